@@ -0,0 +1,59 @@
+# backend/admin_api.py
+from __future__ import annotations
+
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from backend.rag import rag_service
+
+# with a token set, /admin needs `X-Admin-Token: <token>`; without one it only
+# answers requests from this machine
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+router = APIRouter(prefix="/admin")
+
+
+def _authorize(request: Request, token: Optional[str]):
+    if ADMIN_TOKEN:
+        if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+            raise HTTPException(status_code=401, detail="Bad or missing X-Admin-Token.")
+    elif not request.client or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Admin endpoints are local-only unless ADMIN_TOKEN is set.")
+
+
+@router.get("/index")
+async def index_status(request: Request, x_admin_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Live catalog index generation and rebuild progress:
+    {"generation": 3, "items": 120, "index_type": "flat", "built_at": ..., "build_s": 4.2,
+     "rebuild": {"running": true, "phase": "encoding", "done": 512, "total": 1200, ...}}
+    """
+    _authorize(request, x_admin_token)
+    return JSONResponse(await run_in_threadpool(rag_service.index_status))
+
+
+@router.post("/index/rebuild")
+async def index_rebuild(request: Request, x_admin_token: Optional[str] = Header(None)) -> JSONResponse:
+    """Re-embed fashion_items.csv in the background; the current index serves until the swap.
+    202 when started here, 409 when a rebuild is already running (in any worker)."""
+    _authorize(request, x_admin_token)
+    started = await run_in_threadpool(rag_service.rebuild)
+    status = await run_in_threadpool(rag_service.index_status)
+    return JSONResponse({"started": started, **status}, status_code=202 if started else 409)
+
+
+@router.post("/index/attributes")
+async def index_attributes(request: Request, x_admin_token: Optional[str] = Header(None)) -> JSONResponse:
+    """Rebuild the live generation's filter postings, e.g. after ingest_with_agent.py ran.
+    Every worker uses them from its next filtered search; 409 when nothing is published yet."""
+    _authorize(request, x_admin_token)
+    attrs = await run_in_threadpool(rag_service.refresh_attributes)
+    if attrs is None:
+        return JSONResponse({"error": "No catalog index published yet."}, status_code=409)
+    return JSONResponse({"values": {a: len(attrs.values(a)) for a in attrs.fields}})
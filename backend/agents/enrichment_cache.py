@@ -0,0 +1,128 @@
+# backend/agents/enrichment_cache.py
+"""On-disk cache of MoodboardAgent outputs.
+
+Keyed by the normalized description plus prompt version and model name, so
+editing the prompt or switching models never serves stale answers. Entries
+expire after `max_age_s` and the least recently used ones are evicted once
+the table grows past `max_entries`.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_PATH = os.getenv(
+    "MOODBOARD_CACHE_PATH",
+    str(Path(__file__).resolve().parents[2] / ".cache" / "enrichment_cache.sqlite3"),
+)
+MAX_ENTRIES = int(os.getenv("MOODBOARD_CACHE_MAX_ENTRIES", "100000"))
+MAX_AGE_S = float(os.getenv("MOODBOARD_CACHE_MAX_AGE_DAYS", "30")) * 86400
+EVICT_EVERY = 256   # puts between eviction sweeps
+
+
+def normalize_description(description: str) -> str:
+    return " ".join((description or "").split()).casefold()
+
+
+def cache_key(description: str, prompt_version: str, model: str) -> str:
+    raw = f"{prompt_version}\0{model}\0{normalize_description(description)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EnrichmentCache:
+    def __init__(self, path: str | Path = CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 max_age_s: float = MAX_AGE_S):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # opened on first use and again in each forked child (gunicorn --preload):
+        # a sqlite connection must never be shared across fork. Called with _lock held.
+        if self._pid != os.getpid():
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS enrichment ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS enrichment_last_used ON enrichment(last_used)")
+            self._conn, self._pid = db, os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM enrichment WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_s:
+                if row is not None:
+                    self._db.execute("DELETE FROM enrichment WHERE key = ?", (key,))
+                    self.evicted += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE enrichment SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO enrichment (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now))
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        cur = self._db.execute("DELETE FROM enrichment WHERE created < ?", (now - self.max_age_s,))
+        self.evicted += cur.rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM enrichment").fetchone()
+        if count > self.max_entries:
+            cur = self._db.execute(
+                "DELETE FROM enrichment WHERE key IN ("
+                " SELECT key FROM enrichment ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+            self.evicted += cur.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM enrichment").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else None,
+            "evicted": self.evicted,
+        }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_cache() -> EnrichmentCache | None:
+    """Process-wide cache; MOODBOARD_CACHE=off disables it."""
+    global _default
+    if os.getenv("MOODBOARD_CACHE", "on").lower() in {"0", "off", "false", "no"}:
+        return None
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = EnrichmentCache()
+    return _default
@@ -1,44 +1,149 @@
 import os
+import time
+import random
+import asyncio
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Load environment variables
 from pathlib import Path
 load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent.parent / ".env")
 
+try:
+    from backend.agents.enrichment_cache import cache_key, default_cache
+    from backend.openai_config import openai_base_url
+except ImportError:  # run as a script from backend/agents
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from enrichment_cache import cache_key, default_cache
+    from openai_config import openai_base_url
+
+MODEL = os.getenv("MOODBOARD_MODEL", "gpt-4o-mini")
+MAX_RETRIES = int(os.getenv("MOODBOARD_MAX_RETRIES", "6"))
+PROMPT_VERSION = "1"   # bump whenever build_prompt changes, to invalidate cached outputs
+
+def build_prompt(description):
+    return (
+        f"Given the following fashion item description:\n\n'{description}'\n\n"
+        f"Generate structured metadata with the following fields:\n"
+        f"- Category: (1–2 words)\n"
+        f"- Style Tags: (exactly 5 short hashtags)\n"
+        f"- Occasions: (brief list of where/when to wear it)\n"
+        f"- Pairing Suggestions: (short list of items it pairs well with)\n\n"
+        f"Format:\n"
+        f"Category: <text>\n"
+        f"Style Tags: <#tag1 #tag2 #tag3 #tag4 #tag5>\n"
+        f"Occasions: <comma-separated>\n"
+        f"Pairing Suggestions: <comma-separated>\n\n"
+        f"Do not include extra commentary or explanation."
+    )
+
+# answer line label -> field name, matching the catalog CSV columns
+FIELDS = {
+    "category": "category",
+    "style tags": "style_tags",
+    "occasions": "occasions",
+    "pairing suggestions": "pairing_suggestions",
+}
+
+def parse_metadata(text):
+    """Split an answer in build_prompt's format into {category, style_tags, occasions, pairing_suggestions}."""
+    out = {}
+    for line in (text or "").splitlines():
+        label, sep, value = line.partition(":")
+        field = FIELDS.get(label.strip(" -*#").lower())
+        if sep and field and value.strip():
+            out[field] = value.strip()
+    return out
+
+def _retry_after(err, attempt):
+    """Seconds to wait: the server's Retry-After if given, else jittered exponential backoff."""
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    for key, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[key]) * scale
+        except (KeyError, TypeError, ValueError):
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+_USE_DEFAULT = object()
+
 class MoodboardAgent:
-    def run(self, description):
-        print(f"[Agent] Generating metadata for: {description}")
-
-        prompt = (
-            f"Given the following fashion item description:\n\n'{description}'\n\n"
-            f"Generate structured metadata with the following fields:\n"
-            f"- Category: (1–2 words)\n"
-            f"- Style Tags: (exactly 5 short hashtags)\n"
-            f"- Occasions: (brief list of where/when to wear it)\n"
-            f"- Pairing Suggestions: (short list of items it pairs well with)\n\n"
-            f"Format:\n"
-            f"Category: <text>\n"
-            f"Style Tags: <#tag1 #tag2 #tag3 #tag4 #tag5>\n"
-            f"Occasions: <comma-separated>\n"
-            f"Pairing Suggestions: <comma-separated>\n\n"
-            f"Do not include extra commentary or explanation."
-        )
+    def __init__(self, model=MODEL, cache=_USE_DEFAULT):
+        self.model = model
+        self.cache = default_cache() if cache is _USE_DEFAULT else cache
+        self._aclient = None
+        self._cooldown_until = 0.0   # shared by all concurrent arun() calls after a 429
+        self.calls = 0
+        self.retries = 0
 
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+    def _request(self, description):
+        return dict(
+            model=self.model,
+            messages=[{"role": "user", "content": build_prompt(description)}],
             temperature=0.6,
             max_tokens=150
         )
 
+    def _cached(self, description):
+        if self.cache is None:
+            return None, None
+        key = cache_key(description, PROMPT_VERSION, self.model)
+        return key, self.cache.get(key)
+
+    def run(self, description):
+        """Structured metadata text for `description` (see build_prompt); cached when possible."""
+        key, metadata = self._cached(description)
+        if metadata is not None:
+            return metadata
+
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=openai_base_url())
+        response = client.chat.completions.create(**self._request(description))
+        self.calls += 1
+
         metadata = response.choices[0].message.content.strip()
-        print("\n[Agent] Structured Metadata:\n")
-        print(metadata)
+        if key is not None:
+            self.cache.put(key, metadata)
         return metadata
 
+    async def arun(self, description):
+        """Async variant for bulk enrichment; retries rate limits and transient errors.
+
+        OPENAI_BASE_URL points the client at a local stand-in for tests.
+        """
+        # openai is imported on first use: parse_metadata users (rag_service) never need it
+        from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+        retryable = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+        key, metadata = self._cached(description)
+        if metadata is not None:
+            return metadata
+        if self._aclient is None:
+            # retries are handled here so a 429 pauses every in-flight task, not just one
+            self._aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=openai_base_url(),
+                                       max_retries=0)
+        for attempt in range(MAX_RETRIES + 1):
+            wait = self._cooldown_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await self._aclient.chat.completions.create(**self._request(description))
+                self.calls += 1
+                metadata = response.choices[0].message.content.strip()
+                if key is not None:
+                    self.cache.put(key, metadata)
+                return metadata
+            except retryable as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                self.retries += 1
+                delay = _retry_after(e, attempt)
+                if isinstance(e, RateLimitError):
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                else:
+                    await asyncio.sleep(delay)
+
 if __name__ == "__main__":
     desc = input("Enter your product description:\n> ")
     agent = MoodboardAgent()
-    agent.run(desc)
+    print("\n[Agent] Structured Metadata:\n")
+    print(agent.run(desc))
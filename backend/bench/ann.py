@@ -0,0 +1,189 @@
+# backend/bench/ann.py
+"""Recall / latency / memory benchmark for the ann_index kinds.
+
+Ground truth is the exact flat search over the same vectors. By default the
+corpus is synthetic and clustered (uniform random vectors make every ANN
+index look bad); pass --vectors with a saved .npy of real catalog
+embeddings to benchmark the actual distribution.
+
+    python -m backend.bench.ann --n 1000000 --d 512 --kinds flat,ivf,hnsw,ivfpq
+    python -m backend.bench.ann --n 100000 --kinds flat,ivf,hnsw,pq --filter 0.01,0.5   # pq: always exact
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from backend.rag import ann_index
+from backend.rag.ann_index import (KINDS, QUANTIZED, build_index, configure, enable_reconstruct,
+                                   index_kind, search_filtered)
+
+
+def synthetic_vectors(n: int, d: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around `clusters` random centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, d)).astype("float32")
+    out = np.empty((n, d), dtype="float32")
+    step = 65536
+    for s in range(0, n, step):
+        m = min(step, n - s)
+        out[s:s + m] = centres[rng.integers(0, clusters, m)] + \
+            0.6 * rng.standard_normal((m, d)).astype("float32")
+    faiss.normalize_L2(out)
+    return out
+
+
+def split_queries(vecs: np.ndarray, nq: int, seed: int = 1):
+    """Hold out `nq` rows as queries (slightly perturbed so they aren't exact hits)."""
+    rng = np.random.default_rng(seed)
+    pick = rng.choice(len(vecs), size=nq, replace=False)
+    keep = np.ones(len(vecs), dtype=bool)
+    keep[pick] = False
+    queries = vecs[pick] + 0.05 * rng.standard_normal((nq, vecs.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+    return np.ascontiguousarray(vecs[keep]), queries
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def _run(search_fn, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    # single-query latency is what the API sees; batch throughput is reported separately
+    lat = np.empty(len(queries))
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, q in enumerate(queries):
+        t1 = time.perf_counter()
+        _, I = search_fn(q[None, :])
+        lat[i] = time.perf_counter() - t1
+        found[i] = I[0]
+    t1 = time.perf_counter()
+    search_fn(queries)
+    batch_s = time.perf_counter() - t1
+    return {
+        "recall_at_k": round(recall_at_k(found, truth), 4),
+        "latency_ms": {
+            "p50": round(float(np.percentile(lat, 50)) * 1000, 3),
+            "p99": round(float(np.percentile(lat, 99)) * 1000, 3),
+            "mean": round(float(lat.mean()) * 1000, 3),
+        },
+        "batch_qps": round(len(queries) / batch_s, 1) if batch_s > 0 else None,
+    }
+
+
+def bench_filtered(index, base: np.ndarray, queries: np.ndarray, k: int, selectivity: float,
+                   vectors=None, seed: int = 2) -> dict:
+    """Recall/latency of search_filtered for a random filter keeping `selectivity` of the rows.
+
+    `vectors` is the float32 re-scoring copy rag_service passes for quantized kinds.
+    """
+    allowed = np.random.default_rng(seed).random(len(base)) < selectivity
+    ids = np.flatnonzero(allowed)
+    exact = faiss.IndexFlatIP(base.shape[1])
+    exact.add(base[ids])
+    _, pos = exact.search(queries, k)
+    truth = np.where(pos >= 0, ids[pos], -1)
+    strategies = set()
+    def fn(q):
+        D, I, strategy = search_filtered(index, q, k, allowed, vectors=vectors)
+        strategies.add(strategy)
+        return D, I
+    return {"selectivity": selectivity, "allowed": int(len(ids)), "vectors": vectors is not None,
+            **_run(fn, queries, truth, k),
+            "strategy": sorted(strategies)}
+
+
+def bench_kind(kind: str, base: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int,
+               nprobe: int, ef_search: int, rerank: int, filters=()) -> dict:
+    t0 = time.perf_counter()
+    index = build_index(base, kind)
+    build_s = time.perf_counter() - t0
+    configure(index, nprobe=nprobe, ef_search=ef_search)
+    nbytes = int(faiss.serialize_index(index).nbytes)
+
+    out = {
+        "kind": kind,
+        "built_as": index_kind(index),
+        "build_s": round(build_s, 3),
+        **_run(lambda q: index.search(q, k), queries, truth, k),
+        "index_bytes": nbytes,
+        "bytes_per_vector": round(nbytes / len(base), 1),
+        "compression_vs_float32": round(base.nbytes / nbytes, 2),
+    }
+    if index_kind(index) in QUANTIZED and rerank > 1:
+        # the float32 copy stays on disk (memory-mapped); only shortlist rows are touched
+        out["rerank"] = {"factor": rerank, **_run(
+            lambda q: ann_index.search(index, q, k, vectors=base, rerank=rerank), queries, truth, k)}
+    if filters:
+        enable_reconstruct(index)
+        # quantized kinds: with the re-scoring copy (as rag_service searches them) and without
+        out["filtered"] = [bench_filtered(index, base, queries, k, f, vectors=v) for f in filters
+                           for v in ((base, None) if "rerank" in out else (None,))]
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--n", type=int, default=100_000, help="synthetic corpus size")
+    ap.add_argument("--d", type=int, default=512, help="synthetic dimension (CLIP ViT-B/32 = 512)")
+    ap.add_argument("--vectors", help=".npy of real embeddings instead of synthetic data")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--kinds", default=",".join(KINDS))
+    ap.add_argument("--nprobe", type=int, default=ann_index.IVF_NPROBE)
+    ap.add_argument("--ef-search", type=int, default=ann_index.HNSW_EF_SEARCH)
+    ap.add_argument("--rerank", type=int, default=ann_index.RERANK_FACTOR,
+                    help="shortlist factor for re-scoring quantized kinds (<=1 to skip)")
+    ap.add_argument("--filter", default="",
+                    help="comma-separated filter selectivities to benchmark, e.g. 0.001,0.01,0.2")
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args(argv)
+
+    if args.vectors:
+        vecs = np.load(args.vectors).astype("float32")
+        faiss.normalize_L2(vecs)
+    else:
+        vecs = synthetic_vectors(args.n, args.d)
+    base, queries = split_queries(vecs, args.queries)
+    del vecs
+
+    exact = faiss.IndexFlatIP(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+    del exact
+
+    filters = [float(f) for f in args.filter.split(",") if f.strip()]
+    results = []
+    for kind in args.kinds.split(","):
+        r = bench_kind(kind.strip(), base, queries, truth, args.k, args.nprobe, args.ef_search,
+                       args.rerank, filters)
+        results.append(r)
+        print(f"{r['kind']:>6}  recall@{args.k} {r['recall_at_k']:.4f}  "
+              f"p50 {r['latency_ms']['p50']:.3f}ms  p99 {r['latency_ms']['p99']:.3f}ms  "
+              f"{r['bytes_per_vector']:.0f} B/vec ({r['compression_vs_float32']}x)  build {r['build_s']:.1f}s")
+        if "rerank" in r:
+            rr = r["rerank"]
+            print(f"{'':>6}  +rerank x{rr['factor']}: recall@{args.k} {rr['recall_at_k']:.4f}  "
+                  f"p50 {rr['latency_ms']['p50']:.3f}ms  p99 {rr['latency_ms']['p99']:.3f}ms")
+        for fr in r.get("filtered", []):
+            print(f"{'':>6}  filter {fr['selectivity']:g}{' +vectors' if fr['vectors'] else ''} "
+                  f"({'/'.join(fr['strategy'])}): "
+                  f"recall@{args.k} {fr['recall_at_k']:.4f}  p50 {fr['latency_ms']['p50']:.3f}ms  "
+                  f"p99 {fr['latency_ms']['p99']:.3f}ms")
+
+    report = {"n": len(base), "d": base.shape[1], "queries": len(queries), "k": args.k,
+              "nprobe": args.nprobe, "ef_search": args.ef_search, "rerank": args.rerank, "threads": faiss.omp_get_max_threads(),
+              "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
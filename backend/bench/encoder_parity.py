@@ -0,0 +1,172 @@
+# backend/bench/encoder_parity.py
+"""Parity and speed of the encoder backends against fp32 PyTorch.
+
+For each backend (encoders.BACKENDS) it embeds the same catalog texts (and,
+for CLIP, product images) as the torch fp32 reference and reports:
+  cosine       per-item cosine between the backend's and the fp32 vector
+  overlap      top-k neighbour overlap with the fp32 results, for an index
+               rebuilt with the backend ("rebuilt") and for backend queries
+               against an fp32 index that was not rebuilt ("mixed")
+  latency      single-item encode p50/p99 (what a query pays) and batch
+               throughput (what an index build pays), plus model load time
+
+    python -m backend.bench.encoder_parity --model clip-ViT-B-32 --backends int8,onnx,onnx-int8
+    python -m backend.bench.encoder_parity --model sentence-transformers/all-MiniLM-L6-v2 --threads 4
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.rag import rag_service
+from backend.rag.encoders import BACKENDS, ENCODER_THREADS, load_encoder
+from backend.rag.image_search import open_image
+
+IMAGE_DIR = Path(__file__).resolve().parents[1] / "rag" / "images"
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def catalog_texts(n: int) -> list:
+    """The strings rag_service embeds for its text index."""
+    _, rows = rag_service._load_csv()
+    return [f"{rag_service._title(r)}. {r.get('description') or r.get('desc') or ''}".strip()
+            for r in rows[:n]]
+
+
+def catalog_images(image_dir: Path, n: int) -> list:
+    paths = sorted(p for p in image_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTS)[:n]
+    return [open_image(p) for p in paths]
+
+
+def _neighbours(Q: np.ndarray, C: np.ndarray, k: int, same: bool) -> np.ndarray:
+    S = Q @ C.T
+    if same:
+        np.fill_diagonal(S, -np.inf)   # an item is not its own neighbour
+    k = min(k, C.shape[0] - int(same))
+    top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, 1), 1), 1)
+
+
+def _overlap(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean([len(set(x) & set(y)) / len(x) for x, y in zip(a, b)]))
+
+
+def parity(ref: dict, cand: dict, pairs, k: int) -> dict:
+    """Cosine drift per input set and top-k overlap per (query set, corpus set) pair."""
+    out = {}
+    for name in ref:
+        cos = (ref[name] * cand[name]).sum(axis=1)
+        out[f"{name}_cosine"] = {"mean": round(float(cos.mean()), 5), "min": round(float(cos.min()), 5),
+                                 "p1": round(float(np.percentile(cos, 1)), 5)}
+    for q, c in pairs:
+        truth = _neighbours(ref[q], ref[c], k, q == c)
+        out[f"{q}_to_{c}_overlap"] = {
+            "rebuilt": round(_overlap(truth, _neighbours(cand[q], cand[c], k, q == c)), 4),
+            "mixed": round(_overlap(truth, _neighbours(cand[q], ref[c], k, q == c)), 4),
+        }
+    return out
+
+
+def timing(model, inputs: dict, latency_queries: int, batch_size: int) -> tuple:
+    """(normalized embeddings per input set, latency/throughput report)."""
+    embs, report = {}, {}
+    for name, items in inputs.items():
+        for it in items[:3]:
+            model.encode([it], normalize_embeddings=True)   # warm up kernels / sessions
+        lat = []
+        for it in items[:latency_queries]:
+            t0 = time.perf_counter()
+            model.encode([it], normalize_embeddings=True)
+            lat.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        embs[name] = model.encode(items, batch_size=batch_size, convert_to_numpy=True,
+                                  normalize_embeddings=True).astype("float32")
+        batch_s = time.perf_counter() - t0
+        lat = np.array(lat) * 1000.0
+        report[name] = {
+            "single_ms": {"p50": round(float(np.percentile(lat, 50)), 2),
+                          "p99": round(float(np.percentile(lat, 99)), 2)},
+            "batch_items_per_s": round(len(items) / batch_s, 1) if batch_s > 0 else None,
+        }
+    return embs, report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--model", default="clip-ViT-B-32")
+    ap.add_argument("--backends", default=",".join(b for b in BACKENDS if b != "torch"))
+    ap.add_argument("--texts", type=int, default=1000, help="catalog rows to embed")
+    ap.add_argument("--images", type=int, default=500, help="product images to embed (CLIP models only)")
+    ap.add_argument("--image-dir", default=str(IMAGE_DIR))
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--latency-queries", type=int, default=50)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--threads", type=int, default=ENCODER_THREADS, help="intra-op threads (0 = library default)")
+    ap.add_argument("--min-cosine", type=float, default=0.0, help="fail if any backend's mean cosine is below this")
+    ap.add_argument("--min-overlap", type=float, default=0.0,
+                    help="fail if any backend's rebuilt top-k overlap is below this")
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args(argv)
+
+    inputs = {"text": catalog_texts(args.texts)}
+    pairs = [("text", "text")]
+    if "clip" in args.model.lower() and args.images > 0:
+        images = catalog_images(Path(args.image_dir), args.images)
+        if images:
+            inputs["image"] = images
+            # image_search.py (image -> image) and rag_service.image_search (image -> catalog text)
+            pairs += [("image", "image"), ("image", "text")]
+    if not inputs["text"]:
+        sys.exit(f"no catalog rows in {rag_service.CSV_PATH}")
+
+    results = []
+    ref = None
+    for backend in ["torch"] + [b.strip() for b in args.backends.split(",") if b.strip() != "torch"]:
+        t0 = time.perf_counter()
+        model = load_encoder(args.model, backend, threads=args.threads)
+        load_s = time.perf_counter() - t0
+        embs, speed = timing(model, inputs, args.latency_queries, args.batch_size)
+        del model
+        r = {"backend": backend, "load_s": round(load_s, 2), **speed}
+        if ref is None:
+            ref = embs
+        else:
+            r.update(parity(ref, embs, pairs, args.k))
+        results.append(r)
+        line = f"{backend:>9}  load {r['load_s']:.1f}s"
+        for name in inputs:
+            line += (f"  {name}: p50 {r[name]['single_ms']['p50']:.1f}ms "
+                     f"{r[name]['batch_items_per_s']:.0f}/s")
+            if f"{name}_cosine" in r:
+                line += f" cos {r[f'{name}_cosine']['mean']:.4f} (min {r[f'{name}_cosine']['min']:.4f})"
+        for q, c in pairs:
+            if f"{q}_to_{c}_overlap" in r:
+                o = r[f"{q}_to_{c}_overlap"]
+                line += f"  {q}->{c}@{args.k} {o['rebuilt']:.3f}/{o['mixed']:.3f}"
+        print(line)
+
+    failures = []
+    for r in results[1:]:
+        for name in inputs:
+            if r[f"{name}_cosine"]["mean"] < args.min_cosine:
+                failures.append(f"{r['backend']}: {name} cosine {r[f'{name}_cosine']['mean']} < {args.min_cosine}")
+        for q, c in pairs:
+            if r[f"{q}_to_{c}_overlap"]["rebuilt"] < args.min_overlap:
+                failures.append(f"{r['backend']}: {q}->{c} overlap "
+                                f"{r[f'{q}_to_{c}_overlap']['rebuilt']} < {args.min_overlap}")
+    report = {"model": args.model, "texts": len(inputs["text"]), "images": len(inputs.get("image", [])),
+              "k": args.k, "threads": args.threads, "results": results, "failures": failures}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    for f in failures:
+        print(f"FAIL {f}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main()["failures"] else 0)
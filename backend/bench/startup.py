@@ -0,0 +1,175 @@
+# backend/bench/startup.py
+"""Startup-time benchmark: import time per module and time to first served request.
+
+Every measurement runs in a fresh interpreter, so nothing is already in
+sys.modules. Import times come from `python -X importtime`; a module that
+pulls in one of the HEAVY dependencies at import time is reported (and
+fails the run), since those belong behind lazy accessors and lifespan
+warmup. Time to first request starts a uvicorn server per app and polls it
+until the first response (uvicorn only accepts once lifespan warmup is done)
+and then until /ready returns 200. Apps are started in order and kept running,
+so the frontend (whose /ready needs the backend) is pointed at the backend
+started before it.
+
+    python -m backend.bench.startup --repeat 3 --out startup.json
+    python -m backend.bench.startup --no-serve --max-import-ms 800
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+MODULES = (
+    "frontend.main",
+    "backend.rag.server",
+    "backend.image_search_api",
+    "backend.text_search_api",
+    "backend.admin_api",
+    "backend.rag.rag_service",
+    "backend.rag.image_search",
+    "backend.rag.search",
+)
+APPS = ("backend.rag.server:app", "frontend.main:app")
+# imported on first use only; seeing one at import time is a regression
+HEAVY = ("torch", "sentence_transformers", "transformers", "faiss", "chromadb", "openai")
+
+
+def import_profile(module: str, top: int = 8) -> dict:
+    """Import `module` in a fresh interpreter under -X importtime."""
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                       cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{p.stderr[-2000:]}")
+    rows = []   # (self_us, cumulative_us, name)
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cum_us), name.strip()))
+    total_us = next((c for _, c, n in rows if n == module), sum(s for s, _, _ in rows))
+    heavy = sorted({n.split(".")[0] for _, _, n in rows if n.split(".")[0] in HEAVY})
+    # top-level packages by total self time: where the import cost actually goes
+    by_pkg = {}
+    for s, _, n in rows:
+        by_pkg[n.split(".")[0]] = by_pkg.get(n.split(".")[0], 0) + s
+    slowest = sorted(by_pkg.items(), key=lambda kv: -kv[1])[:top]
+    return {"module": module, "import_ms": round(total_us / 1000, 1), "heavy": heavy,
+            "slowest": [{"package": n, "self_ms": round(s / 1000, 1)} for n, s in slowest]}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _status(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code   # a 503 from /ready is still a served request
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def first_request(app: str, env: dict, path: str = "/", timeout_s: float = 300):
+    """Start `uvicorn app`; seconds until the first response on `path`, then until /ready is 200.
+
+    Returns (result, process, base url); the caller stops the process.
+    """
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", app, "--port", str(port),
+                             "--log-level", "warning"], cwd=PROJECT_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    out = {"app": app, "path": path, "first_request_s": None, "ready_s": None}
+    while time.perf_counter() - t0 < timeout_s:
+        if proc.poll() is not None:
+            out["error"] = (proc.stderr.read() or "")[-2000:]
+            return out, proc, base
+        if out["first_request_s"] is None:
+            status = _status(base + path)
+            if status is not None:
+                out["first_request_s"] = round(time.perf_counter() - t0, 3)
+                out["first_status"] = status
+        if out["first_request_s"] is not None and _status(base + "/ready") == 200:
+            out["ready_s"] = round(time.perf_counter() - t0, 3)
+            return out, proc, base
+        time.sleep(0.05)
+    out["error"] = f"not ready after {timeout_s:.0f}s"
+    return out, proc, base
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--modules", default=",".join(MODULES))
+    ap.add_argument("--apps", default=",".join(APPS), help="uvicorn targets to time to first request")
+    ap.add_argument("--repeat", type=int, default=3, help="fresh imports per module (median reported)")
+    ap.add_argument("--no-serve", action="store_true", help="only measure imports")
+    ap.add_argument("--serve-timeout", type=float, default=300)
+    ap.add_argument("--max-import-ms", type=float, default=0,
+                    help="fail if any module's median import time exceeds this (0 = no limit)")
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args(argv)
+
+    imports = []
+    for module in args.modules.split(","):
+        runs = [import_profile(module.strip()) for _ in range(max(1, args.repeat))]
+        r = runs[0]
+        r["import_ms"] = round(statistics.median(x["import_ms"] for x in runs), 1)
+        r["runs_ms"] = [x["import_ms"] for x in runs]
+        imports.append(r)
+        slowest = ", ".join(f"{s['package']} {s['self_ms']:.0f}" for s in r["slowest"][:4])
+        print(f"{r['module']:<28} {r['import_ms']:>8.1f}ms  heavy: {','.join(r['heavy']) or '-'}  ({slowest})")
+
+    serve, procs = [], []
+    env = dict(os.environ)
+    try:
+        for app in ([] if args.no_serve else args.apps.split(",")):
+            s, proc, base = first_request(app.strip(), env, timeout_s=args.serve_timeout)
+            procs.append(proc)
+            serve.append(s)
+            if app.strip().startswith("backend.rag.server:"):
+                env["RAG_API_URL"] = base   # apps started after it proxy to this backend
+            error = (s.get("error") or "").strip().splitlines()
+            print(f"{s['app']:<28} first request {s['first_request_s']}s  ready {s['ready_s']}s"
+                  + (f"  error: {error[-1]}" if error else ""))
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    failures = [f"{r['module']} imports {', '.join(r['heavy'])}" for r in imports if r["heavy"]]
+    if args.max_import_ms:
+        failures += [f"{r['module']} imports in {r['import_ms']}ms > {args.max_import_ms:g}ms"
+                     for r in imports if r["import_ms"] > args.max_import_ms]
+    failures += [f"{s['app']} did not become ready" for s in serve if s["ready_s"] is None]
+
+    report = {"python": sys.version.split()[0], "cpus": os.cpu_count(), "imports": imports,
+              "serve": serve, "failures": failures}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    for f in failures:
+        print(f"FAIL {f}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main()["failures"] else 0)
@@ -0,0 +1,384 @@
+# backend/bench/suite.py
+"""Offline benchmark of the indexing and retrieval hot paths on a synthetic catalog.
+
+For each catalog size N it writes a fresh work directory holding a
+fashion_items.csv with N rows, N random product images and M markdown
+documents. It then measures:
+  image_index   image_index.main: full build throughput and the no-op re-scan
+  ingest        ingest.main into a fresh Chroma store: chunks/s and the no-op re-run
+  rag_build     rag_service catalog index build (load CSV, embed, index, publish)
+  search        single-query p50/p99 of rag_service.text_search and
+                rag_service.image_search, ImageSearchEngine.search and
+                server.retrieve: "cold" with distinct queries and emptied
+                caches, "cached" with the same queries asked again
+  rebuild_search  rag_service.text_search p50/p99 while a catalog rebuild
+                  shares the CLIP encoder with the queries
+
+--stub swaps CLIP and MiniLM for a deterministic hashing encoder (no
+weights, no downloads), so the suite runs anywhere and measures everything
+except model time. --stub-item-ms adds a per-item encode cost (a sleep,
+which releases the GIL like torch does); rebuild_search needs it to show
+contention. Without --stub the real models come from encoders.get_encoder
+(ENCODER_BACKEND) and must already be in the local cache: nothing is
+downloaded. The JSON report records the commit, so runs can be diffed
+across commits.
+
+    python -m backend.bench.suite --stub --sizes 1000,10000 --out suite.json
+    python -m backend.bench.suite --stub --stub-item-ms 2 --sizes 5000   # query p99 during a rebuild
+    python -m backend.bench.suite --sizes 500 --docs 50 --queries 50
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from io import BytesIO
+from pathlib import Path
+
+# fully offline: no model downloads, no Chroma telemetry (read when these modules import)
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from backend.rag import image_index, image_search, ingest, rag_service, server
+from backend.rag.ann_index import INDEX_TYPE
+from backend.rag.encoders import ENCODER_BACKEND, register_encoder, registry_stats
+from backend.rag.image_search import ImageSearchEngine
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+CLIP_DIM, TEXT_DIM = 512, 384
+
+COLORS = ("black", "white", "red", "navy", "camel", "olive", "cream", "burgundy",
+          "grey", "pink", "mustard", "teal")
+MATERIALS = ("linen", "wool", "silk", "denim", "leather", "cotton", "velvet", "cashmere",
+             "satin", "tweed")
+CATEGORIES = ("dress", "blazer", "skirt", "coat", "trousers", "shirt", "sweater", "jacket",
+              "jumpsuit", "cardigan", "boots", "bag")
+STYLES = ("minimal", "vintage", "boho", "preppy", "streetwear", "classic", "romantic", "edgy")
+OCCASIONS = ("office", "wedding", "brunch", "date night", "festival", "travel", "party", "weekend")
+FILLER = ("tailored", "relaxed", "cropped", "oversized", "fitted", "lined", "pleated", "belted",
+          "structured", "soft", "layered", "textured", "seasonal", "versatile", "timeless")
+
+
+class StubEncoder:
+    """Deterministic stand-in for a sentence-transformers model.
+
+    Texts are the sum of a fixed random vector per word, so shared words mean
+    nearby vectors; images are a fixed random projection of an 8x8 thumbnail.
+    `item_ms` sleeps that long per item, standing in for model time.
+    """
+
+    def __init__(self, dim: int, seed: int = 0, item_ms: float = 0.0):
+        self.dim = dim
+        self.item_ms = item_ms
+        self._proj = np.random.default_rng(seed).standard_normal((8 * 8 * 3, dim)).astype("float32")
+        self._words = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _word(self, w: str) -> np.ndarray:
+        v = self._words.get(w)
+        if v is None:
+            v = self._words[w] = np.random.default_rng(zlib.crc32(w.encode())).standard_normal(
+                self.dim).astype("float32")
+        return v
+
+    def _one(self, x) -> np.ndarray:
+        if isinstance(x, str):
+            return np.sum([self._word(w) for w in re.findall(r"\w+", x.lower()) or [""]], axis=0)
+        pixels = np.asarray(x.convert("RGB").resize((8, 8)), dtype="float32").reshape(-1)
+        return (pixels / 255.0 - 0.5) @ self._proj
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = not isinstance(sentences, (list, tuple))
+        items = [sentences] if single else sentences
+        if self.item_ms:
+            time.sleep(self.item_ms * len(items) / 1000.0)
+        out = np.vstack([self._one(x) for x in items]).astype("float32") if items else \
+            np.zeros((0, self.dim), dtype="float32")
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+
+def install_stub(item_ms: float = 0.0):
+    """Serve every CLIP and MiniLM model the pipelines ask for from StubEncoder."""
+    for name in {image_index.MODEL_NAME, image_search.MODEL_NAME, "clip-ViT-B-32"}:
+        register_encoder(name, StubEncoder(CLIP_DIM, item_ms=item_ms))
+    for name in {ingest.EMBED_TEXT_MODEL, server.EMBED_TEXT_MODEL}:
+        register_encoder(name, StubEncoder(TEXT_DIM, item_ms=item_ms))
+
+
+# ---- synthetic catalog ----
+def _product(rng: random.Random, i: int) -> dict:
+    color, material, cat = rng.choice(COLORS), rng.choice(MATERIALS), rng.choice(CATEGORIES)
+    style, occasion = rng.choice(STYLES), rng.choice(OCCASIONS)
+    return {
+        "id": str(i),
+        "name": f"{color.title()} {material.title()} {cat.title()} {i}",
+        "description": f"A {' '.join(rng.sample(FILLER, 3))} {material} {cat} in {color}, "
+                       f"{style} and easy to wear for {occasion}.",
+        "category": cat,
+        "style_tags": ",".join(f"#{t}" for t in {style, color, rng.choice(STYLES)}),
+        "occasions": ",".join({occasion, rng.choice(OCCASIONS)}),
+        "pairing_suggestions": f"{rng.choice(COLORS)} {rng.choice(CATEGORIES)}",
+    }
+
+
+def product_image(rng: random.Random, size: int = 256) -> bytes:
+    """A JPEG of a few coloured shapes on a flat background, roughly product-shot sized."""
+    img = Image.new("RGB", (size, size), tuple(rng.randrange(160, 256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(2, 5)):
+        x0, y0 = rng.randrange(size // 2), rng.randrange(size // 2)
+        box = (x0, y0, x0 + rng.randrange(size // 4, size // 2), y0 + rng.randrange(size // 4, size // 2))
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=fill)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _document(rng: random.Random, i: int, paragraphs: int = 8) -> str:
+    out = [f"# Style guide {i}: {rng.choice(STYLES)} {rng.choice(CATEGORIES)}s"]
+    for _ in range(paragraphs):
+        out.append(" ".join(
+            f"Pair a {rng.choice(COLORS)} {rng.choice(MATERIALS)} {rng.choice(CATEGORIES)} with "
+            f"{rng.choice(FILLER)} {rng.choice(CATEGORIES)}s for {rng.choice(OCCASIONS)}."
+            for _ in range(rng.randint(3, 6))))
+    return "\n\n".join(out) + "\n"
+
+
+def generate_catalog(root: Path, n: int, docs: int, seed: int = 0) -> dict:
+    """fashion_items.csv, images/ and docs/ under `root`; returns their paths."""
+    import csv
+    rng = random.Random(seed)
+    paths = {"csv": root / "fashion_items.csv", "images": root / "images", "docs": root / "docs",
+             "img_index": root / "img_index", "rag_index": root / "rag_index", "vectordb": root / "vectordb"}
+    for key in ("images", "docs", "rag_index"):
+        paths[key].mkdir(parents=True, exist_ok=True)
+    rows = [_product(rng, i) for i in range(n)]
+    with open(paths["csv"], "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+    for i in range(n):
+        (paths["images"] / f"item_{i:06d}.jpg").write_bytes(product_image(rng))
+    for i in range(docs):
+        (paths["docs"] / f"guide_{i:05d}.md").write_text(_document(rng, i), encoding="utf-8")
+    return paths
+
+
+def text_queries(n: int, seed: int = 1) -> list:
+    """`n` distinct shopper queries (distinct, so none is answered from a cache)."""
+    rng = random.Random(seed)
+    seen = []
+    while len(seen) < n:
+        q = f"{rng.choice(COLORS)} {rng.choice(MATERIALS)} {rng.choice(CATEGORIES)} for {rng.choice(OCCASIONS)}"
+        if q not in seen:
+            seen.append(q)
+    return seen
+
+
+# ---- measurements ----
+def _summary(lat_s: list) -> dict:
+    lat = np.array(lat_s) * 1000.0
+    return {"p50_ms": round(float(np.percentile(lat, 50)), 3), "p99_ms": round(float(np.percentile(lat, 99)), 3),
+            "mean_ms": round(float(lat.mean()), 3)}
+
+
+def latency(fn, inputs) -> tuple:
+    """({p50_ms, p99_ms, mean_ms}, number of inputs that returned nothing) for one call per input."""
+    lat, empty = [], 0
+    for x in inputs:
+        t0 = time.perf_counter()
+        res = fn(x)
+        lat.append(time.perf_counter() - t0)
+        empty += not res
+    return _summary(lat), empty
+
+
+def bench_image_index(paths: dict) -> dict:
+    r = image_index.main(full=True, img_dir=str(paths["images"]), out_dir=str(paths["img_index"]))
+    t0 = time.perf_counter()
+    image_index.main(img_dir=str(paths["images"]), out_dir=str(paths["img_index"]))   # nothing changed
+    return {**r, "noop_s": round(time.perf_counter() - t0, 3)}
+
+
+def bench_ingest(paths: dict) -> dict:
+    ingest.DATA_DIR, ingest.VDB_DIR = str(paths["docs"]), str(paths["vectordb"])
+    stats = ingest.main()
+    t0 = time.perf_counter()
+    ingest.main()   # every file unchanged
+    noop_s = time.perf_counter() - t0
+    return {"files": stats.changed, "chunks": stats.embedded, "failed": len(stats.failed),
+            "wall_s": round(stats.wall_s, 3),
+            "chunks_per_s": round(stats.embedded / stats.wall_s, 1) if stats.wall_s else None,
+            "embed_chunks_per_s": round(stats.embedded / stats.embed_s, 1) if stats.embed_s else None,
+            "noop_s": round(noop_s, 3)}
+
+
+def bench_rag_build(paths: dict) -> dict:
+    r = rag_service
+    r.CSV_PATH, r.INDEX_DIR = paths["csv"], paths["rag_index"]
+    r.MANIFEST_FILE, r.REBUILD_FILE = r.INDEX_DIR / "manifest.json", r.INDEX_DIR / "rebuild.json"
+    r.VDB_DIR = paths["vectordb"]
+    r.AUTO_REBUILD = False   # the suite decides when to build
+    t0 = time.perf_counter()
+    r._run_rebuild()   # what rebuild() runs in its background thread
+    wall_s = time.perf_counter() - t0
+    if r._rebuild["phase"] != "done":
+        raise RuntimeError(f"rag_service build failed: {r._rebuild.get('error')}")
+    items = r._live.index.ntotal
+    return {"items": items, "build_s": round(wall_s, 3), "items_per_s": round(items / wall_s, 1)}
+
+
+def bench_search(paths: dict, queries: list, images: list, k: int) -> tuple:
+    """Latency per search surface; also the surfaces that returned nothing for some query."""
+    rag_service._emb_cache.clear()
+    rag_service._results_cache.clear()
+    server.VDB_DIR, server._coll = str(paths["vectordb"]), None
+    server._chroma_db = paths["vectordb"] / "chroma.sqlite3"
+    server.emb_cache.clear()
+    server.results_cache.clear()
+    t0 = time.perf_counter()
+    engine = ImageSearchEngine(index_dir=paths["img_index"], model_name=image_index.MODEL_NAME)
+    engine_open_s = time.perf_counter() - t0
+
+    surfaces = {
+        "rag_service.text_search": (lambda q: rag_service.text_search(q, k), queries),
+        "rag_service.image_search": (lambda b: rag_service.image_search(b, k), images),
+        "image_search.search": (lambda b: engine.search(b, top_k=k), images),
+        "server.retrieve": (lambda q: server.retrieve(q, k), queries),
+    }
+    out, empty = {}, []
+    for name, (fn, inputs) in surfaces.items():
+        fn(inputs[0] + " warmup" if isinstance(inputs[0], str) else product_image(random.Random(-1)))
+        cold, n_empty = latency(fn, inputs)
+        cached, _ = latency(fn, inputs)
+        out[name] = {"cold": cold, "cached": cached}
+        if n_empty:
+            empty.append(f"{name}: {n_empty}/{len(inputs)} queries returned nothing")
+    out["image_search.search"]["engine_open_s"] = round(engine_open_s, 3)
+    return out, empty
+
+
+def bench_rebuild_search(queries: list, k: int) -> dict:
+    """Cold text_search latency while rebuild() re-embeds the catalog in its background thread."""
+    rag_service._emb_cache.clear()
+    rag_service._results_cache.clear()
+    if not rag_service.rebuild():
+        raise RuntimeError("a catalog rebuild is already running")
+    lat = []
+    for q in queries:
+        if not rag_service._rebuild["running"]:
+            break
+        t0 = time.perf_counter()
+        rag_service.text_search(q, k)
+        lat.append(time.perf_counter() - t0)
+    while rag_service._rebuild["running"]:
+        time.sleep(0.01)
+    if rag_service._rebuild["phase"] != "done":
+        raise RuntimeError(f"rag_service rebuild failed: {rag_service._rebuild.get('error')}")
+    out = {"queries": len(lat), "build_s": rag_service._rebuild["build_s"]}
+    if lat:
+        out.update(_summary(lat))
+    return out
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="1000,5000", help="catalog sizes N (CSV rows and product images)")
+    ap.add_argument("--docs", type=int, default=100, help="markdown documents M ingested into Chroma")
+    ap.add_argument("--queries", type=int, default=200, help="distinct queries per search surface")
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--stub", action="store_true", help="deterministic hashing encoders instead of CLIP/MiniLM")
+    ap.add_argument("--stub-item-ms", type=float, default=0.0, help="simulated encode time per item with --stub")
+    ap.add_argument("--work-dir", help="where catalogs are generated (default: a temp dir, removed afterwards)")
+    ap.add_argument("--keep", action="store_true", help="keep the generated catalogs and indexes")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="also write the JSON report here")
+    args = ap.parse_args(argv)
+
+    if args.stub:
+        install_stub(args.stub_item_ms)
+    work = Path(args.work_dir or tempfile.mkdtemp(prefix="vintell-bench-")).resolve()
+    queries = text_queries(args.queries, seed=args.seed + 1)
+    qrng = random.Random(args.seed + 2)
+    images = [product_image(qrng) for _ in range(args.queries)]   # not in any catalog
+    rebuild_queries = text_queries(args.queries, seed=args.seed + 3)
+
+    results, failures = [], []
+    try:
+        for n in (int(s) for s in args.sizes.split(",")):
+            root = work / f"n{n}"
+            shutil.rmtree(root, ignore_errors=True)
+            t0 = time.perf_counter()
+            paths = generate_catalog(root, n, args.docs, seed=args.seed)
+            r = {"n": n, "docs": args.docs, "generate_s": round(time.perf_counter() - t0, 3)}
+            for stage, fn in (("image_index", lambda: bench_image_index(paths)),
+                              ("ingest", lambda: bench_ingest(paths)),
+                              ("rag_build", lambda: bench_rag_build(paths)),
+                              ("search", lambda: bench_search(paths, queries, images, args.k)),
+                              ("rebuild_search", lambda: bench_rebuild_search(rebuild_queries, args.k))):
+                try:
+                    r[stage] = fn()
+                except Exception as e:
+                    failures.append(f"n={n} {stage}: {type(e).__name__}: {e}")
+                    r[stage] = None
+            if r["search"] is not None:
+                r["search"], empty = r["search"]
+                failures += [f"n={n} {e}" for e in empty]
+            results.append(r)
+
+            line = f"n={n:<7}"
+            if r["image_index"]:
+                line += f" image_index {r['image_index']['images_per_s']['end_to_end']}/s"
+            if r["ingest"]:
+                line += f"  ingest {r['ingest']['chunks_per_s']} chunks/s"
+            if r["rag_build"]:
+                line += f"  rag_build {r['rag_build']['build_s']}s"
+            print(line)
+            for name, s in (r["search"] or {}).items():
+                print(f"    {name:<26} cold p50 {s['cold']['p50_ms']:.2f}ms p99 {s['cold']['p99_ms']:.2f}ms"
+                      f"  cached p50 {s['cached']['p50_ms']:.3f}ms")
+            rs = r["rebuild_search"]
+            if rs and rs["queries"]:
+                print(f"    {'text_search during rebuild':<26} p50 {rs['p50_ms']:.2f}ms p99 {rs['p99_ms']:.2f}ms"
+                      f"  ({rs['queries']} queries, build {rs['build_s']}s)")
+    finally:
+        if not (args.keep or args.work_dir):
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"commit": _commit(), "python": sys.version.split()[0], "cpus": os.cpu_count(),
+              "stub": args.stub, "encoder_backend": ENCODER_BACKEND, "index_type": INDEX_TYPE,
+              "queries": args.queries, "k": args.k, "results": results,
+              "encoders": registry_stats(), "failures": failures}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    for f in failures:
+        print(f"FAIL {f}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main()["failures"] else 0)
@@ -1,17 +1,25 @@
 
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Load .env file
 from pathlib import Path
 load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent.parent / ".env")
 
-# Create OpenAI client from environment variable
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from backend.openai_config import openai_base_url
+
+# OpenAI client from environment variable, created on first use
+_client = None
+
+def client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=openai_base_url())
+    return _client
 
 def suggest_fashion_items(prompt):
-    response = client.chat.completions.create(
+    response = client().chat.completions.create(
         model="gpt-4o-mini",  # or "gpt-3.5-turbo" if you want cheaper
         messages=[
             {"role": "system", "content": "You are a personal stylist and fashion assistant."},
@@ -1,16 +1,20 @@
 # backend/image_search_api.py
 from __future__ import annotations
 
+import json
 import os
-import shutil
+import threading
+import time
 from pathlib import Path
 from typing import List, Dict, Any
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 
-# import your FAISS search from the new location
-from backend.rag.image_search import search as vector_search
+# resident FAISS/CLIP engine (loaded once per process, shared by all requests)
+from backend.rag.image_search import engine as image_engine, content_key
+from backend.rag.index_files import atomic_write_bytes
 
 # -----------------------------
 # Config (override with env vars)
@@ -21,10 +25,21 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 PUBLIC_IMAGES_DIR = Path(os.getenv("PUBLIC_IMAGES_DIR", PROJECT_ROOT / "rag" / "images"))
 STATIC_URL_PREFIX = os.getenv("STATIC_URL_PREFIX", "/images/")
 
-UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", PROJECT_ROOT.parent / "uploads"))
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", PROJECT_ROOT / "uploads"))   # served by frontend/main.py
 UPLOAD_URL_PREFIX = os.getenv("UPLOAD_URL_PREFIX", "/uploads/")
+# query images are searched from memory; keeping a copy is optional and happens
+# after the response, named by content hash so repeats are stored once
+UPLOAD_PERSIST = os.getenv("UPLOAD_PERSIST", "1") == "1"
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+UPLOAD_PRUNE_INTERVAL_S = float(os.getenv("UPLOAD_PRUNE_INTERVAL_S", "600"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
 
 
+# /image-search/batch: images per CLIP encode + index.search, and per request
+BATCH_CHUNK = int(os.getenv("IMAGE_SEARCH_BATCH_CHUNK", "64"))
+BATCH_MAX_FILES = int(os.getenv("IMAGE_SEARCH_BATCH_MAX_FILES", "1000"))
+
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 router = APIRouter()
@@ -66,34 +81,86 @@ def _to_web_url(path: str | Path) -> str:
     # fallback: just return filename under /images/
     return (STATIC_URL_PREFIX.rstrip("/") + "/" + abs_p.name).replace("//", "/")
 
-def _save_upload(file: UploadFile) -> Path:
-    """Save uploaded query image."""
+async def _read_upload(file: UploadFile) -> bytes:
+    """Uploaded query image bytes (kept in memory, never re-read from disk)."""
     if not file or not file.filename:
         raise HTTPException(status_code=400, detail="No file provided.")
-    suffix = os.path.splitext(file.filename)[1] or ".png"
-    dest = (UPLOAD_DIR / f"query_{os.getpid()}_{file.filename}").with_suffix(suffix)
-    with dest.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return dest
+    data = await file.read(UPLOAD_MAX_BYTES + 1)
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty file.")
+    if len(data) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Images up to {UPLOAD_MAX_BYTES} bytes.")
+    return data
+
+def _upload_name(data: bytes, filename: str) -> str:
+    suffix = os.path.splitext(filename or "")[1].lower()
+    return f"query_{content_key(data)[:32]}{suffix if suffix in IMAGE_SUFFIXES else '.img'}"
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+def _prune_uploads(now: float):
+    """Delete stored query images not used for UPLOAD_RETENTION_HOURS (at most every UPLOAD_PRUNE_INTERVAL_S)."""
+    global _last_prune
+    if UPLOAD_RETENTION_HOURS <= 0 or not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        if now - _last_prune < UPLOAD_PRUNE_INTERVAL_S:
+            return
+        _last_prune = now
+        cutoff = now - UPLOAD_RETENTION_HOURS * 3600
+        for p in UPLOAD_DIR.iterdir():
+            try:
+                if p.is_file() and p.stat().st_mtime < cutoff:
+                    p.unlink()
+            except OSError:
+                pass   # raced with another worker
+    finally:
+        _prune_lock.release()
+
+def _persist_upload(data: bytes, name: str):
+    """Background task: store the query image once; repeats only refresh its mtime."""
+    dest = UPLOAD_DIR / name
+    now = time.time()
+    try:
+        os.utime(dest, (now, now))
+    except FileNotFoundError:
+        atomic_write_bytes(dest, data)
+    _prune_uploads(now)
 
 @router.post("/image-search")
-async def image_search_endpoint(image_file: UploadFile = File(...), top_k: int = 8) -> JSONResponse:
+async def image_search_endpoint(background: BackgroundTasks, image_file: UploadFile = File(...),
+                                top_k: int = 8) -> JSONResponse:
     """
     Accepts an image upload, runs similarity search, returns JSON:
     {
-      "query_image_url": "/uploads/query_xxx.png",
+      "query_image_url": "/uploads/query_xxx.png",   (null with UPLOAD_PERSIST=0)
       "results": [
         {"image_url": "/images/item1.jpg", "name": "item1", "score": 0.93},
         ...
       ]
     }
     """
-    saved = _save_upload(image_file)
+    data = await _read_upload(image_file)
     try:
-        raw_results = vector_search(str(saved), top_k=top_k)
+        [raw_results] = await run_in_threadpool(image_engine().search_batch, [data], top_k, True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {e}")
+    if isinstance(raw_results, Exception):
+        raise HTTPException(status_code=400, detail=f"Not a readable image: {raw_results}")
+
+    query_url = None
+    if UPLOAD_PERSIST:
+        name = _upload_name(data, image_file.filename)
+        background.add_task(_persist_upload, data, name)
+        query_url = UPLOAD_URL_PREFIX.rstrip("/") + "/" + name
+    payload = {
+        "query_image_url": query_url,
+        "results": _normalize(raw_results)
+    }
+    return JSONResponse(payload)
 
+def _normalize(raw_results) -> List[Dict[str, Any]]:
     normalized: List[Dict[str, Any]] = []
     for r in raw_results:
         path = r.get("path") or r.get("image_path") or r.get("image") or ""
@@ -104,9 +171,49 @@ async def image_search_endpoint(image_file: UploadFile = File(...), top_k: int =
             "name": name,
             "score": float(r.get("score", 0.0))
         })
+    return normalized
 
-    payload = {
-        "query_image_url": (UPLOAD_URL_PREFIX.rstrip("/") + "/" + saved.name),
-        "results": normalized
-    }
-    return JSONResponse(payload)
+@router.post("/image-search/batch")
+async def image_search_batch_endpoint(image_files: List[UploadFile] = File(...), top_k: int = 8) -> StreamingResponse:
+    """
+    Similarity search for many uploaded images (nothing is written to disk).
+    Streams one NDJSON line per image, in upload order:
+    {"index": 0, "filename": "a.jpg", "results": [{"image_url": ..., "name": ..., "score": ...}]}
+    {"index": 1, "filename": "b.txt", "error": "UnidentifiedImageError: ..."}
+    """
+    if len(image_files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} images per request.")
+    # the uploads are closed once this handler returns, before the body streams
+    names = [f.filename for f in image_files]
+    blobs = []
+    for f in image_files:
+        # same cap as a single upload; an empty or undecodable file gets an "error" line
+        data = await f.read(UPLOAD_MAX_BYTES + 1)
+        if len(data) > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"{f.filename}: images up to {UPLOAD_MAX_BYTES} bytes.")
+        blobs.append(data)
+
+    async def lines():
+        for start in range(0, len(blobs), BATCH_CHUNK):
+            chunk = blobs[start:start + BATCH_CHUNK]
+            try:
+                results = await run_in_threadpool(image_engine().search_batch, chunk, top_k, True)
+            except Exception as e:
+                results = [e] * len(chunk)
+            for i, res in enumerate(results, start):
+                line = {"index": i, "filename": names[i]}
+                if isinstance(res, Exception):
+                    line["error"] = f"{type(res).__name__}: {res}"
+                else:
+                    line["results"] = _normalize(res)
+                yield (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/image-search/stats")
+async def image_search_stats() -> JSONResponse:
+    """Cold-start and warm per-query timings of the resident engine."""
+    try:
+        return JSONResponse(image_engine().stats())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
@@ -0,0 +1,14 @@
+# backend/openai_config.py
+"""OpenAI client settings shared by every module that calls the API."""
+import os
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+def openai_base_url() -> str:
+    """OPENAI_BASE_URL, e.g. a local stand-in for tests; the public endpoint when unset.
+
+    Empty counts as unset: .env.example ships it blank, and the SDK would
+    take "" as the URL. Read when a client is built, after load_dotenv.
+    """
+    return os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL
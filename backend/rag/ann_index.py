@@ -0,0 +1,393 @@
+# backend/rag/ann_index.py
+"""FAISS index factory shared by the text (rag_service) and image indexes.
+
+RAG_INDEX_TYPE picks the structure:
+  flat   exact inner-product scan (default; best for small catalogs)
+  ivf    IVF-Flat, coarse k-means partitions, `nprobe` lists scanned per query
+  hnsw   HNSW graph over full vectors
+  ivfpq  IVF with product-quantized codes (smallest memory, approximate scores)
+  fp16   exact scan over float16 codes (2x smaller)
+  sq8    exact scan over int8 scalar-quantized codes (4x smaller)
+  pq     exact scan over product-quantized codes (d/RAG_PQ_M x smaller)
+
+Trained state (k-means centroids, PQ codebooks) is part of the index and
+is persisted by faiss.write_index. Search-time knobs (nprobe, efSearch) are
+re-applied by `configure` after loading.
+
+Indexes are loaded memory-mapped and read-only where faiss supports it, so
+every worker process shares one page-cache copy. For the quantized kinds the
+full-precision vectors can be kept next to the index as a float32 .npy that
+is also memory-mapped; `search` over-fetches a shortlist from the compact
+codes and re-scores it exactly against those vectors.
+"""
+from __future__ import annotations
+import io
+import math
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+try:
+    from backend.rag.index_files import atomic_write_bytes
+except ImportError:  # run as a script from backend/rag
+    from index_files import atomic_write_bytes
+
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat").lower()
+IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))          # 0 = auto, ~4*sqrt(n)
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+HNSW_FILTER_EF_MAX = int(os.getenv("RAG_HNSW_FILTER_EF_MAX", "1024"))
+PQ_M = int(os.getenv("RAG_PQ_M", "0"))                     # 0 = auto, d/8 sub-quantizers
+PQ_NBITS = 8
+RERANK_FACTOR = int(os.getenv("RAG_RERANK_FACTOR", "4"))   # shortlist = k * factor; <=1 disables
+MMAP = os.getenv("RAG_INDEX_MMAP", "1") != "0"
+# filtered search scores the allowed rows exactly when there are at most
+# FILTER_EXACT_MAX of them or they are under FILTER_EXACT_FRACTION of the index
+FILTER_EXACT_MAX = int(os.getenv("RAG_FILTER_EXACT_MAX", "20000"))
+FILTER_EXACT_FRACTION = float(os.getenv("RAG_FILTER_EXACT_FRACTION", "0.02"))
+KINDS = ("flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "pq")
+QUANTIZED = {"ivfpq", "fp16", "sq8", "pq"}
+MIN_POINTS_PER_LIST = 39                                   # faiss k-means minimum
+
+
+def auto_nlist(n: int) -> int:
+    if IVF_NLIST > 0:
+        return IVF_NLIST
+    return max(1, min(int(4 * math.sqrt(max(n, 1))), n // MIN_POINTS_PER_LIST))
+
+
+def _pq_m(d: int) -> int:
+    m = PQ_M or max(1, d // 8)
+    while d % m:          # sub-quantizers must divide the dimension
+        m -= 1
+    return m
+
+
+def new_index(d: int, kind: str = INDEX_TYPE, n_expected: int = 0) -> faiss.Index:
+    """Empty (possibly untrained) inner-product index of the given kind."""
+    kind = kind.lower()
+    if kind not in KINDS:
+        raise ValueError(f"Unknown RAG_INDEX_TYPE {kind!r}; expected one of {', '.join(KINDS)}")
+    if kind == "flat":
+        return faiss.IndexFlatIP(d)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    if kind in ("fp16", "sq8"):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if kind == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        return faiss.IndexScalarQuantizer(d, qtype, faiss.METRIC_INNER_PRODUCT)
+    if kind == "pq":
+        return faiss.IndexPQ(d, _pq_m(d), PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    nlist = auto_nlist(n_expected)
+    quantizer = faiss.IndexFlatIP(d)
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    return faiss.IndexIVFPQ(quantizer, d, nlist, _pq_m(d), PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+
+
+def train_size(index: faiss.Index) -> int:
+    """Training points needed before `index` can be trained (0 if none)."""
+    if index.is_trained:
+        return 0
+    need = 1                     # scalar quantizers only need value ranges
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        need = base.nlist * MIN_POINTS_PER_LIST
+    if isinstance(base, (faiss.IndexIVFPQ, faiss.IndexPQ)):
+        need = max(need, (1 << PQ_NBITS) * MIN_POINTS_PER_LIST)
+    return need
+
+
+def trainable(kind: str, d: int, n: int) -> bool:
+    """Whether `n` vectors of dimension `d` can train `kind` (IndexBuilder falls back to flat below that)."""
+    return n >= train_size(new_index(d, kind, n))
+
+
+def _base(index: faiss.Index) -> faiss.Index:
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index: faiss.Index) -> str:
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexPQ):
+        return "pq"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """HNSW graphs can't delete nodes; everything else built here can."""
+    return index_kind(index) != "hnsw"
+
+
+def configure(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """Apply search-time parameters; call after building or loading."""
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = max(1, min(nprobe, base.nlist))
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
+
+
+class IndexBuilder:
+    """Streams vectors into a new index of `kind`, buffering only the training sample.
+
+    With `with_ids`, vectors are added under caller-supplied int64 ids (IVF
+    stores ids natively; flat/HNSW are wrapped in IndexIDMap2). A catalog
+    too small to train the requested kind falls back to a flat index.
+    """
+
+    def __init__(self, kind: str = INDEX_TYPE, n_expected: int = 0, with_ids: bool = False):
+        self.kind = kind.lower()
+        self.n_expected = n_expected
+        self.with_ids = with_ids
+        self.index = None
+        self._pending = []        # (vecs, ids) waiting for training
+
+    def _create(self, d: int, kind: str):
+        index = new_index(d, kind, self.n_expected)
+        if self.with_ids and not isinstance(index, faiss.IndexIVF):
+            index = faiss.IndexIDMap2(index)
+        return index
+
+    def _add(self, vecs, ids):
+        if self.with_ids:
+            self.index.add_with_ids(vecs, ids)
+        else:
+            self.index.add(vecs)
+
+    def add(self, vecs: np.ndarray, ids=None):
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        if self.index is None:
+            self.index = self._create(vecs.shape[1], self.kind)
+        if self.index.is_trained:
+            self._add(vecs, ids)
+            return
+        self._pending.append((vecs, ids))
+        if sum(len(v) for v, _ in self._pending) >= train_size(self.index):
+            self._train_and_flush()
+
+    def _train_and_flush(self):
+        sample = np.vstack([v for v, _ in self._pending])
+        if len(sample) < train_size(self.index):
+            print(f"[ann_index] {len(sample)} vectors is too few to train {self.kind!r}; using flat")
+            self.index = self._create(sample.shape[1], "flat")
+        else:
+            self.index.train(sample)
+        pending, self._pending = self._pending, []
+        for vecs, ids in pending:
+            self._add(vecs, ids)
+
+    def finish(self) -> faiss.Index | None:
+        if self._pending:
+            self._train_and_flush()
+        return configure(self.index) if self.index is not None else None
+
+
+def build_index(vecs: np.ndarray, kind: str = INDEX_TYPE, ids=None) -> faiss.Index:
+    """Index over an in-memory matrix (positional ids unless `ids` is given)."""
+    builder = IndexBuilder(kind, n_expected=len(vecs), with_ids=ids is not None)
+    builder.add(vecs, None if ids is None else np.asarray(ids, dtype="int64"))
+    return builder.finish()
+
+
+def read_index(path, mmap: bool = MMAP) -> faiss.Index:
+    """Load an index; with `mmap`, map its codes read-only instead of copying them.
+
+    A mapped index can't be modified, so writers (image_index) pass mmap=False.
+    """
+    if mmap:
+        # IO_FLAG_MMAP_IFC maps flat/SQ/PQ/HNSW storage zero-copy; older faiss
+        # builds only have IO_FLAG_MMAP (IVF lists)
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return configure(faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY))
+        except RuntimeError:
+            pass          # this index type can't be mapped; fall back to a heap copy
+    return configure(faiss.read_index(str(path)))
+
+
+def needs_vectors(kind: str) -> bool:
+    """Whether full-precision vectors should be kept for re-scoring `kind`."""
+    return kind in QUANTIZED and RERANK_FACTOR > 1
+
+
+def save_vectors(path, vecs: np.ndarray):
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(vecs, dtype="float32"))
+    atomic_write_bytes(path, buf.getvalue())
+
+
+def load_vectors(path, rows: int | None = None):
+    """Memory-mapped float32 vectors, or None if missing (or not `rows` long)."""
+    if not Path(path).exists():
+        return None
+    vecs = np.load(str(path), mmap_mode="r")
+    if rows is not None and len(vecs) < rows:
+        return None
+    return vecs
+
+
+def search(index: faiss.Index, q: np.ndarray, k: int, vectors=None, row_of=None,
+           rerank: int = RERANK_FACTOR, params=None):
+    """`index.search`, re-scored with full-precision `vectors` for quantized kinds.
+
+    `row_of` maps an array of FAISS ids to rows of `vectors` (-1 = unknown);
+    without it the id is the row. Returns (D, I) like faiss.
+    """
+    q = np.ascontiguousarray(q, dtype="float32")
+    if q.ndim == 1:
+        q = q[None, :]
+    if vectors is None or rerank <= 1 or index_kind(index) not in QUANTIZED:
+        return index.search(q, k, params=params)
+    D, I = index.search(q, k * rerank, params=params)
+    rows = I if row_of is None else row_of(I)
+    out_d = np.full((len(q), k), -np.inf, dtype="float32")
+    out_i = np.full((len(q), k), -1, dtype="int64")
+    for r in range(len(q)):
+        ok = (I[r] >= 0) & (rows[r] >= 0)
+        if not ok.any():
+            continue
+        exact = np.asarray(vectors[rows[r][ok]], dtype="float32") @ q[r]
+        top = np.argsort(-exact)[:k]
+        out_d[r, :len(top)] = exact[top]
+        out_i[r, :len(top)] = I[r][ok][top]
+    return out_d, out_i
+
+
+def _filter_params(index: faiss.Index, sel, selectivity: float, k: int):
+    """SearchParameters carrying `sel`, widened so a sparse filter still finds k hits."""
+    base = _base(index)
+    selectivity = max(selectivity, 1e-6)
+    if isinstance(base, faiss.IndexIVF):
+        # probe enough lists to expect a few times k allowed candidates
+        per_list = max(index.ntotal / base.nlist * selectivity, 1e-6)
+        nprobe = min(base.nlist, max(base.nprobe, math.ceil(4 * k / per_list)))
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        ef = min(HNSW_FILTER_EF_MAX, math.ceil(k / selectivity))
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=max(ef, base.hnsw.efSearch))
+    return faiss.SearchParameters(sel=sel)
+
+
+def enable_reconstruct(index: faiss.Index) -> faiss.Index:
+    """Give an IVF index the id -> list map `reconstruct` needs (exact filtered search).
+
+    Call once when loading an index for searching: building the map mutates
+    the index, which must not happen while other threads search it. Writers
+    that remove ids (image_index) must not call it.
+    """
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF) and base.direct_map.type == faiss.DirectMap.NoMap:
+        try:
+            base.make_direct_map()
+        except RuntimeError:
+            # ids that aren't 0..n-1 (image index after removals) need the hashtable flavour
+            base.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def _takes_selector(index: faiss.Index) -> bool:
+    """IndexPQ's search rejects SearchParameters, so it can't filter inside the search."""
+    return not isinstance(_base(index), faiss.IndexPQ)
+
+
+def _exact_subset(index, q, k, ids, vectors=None, row_of=None, chunk=65536):
+    """Brute-force top-k over just `ids`, `chunk` at a time; None if their vectors can't be had.
+
+    Without `vectors`, IVF indexes need enable_reconstruct() first.
+    """
+    if vectors is not None:
+        rows = ids if row_of is None else row_of(ids)
+        ids, rows = ids[rows >= 0], rows[rows >= 0]
+    D = np.full((len(q), k), -np.inf, dtype="float32")
+    I = np.full((len(q), k), -1, dtype="int64")
+    for s in range(0, len(ids), chunk):
+        part = ids[s:s + chunk]
+        if vectors is not None:
+            X = np.asarray(vectors[rows[s:s + chunk]], dtype="float32")
+        else:
+            try:
+                X = index.reconstruct_batch(part)
+            except RuntimeError:      # no direct map, or codes that can't be decoded back to vectors
+                return None
+        # merge this chunk's scores into the running top-k
+        S = np.hstack([D, q @ X.T])
+        C = np.hstack([I, np.broadcast_to(part, (len(q), len(part)))])
+        top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, 1), 1), 1)
+        D, I = np.take_along_axis(S, top, 1), np.take_along_axis(C, top, 1)
+    return D, I
+
+
+def _post_filtered(index, q, k, allowed, selectivity, vectors=None, row_of=None):
+    """Top-k allowed hits by over-fetching unfiltered results, for indexes that can't take a selector."""
+    fetch = math.ceil(2 * k / selectivity)
+    while True:
+        D, I = search(index, q, min(fetch, index.ntotal), vectors=vectors, row_of=row_of)
+        ok = (I >= 0) & (I < len(allowed))
+        ok[ok] = allowed[I[ok]]
+        if ok.sum(axis=1).min() >= k or fetch >= index.ntotal:
+            break
+        fetch *= 4
+    out_d = np.full((len(q), k), -np.inf, dtype="float32")
+    out_i = np.full((len(q), k), -1, dtype="int64")
+    for r in range(len(q)):
+        d, i = D[r][ok[r]][:k], I[r][ok[r]][:k]
+        out_d[r, :len(d)], out_i[r, :len(i)] = d, i
+    return out_d, out_i
+
+
+def search_filtered(index: faiss.Index, q: np.ndarray, k: int, allowed: np.ndarray,
+                    vectors=None, row_of=None):
+    """Top-k restricted to ids where the boolean bitmap `allowed` is set.
+
+    Small allowed sets are scored exactly (pre-filter brute force); larger
+    ones go through the ANN index with a bitmap IDSelector, so filtering
+    happens inside the search rather than by over-fetching. PQ indexes,
+    whose search takes no selector, are scored exactly when their float32
+    copy is there and over-fetch otherwise.
+    Returns (D, I, strategy) with strategy "exact", "ann" or "empty".
+    """
+    q = np.ascontiguousarray(q, dtype="float32")
+    if q.ndim == 1:
+        q = q[None, :]
+    n_allowed = int(allowed.sum())
+    if n_allowed == 0:
+        return (np.full((len(q), k), -np.inf, dtype="float32"),
+                np.full((len(q), k), -1, dtype="int64"), "empty")
+    selectivity = n_allowed / max(index.ntotal, 1)
+    takes_selector = _takes_selector(index)
+    small = n_allowed <= FILTER_EXACT_MAX or selectivity <= FILTER_EXACT_FRACTION
+    # a PQ scan is brute force anyway: scoring the allowed rows of the float32
+    # copy costs no more (decoding codes one by one does, so without the copy
+    # wide filters over-fetch instead)
+    if small or (not takes_selector and vectors is not None):
+        res = _exact_subset(index, q, k, np.flatnonzero(allowed), vectors, row_of)
+        if res is not None:
+            return (*res, "exact")
+    if takes_selector:
+        bits = np.packbits(allowed, bitorder="little")
+        sel = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bits))
+        try:
+            D, I = search(index, q, k, vectors=vectors, row_of=row_of,
+                          params=_filter_params(index, sel, selectivity, k))
+            return D, I, "ann"
+        except RuntimeError:      # "invalid search params": this index type can't filter in the search
+            pass
+    return (*_post_filtered(index, q, k, allowed, selectivity, vectors, row_of), "ann")
@@ -0,0 +1,81 @@
+# backend/rag/answer_cache.py
+"""Cache of completed /rag/stream answers, replayable as the same SSE events.
+
+An answer is keyed by (normalized query, ordered retrieved chunk ids, model,
+temperature). Optionally, a query whose embedding is within `near_dup`
+cosine similarity of a cached query *with the same retrieved chunks* is
+served the cached answer too.
+"""
+from __future__ import annotations
+import os
+import threading
+
+import numpy as np
+
+from backend.rag.query_cache import VersionedCache, normalize_query, approx_nbytes, mb
+
+ANSWER_CACHE_MB = float(os.getenv("ANSWER_CACHE_MB", "64"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
+# cosine threshold for near-duplicate queries; 0 disables the similarity match
+ANSWER_CACHE_NEAR_DUP = float(os.getenv("ANSWER_CACHE_NEAR_DUP", "0"))
+
+
+def answer_key(query: str, chunk_ids, model: str, temperature: float):
+    return (normalize_query(query), tuple(chunk_ids), model, round(float(temperature), 3))
+
+
+class AnswerCache:
+    def __init__(self, version_fn, max_bytes: int = mb(ANSWER_CACHE_MB),
+                 ttl_s: float = ANSWER_CACHE_TTL_S, near_dup: float = ANSWER_CACHE_NEAR_DUP):
+        self._answers = VersionedCache(max_bytes, version_fn, ttl_s=ttl_s)
+        self.near_dup = near_dup
+        # (chunk ids, model, temperature) -> {answer key: unit query embedding}
+        self._by_context: dict = {}
+        self._tracked = 0
+        self._lock = threading.Lock()
+        self.near_hits = 0
+
+    def get(self, query, chunk_ids, model, temperature, query_emb=None):
+        """Cached token list, or None."""
+        key = answer_key(query, chunk_ids, model, temperature)
+        tokens = self._answers.get(key)
+        if tokens is not None or not self.near_dup or query_emb is None:
+            return tokens
+        with self._lock:
+            candidates = list(self._by_context.get(key[1:], {}).items())
+        q = np.asarray(query_emb, dtype="float32")
+        for other_key, emb in candidates:
+            if float(np.dot(q, emb)) < self.near_dup:
+                continue
+            tokens = self._answers.get(other_key)
+            if tokens is not None:
+                self.near_hits += 1
+                return tokens
+            with self._lock:   # evicted or expired: forget it
+                self._by_context.get(key[1:], {}).pop(other_key, None)
+        return None
+
+    def put(self, query, chunk_ids, model, temperature, tokens, query_emb=None):
+        key = answer_key(query, chunk_ids, model, temperature)
+        tokens = tuple(tokens)
+        self._answers.put(key, tokens, approx_nbytes(tokens))
+        if self.near_dup and query_emb is not None:
+            with self._lock:
+                self._by_context.setdefault(key[1:], {})[key] = np.asarray(query_emb, dtype="float32")
+                self._tracked += 1
+                if self._tracked > 2 * len(self._answers) + 64:
+                    self._prune()
+
+    def _prune(self):
+        """Drop embeddings of answers the LRU has evicted, expired or invalidated."""
+        for ctx in list(self._by_context):
+            live = {k: e for k, e in self._by_context[ctx].items() if k in self._answers}
+            if live:
+                self._by_context[ctx] = live
+            else:
+                del self._by_context[ctx]
+        self._tracked = sum(len(v) for v in self._by_context.values())
+
+    def stats(self) -> dict:
+        return {**self._answers.stats(), "near_dup_hits": self.near_hits,
+                "near_dup_threshold": self.near_dup}
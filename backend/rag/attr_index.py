@@ -0,0 +1,127 @@
+# backend/rag/attr_index.py
+"""Precomputed attribute postings for filtered vector search.
+
+For every (attribute, value) pair the index keeps the sorted FAISS ids that
+carry it, e.g. ("style_tags", "red") -> [0, 7, 19]. All postings live in one
+memory-mapped int64 .npy; a small JSON maps each pair to its slice. A query
+filter is turned into an allowed-id bitmap with a handful of vectorised
+numpy operations, whatever the catalog size:
+
+    include={"category": ["blazer", "dress"]}   any of the values...
+    include={"category": [...], "occasions": [...]}   ...for every attribute
+    exclude={"style_tags": ["red"]}             none of the values
+
+Values are normalised (case-folded, leading "#" dropped), so "#Red" and
+"red" are the same tag.
+"""
+from __future__ import annotations
+import io
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Sequence
+
+import numpy as np
+
+try:
+    from backend.rag.index_files import atomic_write_bytes, atomic_write_json
+except ImportError:  # run as a script from backend/rag
+    from index_files import atomic_write_bytes, atomic_write_json
+
+# how each catalog column is split into values
+SINGLE, TAGS, LIST = "single", "tags", "list"
+FIELDS = {
+    "category": SINGLE,
+    "style_tags": TAGS,
+    "occasions": LIST,
+    "agent_category": SINGLE,
+    "agent_style_tags": TAGS,
+}
+
+
+def normalize_value(v: str) -> str:
+    return " ".join(str(v).split()).lstrip("#").casefold()
+
+
+def split_values(raw: str, how: str) -> set:
+    if not raw:
+        return set()
+    if how == TAGS:
+        parts = re.split(r"[\s,]+", raw)
+    elif how == LIST:
+        parts = raw.split(",")
+    else:
+        parts = [raw]
+    return {v for v in (normalize_value(p) for p in parts) if v}
+
+
+def write_attr_index(path: str | Path, rows: Iterable[Mapping[str, str]], n_ids: int,
+                     ids: Sequence[int] | None = None, fields: Dict[str, str] = FIELDS):
+    """Build postings for `fields` over `rows` and write `<path>.json` + `<path>.npy`.
+
+    Row i gets FAISS id i unless `ids` is given. `n_ids` is the id space
+    (index.ntotal for positional ids) and sizes query bitmaps.
+    """
+    postings: Dict[str, Dict[str, list]] = {a: {} for a in fields}
+    for i, row in enumerate(rows):
+        fid = i if ids is None else int(ids[i])
+        for attr, how in fields.items():
+            for v in split_values(row.get(attr) or "", how):
+                postings[attr].setdefault(v, []).append(fid)
+
+    slices, chunks, at = {}, [], 0
+    for attr, values in postings.items():
+        slices[attr] = {}
+        for v, plist in sorted(values.items()):
+            arr = np.unique(np.asarray(plist, dtype="int64"))
+            slices[attr][v] = [at, at + len(arr)]
+            chunks.append(arr)
+            at += len(arr)
+    buf = io.BytesIO()
+    np.save(buf, np.concatenate(chunks) if chunks else np.empty(0, dtype="int64"))
+    path = Path(path)
+    atomic_write_bytes(path.with_suffix(".npy"), buf.getvalue())
+    # the JSON goes last: readers only trust a .npy the JSON describes
+    atomic_write_json(path.with_suffix(".json"), {"n_ids": int(n_ids), "fields": fields,
+                                                  "total": at, "slices": slices})
+
+
+class AttributeIndex:
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_ids: int = meta["n_ids"]
+        self.fields: dict = meta["fields"]
+        self._slices: dict = meta["slices"]
+        self._postings = np.load(str(path.with_suffix(".npy")), mmap_mode="r")
+        if len(self._postings) != meta["total"]:
+            raise ValueError(f"{path}: postings don't match their dictionary")
+
+    def values(self, attr: str) -> Dict[str, int]:
+        """value -> number of items, for building filter UIs."""
+        return {v: b - a for v, (a, b) in self._slices.get(attr, {}).items()}
+
+    def postings(self, attr: str, value: str) -> np.ndarray:
+        if attr not in self.fields:
+            raise KeyError(f"unknown filter attribute {attr!r}; expected one of {', '.join(self.fields)}")
+        span = self._slices[attr].get(normalize_value(value))
+        if span is None:
+            return np.empty(0, dtype="int64")
+        return self._postings[span[0]:span[1]]
+
+    def mask(self, include: Mapping[str, Sequence[str]] | None = None,
+             exclude: Mapping[str, Sequence[str]] | None = None) -> np.ndarray:
+        """Boolean bitmap over FAISS ids for the filter."""
+        allowed = np.ones(self.n_ids, dtype=bool)
+        for attr, values in (include or {}).items():
+            values = [values] if isinstance(values, str) else values
+            hit = np.zeros(self.n_ids, dtype=bool)
+            for v in values:
+                hit[self.postings(attr, v)] = True
+            allowed &= hit
+        for attr, values in (exclude or {}).items():
+            values = [values] if isinstance(values, str) else values
+            for v in values:
+                allowed[self.postings(attr, v)] = False
+        return allowed
@@ -0,0 +1,116 @@
+# backend/rag/embed_batcher.py
+"""Dynamic micro-batching for query embeddings.
+
+Request handlers call `batcher.encode(item)` from many threads at once; a
+single scheduler thread collects whatever arrives within `max_wait_ms` of
+the first queued item (up to `max_batch` items) and runs one batched
+encode, then hands each caller its own row.
+"""
+from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+MAX_BATCH = int(os.getenv("EMBED_BATCH_MAX", "32"))
+MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "3"))
+METRICS_WINDOW = 4096
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item encodes into batched `encode_fn` calls.
+
+    `encode_fn(items) -> np.ndarray` must return one row per item. Items are
+    grouped by `kind` ("text", "image", ...) so each encode call sees a
+    homogeneous batch; all kinds collected in the same window are flushed
+    together.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 name: str = "embed"):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._q: queue.Queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # metrics
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._sizes = deque(maxlen=METRICS_WINDOW)
+        self._queue_delay = deque(maxlen=METRICS_WINDOW)   # seconds, submit -> encode start
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher",
+                                                    daemon=True)
+                    self._thread.start()
+
+    def submit(self, item, kind: str = "text") -> Future:
+        fut: Future = Future()
+        self._ensure_thread()
+        self._q.put((kind, item, fut, time.perf_counter()))
+        return fut
+
+    def encode(self, item, kind: str = "text") -> np.ndarray:
+        """Blocking: the embedding row for `item`."""
+        return self.submit(item, kind).result()
+
+    def _collect(self):
+        first = self._q.get()
+        batch = [first]
+        deadline = first[3] + self.max_wait_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            groups: dict = {}
+            for entry in batch:
+                groups.setdefault(entry[0], []).append(entry)
+            for entries in groups.values():
+                self._run(entries)
+
+    def _run(self, entries):
+        start = time.perf_counter()
+        try:
+            vecs = self.encode_fn([e[1] for e in entries])
+        except BaseException as exc:
+            for e in entries:
+                e[2].set_exception(exc)
+            return
+        for row, e in zip(vecs, entries):
+            e[2].set_result(row)
+        with self._lock:
+            self._batches += 1
+            self._items += len(entries)
+            self._sizes.append(len(entries))
+            self._queue_delay.extend(start - e[3] for e in entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = np.array(self._sizes, dtype="float64")
+            delay = np.array(self._queue_delay, dtype="float64") * 1000.0
+            out = {"batches": self._batches, "items": self._items,
+                   "max_batch": self.max_batch, "max_wait_ms": self.max_wait_s * 1000.0}
+        if sizes.size:
+            out["batch_size_mean"] = float(sizes.mean())
+            out["batch_fill"] = float(sizes.mean() / self.max_batch)
+        if delay.size:
+            out["queue_delay_ms"] = {"p50": float(np.percentile(delay, 50)),
+                                     "p99": float(np.percentile(delay, 99))}
+        return out
@@ -0,0 +1,354 @@
+# backend/rag/encoders.py
+"""CPU inference backends for the sentence-transformers encoders (CLIP, MiniLM).
+
+ENCODER_BACKEND picks how a model runs:
+  torch      stock PyTorch fp32 SentenceTransformer (default)
+  int8       PyTorch with dynamic int8 quantization of every Linear layer
+  onnx       exported once to ONNX (cached under ENCODER_ONNX_DIR), run on ONNX Runtime
+  onnx-int8  that export with dynamically quantized int8 weights
+
+Every backend hands back an object with SentenceTransformer's `encode`, so
+callers don't change. Servers and scripts take models from `get_encoder`,
+which loads each (model, backend) once per process and shares it. The int8
+and ONNX backends give slightly different vectors than fp32: measure the
+drift with `python -m backend.bench.encoder_parity` before switching.
+Indexes record the backend they were embedded with and are re-embedded when
+it changes, so fp32 and int8 vectors are never mixed.
+
+ENCODER_THREADS caps the intra-op threads of torch / ONNX Runtime (0 = their
+default, one per core); with several workers per host split the cores
+between them. The onnx backends need onnxruntime (onnx-int8 also needs onnx
+for quantization); the export itself runs once, with torch.
+"""
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from backend.rag.index_files import atomic_write_json
+except ImportError:  # run as a script from backend/rag
+    from index_files import atomic_write_json
+
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch").lower()
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", "0"))
+# items per encode_bulk call: how long a query can wait behind an index build
+ENCODER_BULK_CHUNK = int(os.getenv("ENCODER_BULK_CHUNK", "16"))
+ONNX_DIR = Path(os.getenv("ENCODER_ONNX_DIR", Path(__file__).resolve().parent / "data" / "onnx"))
+ONNX_OPSET = 17
+
+_export_lock = threading.Lock()
+_registry = {}   # (model name, backend) -> SharedEncoder
+_registry_lock = threading.Lock()
+
+
+def load_encoder(model_name: str, backend: str | None = None, threads: int | None = None):
+    """The sentence-transformers model `model_name` on `backend` (ENCODER_BACKEND by default)."""
+    backend = (backend or ENCODER_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown encoder backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    threads = ENCODER_THREADS if threads is None else threads
+    if backend.startswith("onnx"):
+        return OnnxEncoder(model_name, quantize=backend == "onnx-int8", threads=threads)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    model = SentenceTransformer(model_name, device="cpu")
+    # int8 weights, activations quantized per batch at run time; in place, so
+    # the fp32 copy is not kept next to it
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class SharedEncoder:
+    """One loaded model shared by every module of the process.
+
+    `encode` calls are serialized: HF fast tokenizers fail when used from two
+    threads at once, and a single encode already keeps every intra-op thread
+    busy. Concurrent callers should batch (see embed_batcher) rather than
+    hold their own model copies.
+
+    Index builds that share the model with live queries use `encode_bulk`:
+    it encodes ENCODER_BULK_CHUNK items at a time and lets queries that are
+    already waiting go before each chunk, so a query waits for one chunk,
+    not for a whole build batch.
+    """
+
+    def __init__(self, model, model_name: str, backend: str, load_s: float):
+        self.model = model
+        self.model_name = model_name
+        self.backend = backend
+        self.load_s = load_s
+        self._cond = threading.Condition()
+        self._busy = False
+        self._queued = 0      # encode() calls that asked for the model ...
+        self._started = 0     # ... and that got it
+        self.calls = 0
+        self.busy_s = 0.0
+
+    def _run(self, args, kwargs, bulk: bool):
+        with self._cond:
+            if bulk:
+                ahead = self._queued
+                while self._busy or self._started < ahead:
+                    self._cond.wait()
+            else:
+                self._queued += 1
+                while self._busy:
+                    self._cond.wait()
+                self._started += 1
+            self._busy = True
+        t0 = time.perf_counter()
+        try:
+            return self.model.encode(*args, **kwargs)
+        finally:
+            with self._cond:
+                self.calls += 1
+                self.busy_s += time.perf_counter() - t0
+                self._busy = False
+                self._cond.notify_all()
+
+    def encode(self, *args, **kwargs):
+        return self._run(args, kwargs, bulk=False)
+
+    def encode_bulk(self, items, chunk: int = ENCODER_BULK_CHUNK, **kwargs) -> np.ndarray:
+        """`encode(items, convert_to_numpy=True, ...)` for a non-empty list, in chunks
+        that queries can get between."""
+        kwargs["convert_to_numpy"] = True
+        return np.vstack([self._run((list(items[s:s + chunk]),), kwargs, bulk=True)
+                          for s in range(0, len(items), max(1, chunk))])
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "backend": self.backend, "load_s": round(self.load_s, 3),
+                "calls": self.calls, "busy_s": round(self.busy_s, 3)}
+
+
+def get_encoder(model_name: str, backend: str | None = None) -> SharedEncoder:
+    """The process-wide encoder for (model_name, backend), loaded on first request."""
+    key = (model_name, (backend or ENCODER_BACKEND).lower())
+    enc = _registry.get(key)
+    if enc is None:
+        with _registry_lock:
+            enc = _registry.get(key)
+            if enc is None:
+                t0 = time.perf_counter()
+                model = load_encoder(*key)
+                enc = _registry[key] = SharedEncoder(model, *key, time.perf_counter() - t0)
+    return enc
+
+
+def register_encoder(model_name: str, model, backend: str | None = None) -> SharedEncoder:
+    """Serve `model` (anything with an ST-style `encode`) for (model_name, backend) from now on.
+
+    Used to run the pipelines on a local stand-in, e.g. backend.bench.suite --stub.
+    """
+    key = (model_name, (backend or ENCODER_BACKEND).lower())
+    with _registry_lock:
+        enc = _registry[key] = SharedEncoder(model, *key, 0.0)
+    return enc
+
+
+def registry_stats() -> list:
+    """Loaded encoders with their load time and encode usage."""
+    return [enc.stats() for enc in list(_registry.values())]
+
+
+# ---- ONNX ----
+def _model_dir(model_name: str) -> Path:
+    return ONNX_DIR / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+
+
+def _pooling(model) -> tuple:
+    """(pooling mode, normalize) of a Transformer -> Pooling [-> Normalize] pipeline."""
+    from sentence_transformers import models
+    mode, normalize = None, False
+    for module in list(model)[1:]:
+        if isinstance(module, models.Pooling):
+            mode = module.get_pooling_mode_str()
+        elif isinstance(module, models.Normalize):
+            normalize = True
+        else:
+            raise ValueError(f"can't export {type(module).__name__} modules to ONNX")
+    if mode not in ("mean", "cls", "max"):
+        raise ValueError(f"can't export pooling mode {mode!r} to ONNX")
+    return mode, normalize
+
+
+def _export(model_name: str, out_dir: Path):
+    """Export the model's graph(s) plus tokenizer/processor, so loading it again needs no torch."""
+    import torch
+    from PIL import Image
+    from sentence_transformers import SentenceTransformer, models
+
+    class Graph(torch.nn.Module):
+        def __init__(self, inner, fn):
+            super().__init__()
+            self.inner, self.fn = inner, fn
+
+        def forward(self, *args):
+            return self.fn(self.inner, *args)
+
+    def export(graph, dummy: dict, outputs: dict, name: str):
+        axes = {k: ({0: "batch", 1: "seq"} if v.ndim == 2 else {0: "batch"}) for k, v in dummy.items()}
+        tmp = out_dir / f"{name}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(graph.eval(), tuple(dummy.values()), str(tmp), input_names=list(dummy),
+                              output_names=list(outputs), dynamic_axes={**axes, **outputs},
+                              opset_version=ONNX_OPSET, do_constant_folding=True)
+        os.replace(tmp, out_dir / name)
+
+    st = SentenceTransformer(model_name, device="cpu")
+    first = st[0]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(first, models.CLIPModel):
+        proc = first.processor
+        text = proc.tokenizer(["a photo of a red dress"], padding=True, return_tensors="pt")
+        export(Graph(first.model, lambda m, ids, mask: m.get_text_features(input_ids=ids, attention_mask=mask)),
+               {"input_ids": text["input_ids"], "attention_mask": text["attention_mask"]},
+               {"embeddings": {0: "batch"}}, "text.onnx")
+        pixels = proc.image_processor(images=[Image.new("RGB", (224, 224))], return_tensors="pt")["pixel_values"]
+        export(Graph(first.model, lambda m, px: m.get_image_features(pixel_values=px)),
+               {"pixel_values": pixels}, {"embeddings": {0: "batch"}}, "image.onnx")
+        proc.save_pretrained(out_dir)
+        config = {"kind": "clip", "max_seq_length": proc.tokenizer.model_max_length}
+    elif isinstance(first, models.Transformer):
+        mode, normalize = _pooling(st)
+        dummy = first.tokenizer(["a photo of a red dress"], padding=True, return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+        export(Graph(first.auto_model, lambda m, *xs: m(**dict(zip(names, xs)))[0]),
+               {n: dummy[n] for n in names}, {"token_embeddings": {0: "batch", 1: "seq"}}, "text.onnx")
+        first.tokenizer.save_pretrained(out_dir)
+        config = {"kind": "text", "pooling": mode, "normalize": normalize,
+                  "max_seq_length": first.max_seq_length}
+    else:
+        raise ValueError(f"{model_name}: can't export {type(first).__name__} to ONNX")
+    # written last: its presence means the export is complete
+    atomic_write_json(out_dir / "encoder.json", {"model": model_name, **config})
+
+
+def _quantize(src: Path, dst: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    tmp = dst.with_suffix(".tmp")
+    quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+    os.replace(tmp, dst)
+
+
+class OnnxEncoder:
+    """SentenceTransformer.encode() on ONNX Runtime: CLIP (separate text and image
+    graphs, mixed batches allowed) or transformer + pooling models such as MiniLM.
+
+    The export is reused across processes; inference sessions are created per
+    process on first use, since ONNX Runtime thread pools don't survive fork().
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, threads: int = ENCODER_THREADS):
+        self.model_name = model_name
+        self.dir = _model_dir(model_name)
+        self.threads = threads
+        with _export_lock:
+            if not (self.dir / "encoder.json").exists():
+                _export(model_name, self.dir)
+            self.config = json.loads((self.dir / "encoder.json").read_text(encoding="utf-8"))
+            parts = ("text", "image") if self.config["kind"] == "clip" else ("text",)
+            self.files = {}
+            for part in parts:
+                path = self.dir / f"{part}.onnx"
+                if quantize:
+                    q = self.dir / f"{part}-int8.onnx"
+                    if not q.exists():
+                        _quantize(path, q)
+                    path = q
+                self.files[part] = path
+        if self.config["kind"] == "clip":
+            from transformers import CLIPProcessor
+            self.processor = CLIPProcessor.from_pretrained(self.dir)
+            self.tokenizer = self.processor.tokenizer
+        else:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(self.dir)
+        self._sessions = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _session(self, part: str):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._sessions, self._pid = {}, os.getpid()
+        sess = self._sessions.get(part)
+        if sess is None:
+            with self._lock:
+                sess = self._sessions.get(part)
+                if sess is None:
+                    import onnxruntime as ort
+                    opts = ort.SessionOptions()
+                    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    opts.inter_op_num_threads = 1
+                    if self.threads > 0:
+                        opts.intra_op_num_threads = self.threads
+                    sess = ort.InferenceSession(str(self.files[part]), opts,
+                                                providers=["CPUExecutionProvider"])
+                    self._sessions[part] = sess
+        return sess
+
+    def _run(self, part: str, feeds: dict) -> np.ndarray:
+        sess = self._session(part)
+        wanted = {i.name for i in sess.get_inputs()}
+        return sess.run(None, {k: v for k, v in feeds.items() if k in wanted})[0]
+
+    def _encode_texts(self, texts) -> np.ndarray:
+        cfg = self.config
+        tok = self.tokenizer([t.strip() for t in texts], padding=True, truncation=True,
+                             max_length=cfg["max_seq_length"], return_tensors="np")
+        feeds = {k: np.asarray(v, dtype="int64") for k, v in tok.items()}
+        out = self._run("text", feeds)
+        if cfg["kind"] == "clip":
+            return out
+        mask = feeds["attention_mask"][..., None].astype(out.dtype)
+        if cfg["pooling"] == "cls":
+            out = out[:, 0]
+        elif cfg["pooling"] == "max":
+            out = np.where(mask > 0, out, -1e9).max(axis=1)
+        else:
+            out = (out * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if cfg["normalize"]:
+            out = out / np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+    def _encode_images(self, images) -> np.ndarray:
+        pixels = self.processor.image_processor(images=list(images), return_tensors="np")["pixel_values"]
+        return self._run("image", {"pixel_values": np.asarray(pixels, dtype="float32")})
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar=None, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **_) -> np.ndarray:
+        """Same contract as SentenceTransformer.encode (numpy output only)."""
+        single = isinstance(sentences, str) or not hasattr(sentences, "__len__")
+        items = [sentences] if single else list(sentences)
+        if not items:
+            return np.zeros((0, 0), dtype="float32")
+        # like sentence-transformers: similar lengths share a batch (less padding)
+        order = sorted(range(len(items)), key=lambda i: -len(items[i]) if isinstance(items[i], str) else 0)
+        out = None
+        for s in range(0, len(order), batch_size):
+            idx = order[s:s + batch_size]
+            texts = [i for i in idx if isinstance(items[i], str)]
+            images = [i for i in idx if not isinstance(items[i], str)]
+            for sel, fn in ((texts, self._encode_texts), (images, self._encode_images)):
+                if not sel:
+                    continue
+                vecs = fn([items[i] for i in sel]).astype("float32")
+                if out is None:
+                    out = np.empty((len(items), vecs.shape[1]), dtype="float32")
+                out[sel] = vecs
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
@@ -1,11 +1,27 @@
-import os, glob, json
+import os, glob, json, time, hashlib, argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 from PIL import Image
 import faiss
 
+try:
+    from backend.rag.ann_index import (INDEX_TYPE, IndexBuilder, index_kind, load_vectors,
+                                       needs_vectors, read_index, supports_remove, trainable)
+    from backend.rag.encoders import ENCODER_BACKEND, get_encoder
+    from backend.rag.index_files import (atomic_write_bytes, atomic_write_json,
+                                         generation_name, prune_generations)
+    from backend.rag.meta_store import MetaStore, write_store
+except ImportError:  # run as a script: python rag/image_index.py
+    from ann_index import (INDEX_TYPE, IndexBuilder, index_kind, load_vectors,
+                           needs_vectors, read_index, supports_remove, trainable)
+    from encoders import ENCODER_BACKEND, get_encoder
+    from index_files import (atomic_write_bytes, atomic_write_json,
+                             generation_name, prune_generations)
+    from meta_store import MetaStore, write_store
+
 # load root .env
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
 
@@ -13,34 +29,337 @@ IMG_DIR = os.getenv("RAG_IMG_DIR", "rag/images")
 OUT_DIR = os.getenv("RAG_IMG_INDEX_DIR", "rag/img_index")
 MODEL_NAME = os.getenv("EMBED_IMAGE_MODEL", "clip-ViT-B-32")
 
-def main():
-    Path(OUT_DIR).mkdir(parents=True, exist_ok=True)
-    paths = [p for p in glob.glob(f"{IMG_DIR}/**/*", recursive=True)
-             if Path(p).suffix.lower() in {".jpg",".jpeg",".png",".webp"}]
-    if not paths:
-        print("No images in rag/images")
-        return
+# ---- pipeline knobs ----
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+BATCH_SIZE = int(os.getenv("IMG_INDEX_BATCH", "32"))          # images per CLIP encode
+WORKERS = int(os.getenv("IMG_INDEX_WORKERS", str(min(8, os.cpu_count() or 4))))
+MAX_SIDE = int(os.getenv("IMG_INDEX_MAX_SIDE", "448"))        # CLIP only needs 224px
+QUEUE_SIZE = int(os.getenv("IMG_INDEX_QUEUE", str(4 * BATCH_SIZE)))
+
+
+class PipelineStats:
+    """Per-stage counters; rates are images per second of busy time."""
+
+    def __init__(self):
+        self.decoded = 0
+        self.encoded = 0
+        self.failed = []          # (path, error)
+        self.decode_s = 0.0       # summed over worker threads
+        self.encode_s = 0.0
+        self.add_s = 0.0
+        self.wall_s = 0.0
+
+    def as_dict(self):
+        rate = lambda n, s: round(n / s, 2) if s > 0 else None
+        return {
+            "indexed": self.encoded,
+            "failed": len(self.failed),
+            "wall_s": round(self.wall_s, 3),
+            "images_per_s": {
+                "decode_per_worker": rate(self.decoded, self.decode_s),
+                "encode": rate(self.encoded, self.encode_s),
+                "index_add": rate(self.encoded, self.add_s),
+                "end_to_end": rate(self.encoded, self.wall_s),
+            },
+        }
+
+    def report(self):
+        d = self.as_dict()
+        r = d["images_per_s"]
+        print(f"Indexed {d['indexed']} images, {d['failed']} failed in {d['wall_s']}s "
+              f"(decode {r['decode_per_worker']}/s/worker, encode {r['encode']}/s, "
+              f"end-to-end {r['end_to_end']}/s)")
+        for path, err in self.failed[:10]:
+            print(f"  ! {path}: {err}")
+        if len(self.failed) > 10:
+            print(f"  ! ... and {len(self.failed) - 10} more")
+
+
+def list_images(img_dir=IMG_DIR):
+    return sorted(p for p in glob.glob(f"{img_dir}/**/*", recursive=True)
+                  if Path(p).suffix.lower() in IMG_EXTS)
+
+def load_image(path, max_side=MAX_SIDE):
+    """Decode + downscale in a worker thread (PIL releases the GIL while decoding)."""
+    t0 = time.perf_counter()
+    img = Image.open(path)
+    img.draft("RGB", (max_side, max_side))   # cheap JPEG downscale at decode time
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return img, time.perf_counter() - t0
 
-    model = SentenceTransformer(MODEL_NAME)
-    vecs, metas = [], []
+def iter_decoded(paths, stats, workers=WORKERS, queue_size=QUEUE_SIZE):
+    """Yield (path, image) in order; at most `queue_size` decodes are in flight."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        it = iter(paths)
+        for p in it:
+            pending.append((p, pool.submit(load_image, p)))
+            if len(pending) >= queue_size:
+                break
+        while pending:
+            p, fut = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(load_image, nxt)))
+            try:
+                img, dt = fut.result()
+            except Exception as e:
+                stats.failed.append((p, f"{type(e).__name__}: {e}"))
+                continue
+            stats.decoded += 1
+            stats.decode_s += dt
+            yield p, img
 
-    for p in paths:
+def iter_embedded(model, paths, stats, batch_size=BATCH_SIZE):
+    """Yield (batch_paths, float32 vectors) for fixed-size CLIP batches."""
+    batch_paths, batch_imgs = [], []
+
+    def encode():
+        t0 = time.perf_counter()
         try:
-            img = Image.open(p).convert("RGB")
-            emb = model.encode([img], convert_to_numpy=True, normalize_embeddings=True)[0]
-            vecs.append(emb)
-            metas.append({"path": os.path.relpath(p)})
-        except Exception:
-            continue
-
-    vecs = np.vstack(vecs).astype("float32")
-    index = faiss.IndexFlatIP(vecs.shape[1])
-    index.add(vecs)
-    faiss.write_index(index, f"{OUT_DIR}/index.faiss")
-    with open(f"{OUT_DIR}/meta.json","w",encoding="utf-8") as f:
-        json.dump(metas, f, ensure_ascii=False, indent=2)
-    print(f"Indexed {len(metas)} images → {OUT_DIR}")
+            vecs = model.encode(batch_imgs, batch_size=batch_size, convert_to_numpy=True,
+                                normalize_embeddings=True).astype("float32")
+        except Exception as e:
+            stats.failed.extend((p, f"encode: {type(e).__name__}: {e}") for p in batch_paths)
+            return None
+        stats.encode_s += time.perf_counter() - t0
+        stats.encoded += len(batch_paths)
+        return vecs
 
-if __name__ == "__main__":
-    main()
+    for p, img in iter_decoded(paths, stats):
+        batch_paths.append(p)
+        batch_imgs.append(img)
+        if len(batch_imgs) >= batch_size:
+            vecs = encode()
+            if vecs is not None:
+                yield batch_paths, vecs
+            batch_paths, batch_imgs = [], []
+    if batch_imgs:
+        vecs = encode()
+        if vecs is not None:
+            yield batch_paths, vecs
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(out_dir=OUT_DIR):
+    """Current generation as written by _publish, with its "items" and "failed"
+    lists, or None for a legacy/missing index."""
+    meta_path = Path(out_dir) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if not isinstance(meta, dict) or meta.get("version") not in (2, 3):
+        return None
+    if not (Path(out_dir) / meta["index_file"]).exists():
+        return None
+    if meta["version"] == 3:   # version 2 kept the lists in meta.json itself
+        try:
+            with open(Path(out_dir) / meta["manifest_file"], "r", encoding="utf-8") as f:
+                meta = {**meta, **json.load(f)}
+        except (OSError, ValueError):
+            return None
+    return meta
+
+def scan(paths, previous):
+    """Split `paths` into unchanged / changed / removed against the previous manifest.
+
+    Files whose (mtime_ns, size) match are trusted without reading them; the
+    rest are hashed, so a touched-but-identical file is not re-embedded.
+    """
+    prev_by_path = {it["path"]: it for it in previous}
+    unchanged, changed = [], []
+
+    def check(p):
+        st = os.stat(p)
+        rel = os.path.relpath(p)
+        entry = {"path": rel, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        prev = prev_by_path.get(rel)
+        if prev and prev["mtime_ns"] == st.st_mtime_ns and prev["size"] == st.st_size:
+            return p, {**prev}, False
+        entry["sha256"] = file_sha256(p)
+        if prev and prev.get("sha256") == entry["sha256"]:
+            return p, {**prev, **entry}, False
+        return p, entry, True
 
+    seen = set()
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        for p, entry, is_changed in pool.map(check, paths):
+            seen.add(entry["path"])
+            (changed if is_changed else unchanged).append((p, entry))
+    removed = [it for it in previous if it["path"] not in seen]
+    return unchanged, changed, removed
+
+VECTORS_TMP = ".vectors.tmp.npy"
+
+def _carry_vectors(out, current, items, out_dir=OUT_DIR, chunk=65536):
+    """Copy the kept items' float32 vectors from the live generation into rows 0..len(items)."""
+    old = load_vectors(Path(out_dir) / current["vectors_file"])
+    old_store = MetaStore(Path(out_dir) / current["meta_store"])
+    ids = np.array([it["id"] for it in items], dtype="int64")
+    for s in range(0, len(ids), chunk):
+        out[s:s + len(ids[s:s + chunk])] = old[old_store.rows_of(ids[s:s + chunk])]
+
+def _publish(index, items, failed, next_id, generation, vectors=None, out_dir=OUT_DIR):
+    """Write index + metadata store under a new generation name, then swap meta.json to point at them.
+
+    `vectors` is the flushed temp .npy whose rows line up with `items`; it
+    is only kept for quantized index kinds (full-precision re-scoring).
+    The per-file manifest (path, hash, mtime, id) goes to manifest-N.json,
+    which only this indexer reads: meta.json stays small for the searchers
+    that re-read it on every reload.
+    """
+    name = generation_name("index", generation, ".faiss")
+    store = generation_name("items", generation, ".store")
+    atomic_write_bytes(Path(out_dir) / name, faiss.serialize_index(index).tobytes())
+    # searchers map this instead of holding the items list per process
+    write_store(Path(out_dir) / store, ["path", "sha256"], items, ids=[it["id"] for it in items])
+    vectors_file = None
+    if vectors is not None:
+        if needs_vectors(index_kind(index)):
+            vectors_file = generation_name("vectors", generation, ".npy")
+            os.replace(vectors, Path(out_dir) / vectors_file)
+        else:   # tiny catalog fell back to flat: exact scores already
+            os.unlink(vectors)
+    manifest = generation_name("manifest", generation, ".json")
+    atomic_write_json(Path(out_dir) / manifest, {
+        "items": items,
+        "failed": failed,     # not indexed; retried once the file changes
+    })
+    atomic_write_json(Path(out_dir) / "meta.json", {
+        "version": 3,
+        "generation": generation,
+        "index_file": name,
+        "meta_store": store,
+        "vectors_file": vectors_file,
+        "manifest_file": manifest,
+        "index_type": index_kind(index),   # as built: flat while the catalog is too small to train INDEX_TYPE
+        "encoder": ENCODER_BACKEND,
+        "next_id": next_id,
+        "items": len(items),
+        "failed": len(failed),
+    })
+    prune_generations(out_dir, "index", ".faiss", keep=2)
+    prune_generations(out_dir, "items", ".store", keep=2)
+    prune_generations(out_dir, "vectors", ".npy", keep=2)
+    prune_generations(out_dir, "manifest", ".json", keep=2)
+
+def main(full=False, img_dir=IMG_DIR, out_dir=OUT_DIR):
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    paths = list_images(img_dir)
+    live = load_manifest(out_dir)
+    current = None if full else live
+    previous = (current["items"] + current.get("failed", [])) if current else []
+
+    t_scan = time.perf_counter()
+    unchanged, changed, removed = scan(paths, previous)
+    t_scan = time.perf_counter() - t_scan
+
+    keep_vectors = needs_vectors(INDEX_TYPE)
+    index = None
+    if current:
+        # a heap copy: this index is modified in place
+        index = read_index(Path(out_dir) / current["index_file"], mmap=False)
+        indexed = {it["path"] for it in previous if "id" in it}
+        replaces = any(it["path"] in indexed for it in removed) or \
+            any(e["path"] in indexed for _, e in changed)
+        n_after = sum("id" in e for _, e in unchanged) + len(changed)
+        if (not isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF))
+                or (index_kind(index) != INDEX_TYPE and trainable(INDEX_TYPE, index.d, n_after))
+                or current.get("encoder", "torch") != ENCODER_BACKEND
+                or (replaces and not supports_remove(index))
+                or (keep_vectors and index_kind(index) == INDEX_TYPE and not current.get("vectors_file"))):
+            # legacy positional index, RAG_INDEX_TYPE changed or a flat fallback
+            # whose catalog can now train it, ENCODER_BACKEND changed
+            # (vectors of two encoders don't mix), an HNSW graph
+            # that can't drop the stale vectors, or no re-scoring vectors to
+            # carry over: rebuild from scratch
+            index, current = None, None
+    if current is None:
+        # full build: everything is (re-)embedded into a fresh ID-mapped index
+        changed = unchanged + changed
+        unchanged, removed, previous = [], [], []
+    if not changed and not removed:
+        print(f"Image index up to date ({len(unchanged)} images, scan {t_scan:.2f}s)")
+        return {"indexed": 0, "removed": 0, "unchanged": len(unchanged)}
+
+    prev_by_path = {it["path"]: it for it in previous}
+    stale = removed + [prev_by_path[e["path"]] for _, e in changed if e["path"] in prev_by_path]
+    stale_ids = [it["id"] for it in stale if "id" in it]
+    if index is not None and stale_ids:
+        index.remove_ids(np.array(stale_ids, dtype="int64"))
+
+    next_id = current["next_id"] if current else 0
+    items = [e for _, e in unchanged if "id" in e]
+    failed = [e for _, e in unchanged if "id" not in e]
+    pending = {p: e for p, e in changed}
+    stats = PipelineStats()
+    model = get_encoder(MODEL_NAME) if pending else None
+    # a fresh index is trained on the first embeddings it sees (IVF/PQ); an
+    # existing one keeps its trained state and just takes the new vectors
+    builder = IndexBuilder(INDEX_TYPE, n_expected=len(pending), with_ids=True) if index is None else None
+
+    # quantized kinds keep a float32 copy, row-aligned with `items`, written
+    # through a memmap so it never has to fit in RAM
+    vectors = None
+    vectors_tmp = Path(out_dir) / VECTORS_TMP
+    def open_vectors(d):
+        return np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype="float32",
+                                         shape=(max(1, len(items) + len(pending)), d))
+    if keep_vectors and index is not None and index_kind(index) == INDEX_TYPE:
+        vectors = open_vectors(index.d)
+        _carry_vectors(vectors, current, items, out_dir)
+
+    t0 = time.perf_counter()
+    for batch_paths, vecs in iter_embedded(model, list(pending), stats):
+        # flush each batch straight into FAISS; images and batch vectors are dropped
+        t1 = time.perf_counter()
+        ids = np.arange(next_id, next_id + len(batch_paths), dtype="int64")
+        if builder is not None:
+            builder.add(vecs, ids)
+        else:
+            index.add_with_ids(vecs, ids)
+        if keep_vectors:
+            if vectors is None:
+                vectors = open_vectors(vecs.shape[1])
+            vectors[len(items):len(items) + len(vecs)] = vecs
+        for p, i in zip(batch_paths, ids):
+            items.append({**pending.pop(p), "id": int(i)})
+        next_id += len(batch_paths)
+        stats.add_s += time.perf_counter() - t1
+    if builder is not None:
+        index = builder.finish()
+    stats.wall_s = time.perf_counter() - t0
+    failed += pending.values()   # whatever was not embedded
+
+    wrote_vectors = vectors is not None
+    if wrote_vectors:
+        vectors.flush()
+        del vectors
+
+    if index is None:
+        stats.report()
+        print(f"No images in {img_dir}" if not paths else "Nothing indexed.")
+        return stats.as_dict()
+
+    # never reuse the live generation's file name, even for a --full rebuild
+    generation = (live["generation"] + 1) if live else 1
+    _publish(index, items, failed, next_id, generation,
+             vectors=vectors_tmp if wrote_vectors else None, out_dir=out_dir)
+    stats.report()
+    mode = "incremental" if current else "full"
+    print(f"{mode} ({index_kind(index)}): +{stats.encoded} embedded, -{len(removed)} removed, "
+          f"{len(unchanged)} unchanged (scan {t_scan:.2f}s) → {out_dir} gen {generation}")
+    return {**stats.as_dict(), "removed": len(removed), "unchanged": len(unchanged),
+            "generation": generation}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build or update the FAISS image index.")
+    ap.add_argument("--full", action="store_true", help="ignore the manifest and rebuild everything")
+    main(full=ap.parse_args().full)
@@ -1,44 +1,268 @@
 # backend/rag/image_search.py
 from dotenv import load_dotenv
-import os, json
+import os, json, time, threading, hashlib
+from collections import deque
+from io import BytesIO
 from pathlib import Path
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from PIL import Image
-import faiss
+
+# torch/sentence-transformers and faiss (via ann_index) are imported on first
+# use, so importing this module (e.g. for open_image) stays cheap
+try:
+    from backend.rag.encoders import ENCODER_BACKEND, get_encoder
+    from backend.rag.index_files import file_signature
+    from backend.rag.meta_store import MetaStore
+    from backend.rag.query_cache import LRUCache, mb
+except ImportError:  # run as a script: python rag/image_search.py
+    from encoders import ENCODER_BACKEND, get_encoder
+    from index_files import file_signature
+    from meta_store import MetaStore
+    from query_cache import LRUCache, mb
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[2] / ".env")
 
-OUT_DIR = os.getenv("RAG_IMG_INDEX_DIR") 
+OUT_DIR = os.getenv("RAG_IMG_INDEX_DIR")
 
 # IMPORTANT: point to the correct index dir under backend/rag/
 OUT_DIR = os.getenv("RAG_IMG_INDEX_DIR", "backend/rag/img_index")
 OUT_DIR = "backend/rag/img_index"
 MODEL_NAME = os.getenv("EMBED_IMAGE_MODEL", "clip-ViT-B-32")
+ENCODE_BATCH = int(os.getenv("IMG_SEARCH_BATCH", "32"))
+LATENCY_WINDOW = int(os.getenv("IMG_SEARCH_LATENCY_WINDOW", "2048"))
+RELOAD_CHECK_S = float(os.getenv("IMG_SEARCH_RELOAD_CHECK_S", "2"))
+# query images get the same decode-time downscale as indexed ones (image_index.load_image)
+QUERY_MAX_SIDE = int(os.getenv("IMG_QUERY_MAX_SIDE", os.getenv("IMG_INDEX_MAX_SIDE", "448")))
+# query embeddings by content hash: a re-uploaded image skips decode + encode
+QUERY_EMB_CACHE_MB = float(os.getenv("IMG_QUERY_EMB_CACHE_MB", "16"))
 
-def search(image_path, top_k=5):
-    index_path = Path(OUT_DIR) / "index.faiss"
-    meta_path = Path(OUT_DIR) / "meta.json"
-    if not index_path.exists() or not meta_path.exists():
-        raise FileNotFoundError(f"Index or meta not found in {OUT_DIR}")
 
-    index = faiss.read_index(str(index_path))
+def _ann():
+    try:
+        from backend.rag import ann_index
+    except ImportError:  # run as a script
+        import ann_index
+    return ann_index
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def open_image(image, max_side: int = QUERY_MAX_SIDE) -> Image.Image:
+    """Accept a path, raw bytes or an already decoded PIL image; downscaled to `max_side` (0 = as is)."""
+    if isinstance(image, Image.Image):
+        img = image
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        img = Image.open(BytesIO(image))
+    else:
+        img = Image.open(image)
+    if max_side:
+        img.draft("RGB", (max_side, max_side))   # cheap JPEG downscale at decode time
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side))
+        return img
+    return img.convert("RGB")
+
+
+def load_generation(index_dir=OUT_DIR):
+    """Read meta.json, then the files it points at; returns (index, metas, vectors).
+
+    `metas.get(faiss_id)` gives the item dict. For current indexes it is the
+    generation's memory-mapped MetaStore; older meta.json files fall back to
+    an in-memory dict (legacy list-style meta maps to index.faiss with
+    positional ids). `vectors` is the memory-mapped float32 copy used to
+    re-score quantized indexes, or None. meta.json is replaced atomically by
+    image_index, so reading it first pins one consistent generation.
+    """
+    meta_path = Path(index_dir) / "meta.json"
+    if not meta_path.exists():
+        raise FileNotFoundError(f"Index or meta not found in {index_dir}")
     with open(meta_path, "r", encoding="utf-8") as f:
-        metas = json.load(f)
+        meta = json.load(f)
+    ann_index = _ann()
+    embedded_with = meta.get("encoder", "torch") if isinstance(meta, dict) else "torch"
+    if embedded_with != ENCODER_BACKEND:
+        print(f"[image_search] {index_dir} was embedded with the {embedded_with} encoder, queries use "
+              f"{ENCODER_BACKEND}: re-run image_index.py to re-embed it")
+    vectors = None
+    if isinstance(meta, dict) and meta.get("meta_store"):
+        index_path = Path(index_dir) / meta["index_file"]
+        by_id = MetaStore(Path(index_dir) / meta["meta_store"])
+        if meta.get("vectors_file"):
+            vectors = ann_index.load_vectors(Path(index_dir) / meta["vectors_file"], rows=len(by_id))
+    elif isinstance(meta, dict):
+        index_path = Path(index_dir) / meta["index_file"]
+        by_id = {int(it["id"]): it for it in meta["items"]}
+    else:
+        index_path = Path(index_dir) / "index.faiss"
+        by_id = dict(enumerate(meta))
+    if not index_path.exists():
+        raise FileNotFoundError(f"Index or meta not found in {index_dir}")
+    return ann_index.read_index(index_path), by_id, vectors
+
+
+class ImageSearchEngine:
+    """CLIP model, FAISS index and metadata loaded once and kept resident.
+
+    Construction pays the cold start (model + index + meta); `search` and
+    `search_batch` only pay encode + index lookup. Timings for both are
+    exposed through `stats()`. A new index generation published by
+    image_index is picked up without a restart.
+    """
+
+    def __init__(self, index_dir=OUT_DIR, model_name=MODEL_NAME):
+        self.index_dir = Path(index_dir)
+        t0 = time.perf_counter()
+        self.model = get_encoder(model_name)   # shared with rag_service when it's the same CLIP
+        t1 = time.perf_counter()
+        self._sig = file_signature(self.index_dir / "meta.json")
+        self.index, self.metas, self.vectors = load_generation(self.index_dir)
+        t2 = time.perf_counter()
 
-    model = SentenceTransformer(MODEL_NAME)
+        self.cold_start = {
+            "model_s": t1 - t0,
+            "index_s": t2 - t1,
+            "total_s": t2 - t0,
+        }
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # seconds per query
+        self._emb_cache = LRUCache(mb(QUERY_EMB_CACHE_MB))
+        self._queries = 0
+        self._reloads = 0
+        self._next_check = time.monotonic() + RELOAD_CHECK_S
+        self._lock = threading.Lock()
 
-    img = Image.open(image_path).convert("RGB")
-    q = model.encode([img], convert_to_numpy=True, normalize_embeddings=True)[0].astype("float32")
-    D, I = index.search(q.reshape(1, -1), top_k)
+    def maybe_reload(self):
+        """Swap in a newer index generation if meta.json changed (checked at most every RELOAD_CHECK_S)."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_S
+        sig = file_signature(self.index_dir / "meta.json")
+        if sig is None or sig == self._sig:
+            return
+        index, metas, vectors = load_generation(self.index_dir)
+        with self._lock:
+            self.index, self.metas, self.vectors, self._sig = index, metas, vectors, sig
+            self._reloads += 1
 
+    def _hits(self, metas, scores, ids):
+        out = []
+        for score, i in zip(scores, ids):
+            m = metas.get(int(i)) if i >= 0 else None
+            if m is None:
+                continue
+            out.append({"path": m.get("path", ""), "score": float(score)})
+        return out
+
+    def embed(self, images, return_exceptions=False):
+        """Query embeddings, one per image; repeated image bytes come from the cache.
+
+        Paths and raw bytes are keyed by content hash, decoded PIL images are
+        always encoded. With `return_exceptions` an image that fails to
+        decode gets its exception in place of a vector instead of raising.
+        """
+        out = [None] * len(images)
+        keys = [None] * len(images)
+        todo, imgs = [], []
+        for i, im in enumerate(images):
+            try:
+                if not isinstance(im, Image.Image):
+                    if not isinstance(im, (bytes, bytearray, memoryview)):
+                        im = Path(im).read_bytes()
+                    keys[i] = content_key(im)
+                    out[i] = self._emb_cache.get(keys[i])
+                    if out[i] is not None:
+                        continue
+                imgs.append(open_image(im))
+                todo.append(i)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                out[i] = e
+        if imgs:
+            q = self.model.encode(imgs, batch_size=ENCODE_BATCH, convert_to_numpy=True,
+                                  normalize_embeddings=True).astype("float32")
+            for i, v in zip(todo, q):
+                out[i] = v
+                if keys[i] is not None:
+                    self._emb_cache.put(keys[i], v)
+        return out
+
+    def search(self, image, top_k=5):
+        return self.search_batch([image], top_k=top_k)[0]
+
+    def search_batch(self, images, top_k=5, return_exceptions=False):
+        """One batched CLIP encode (cache misses only) and one matrix index.search for all images.
+
+        With `return_exceptions`, undecodable images get their exception as
+        the result instead of failing the whole batch.
+        """
+        if not images:
+            return []
+        t0 = time.perf_counter()
+        vecs = self.embed(images, return_exceptions=return_exceptions)
+        ok = [i for i, v in enumerate(vecs) if not isinstance(v, Exception)]
+        out = list(vecs)
+        if ok:
+            q = np.vstack([vecs[i] for i in ok])
+            self.maybe_reload()
+            with self._lock:
+                index, metas, vectors = self.index, self.metas, self.vectors   # one consistent generation
+            # quantized indexes re-score their shortlist against the float32 vectors
+            D, I = _ann().search(index, q, top_k, vectors=vectors,
+                                  row_of=getattr(metas, "rows_of", None))
+            for r, i in enumerate(ok):
+                out[i] = self._hits(metas, D[r], I[r])
+
+        per_query = (time.perf_counter() - t0) / len(images)
+        with self._lock:
+            self._queries += len(images)
+            self._latencies.extend([per_query] * len(images))
+        return out
+
+    def warmup(self):
+        """One encode + index search, not counted in stats, so the first real query is warm."""
+        q = np.vstack(self.embed([Image.new("RGB", (224, 224))]))
+        _ann().search(self.index, q, 1, vectors=self.vectors, row_of=getattr(self.metas, "rows_of", None))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lat = np.array(self._latencies, dtype="float64") * 1000.0
+            queries = self._queries
+        out = {
+            "cold_start": self.cold_start,
+            "queries": queries,
+            "index_size": int(self.index.ntotal),
+            "reloads": self._reloads,
+            "embedding_cache": self._emb_cache.stats(),
+            "encoder": self.model.stats(),
+        }
+        if lat.size:
+            out["latency_ms"] = {
+                "p50": float(np.percentile(lat, 50)),
+                "p99": float(np.percentile(lat, 99)),
+                "mean": float(lat.mean()),
+                "window": int(lat.size),
+            }
+        return out
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def engine() -> ImageSearchEngine:
+    """Process-wide engine, built on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ImageSearchEngine()
+    return _engine
+
+def search(image_path, top_k=5):
     # Return path + score (path can be relative or absolute from your meta.json)
-    out = []
-    for j, i in enumerate(I[0]):
-        if i < 0 or i >= len(metas):
-            continue
-        out.append({"path": metas[i].get("path", ""), "score": float(D[0][j])})
-    return out
+    return engine().search(image_path, top_k=top_k)
 
 if __name__ == "__main__":
     p = input("Image path to search: ").strip().strip('"')
@@ -46,3 +270,6 @@ if __name__ == "__main__":
     print("\nTop matches:")
     for r in results:
         print(f"{r['score']:.3f}  {r['path']}")
+    s = engine().stats()
+    print(f"\ncold start {s['cold_start']['total_s']:.2f}s, "
+          f"query {s['latency_ms']['p50']:.1f}ms")
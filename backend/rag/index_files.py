@@ -0,0 +1,59 @@
+# backend/rag/index_files.py
+"""Atomic writes for index/metadata files that live readers may be loading.
+
+An index and its metadata are published as one *generation*: the data files
+are written under generation-numbered names first, then a small JSON pointer
+is swapped in with a single os.replace. Readers open the pointer and follow
+it, so they see either the old pair or the new pair, never a mix.
+"""
+from __future__ import annotations
+import glob
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write_bytes(path: str | Path, data: bytes):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path: str | Path, obj):
+    atomic_write_bytes(path, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+def generation_name(prefix: str, generation: int, suffix: str) -> str:
+    return f"{prefix}-{generation:06d}{suffix}"
+
+
+def prune_generations(directory: str | Path, prefix: str, suffix: str, keep: int = 2):
+    """Delete all but the newest `keep` generations (a reader may still hold the previous one)."""
+    files = sorted(glob.glob(str(Path(directory) / f"{prefix}-[0-9]*{suffix}")))
+    for f in files[:-keep] if keep > 0 else files:
+        try:
+            os.unlink(f)
+        except OSError:
+            pass
+
+
+def file_signature(path: str | Path):
+    """Cheap change token for a file: (mtime_ns, size), or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
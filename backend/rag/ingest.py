@@ -1,10 +1,16 @@
-import os, glob, uuid
+import os, glob, hashlib, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 from pypdf import PdfReader
 from markdown_it import MarkdownIt
 import chromadb
-from sentence_transformers import SentenceTransformer
+
+try:
+    from backend.rag.encoders import get_encoder
+except ImportError:  # run as a script: python rag/ingest.py
+    from encoders import get_encoder
 
 # load root .env
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
@@ -14,6 +20,11 @@ CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "120"))
 EMBED_TEXT_MODEL = os.getenv("EMBED_TEXT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 DATA_DIR = os.getenv("RAG_DATA_DIR", "rag/data")
 VDB_DIR = os.getenv("RAG_VDB_DIR", "rag/vectordb")
+COLLECTION_NAME = os.getenv("RAG_COLLECTION", "docs")
+STATE_PAGE = 5000   # metadata rows fetched per coll.get page
+EMBED_BATCH = int(os.getenv("INGEST_BATCH", "256"))   # chunks per encode + commit
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+INGEST_EXTS = {".pdf", ".md", ".txt"}
 
 def read_pdf(path):
     reader = PdfReader(path)
@@ -34,37 +45,197 @@ def chunk_text(t, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
         i += max(1, size - overlap)
     return chunks
 
-def main():
-    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
-    client = chromadb.Client(Settings(persist_directory=VDB_DIR))
-    coll = client.get_or_create_collection(name="docs")
-    embedder = SentenceTransformer(EMBED_TEXT_MODEL)
-
-    docs, metas, ids = [], [], []
-
-    for path in glob.glob(f"{DATA_DIR}/**/*", recursive=True):
-        if os.path.isdir(path): continue
-        ext = Path(path).suffix.lower()
-        if ext == ".pdf":
-            text = read_pdf(path)
-        elif ext in {".md", ".txt"}:
-            text = read_md_or_txt(path)
-        else:
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_id(source, file_hash, idx):
+    """Stable id: the same file content always maps to the same chunk ids."""
+    return hashlib.sha1(f"{source}\0{file_hash}\0{idx}".encode("utf-8")).hexdigest()
+
+def ingested_sources(coll):
+    """Distinct sources written by this script (memory is O(files), not O(chunks)).
+
+    Rows without a "source" (e.g. catalog items from ingest_with_agent) are ignored.
+    """
+    sources = set()
+    offset = 0
+    while True:
+        page = coll.get(include=["metadatas"], limit=STATE_PAGE, offset=offset)
+        metas = page.get("metadatas") or []
+        sources.update(m["source"] for m in metas if m and "source" in m)
+        if len(metas) < STATE_PAGE:
+            return sources
+        offset += STATE_PAGE
+
+def file_rows(coll, source):
+    """[(id, file_hash, n_chunks)] for one source; legacy rows have file_hash None."""
+    res = coll.get(where={"source": source}, include=["metadatas"])
+    return [(cid, m.get("file_hash"), m.get("n_chunks"))
+            for cid, m in zip(res["ids"], res["metadatas"])]
+
+def is_current(rows, file_hash):
+    """True if every chunk of this exact file content is already in the collection."""
+    if not rows or any(h != file_hash for _, h, _ in rows):
+        return False
+    return len(rows) == rows[0][2]
+
+def extract(path):
+    ext = Path(path).suffix.lower()
+    if ext == ".pdf":
+        return read_pdf(path)
+    if ext in {".md", ".txt"}:
+        return read_md_or_txt(path)
+    return None
+
+def extract_chunks(path):
+    """Runs in a worker process: pypdf extraction is CPU-bound."""
+    return chunk_text(extract(path))
+
+
+class IngestStats:
+    def __init__(self):
+        self.unchanged = 0
+        self.changed = 0
+        self.failed = []          # (source, error)
+        self.embedded = 0
+        self.resumed = 0          # chunks already committed by an interrupted run
+        self.stale = 0
+        self.removed_files = 0
+        self.embed_s = 0.0
+        self.wall_s = 0.0
+
+    def report(self):
+        rate = self.embedded / self.embed_s if self.embed_s else 0.0
+        print(f"Ingested {self.embedded} chunks from {self.changed} changed files "
+              f"({self.resumed} already committed), removed {self.stale} stale chunks "
+              f"({self.removed_files} deleted files), {self.unchanged} files unchanged, "
+              f"{len(self.failed)} failed in {self.wall_s:.1f}s ({rate:.1f} chunks/s embed) → {VDB_DIR}")
+        for source, err in self.failed[:10]:
+            print(f"  ! {source}: {err}")
+
+
+def iter_changed(coll, paths, stats):
+    """Yield (path, source, file_hash, stale_ids) for files that need (re-)ingesting."""
+    for path in paths:
+        source = os.path.relpath(path)
+        file_hash = file_sha256(path)
+        rows = file_rows(coll, source)
+        if is_current(rows, file_hash):
+            stats.unchanged += 1
             continue
+        stats.changed += 1
+        # chunks of earlier versions of this file; chunks of this version are kept
+        # so an interrupted run can resume without re-embedding them
+        yield path, source, file_hash, [cid for cid, h, _ in rows if h != file_hash]
 
-        for idx, chunk in enumerate(chunk_text(text)):
-            docs.append(chunk)
-            metas.append({"source": os.path.relpath(path), "chunk": idx})
-            ids.append(str(uuid.uuid4()))
+def iter_extracted(changed, stats, workers=INGEST_WORKERS):
+    """Extract in a process pool with a bounded number of files in flight."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in changed:
+            pending.append((item, pool.submit(extract_chunks, item[0])))
+            if len(pending) < 2 * workers:
+                continue
+            yield from _drain_one(pending, stats)
+        while pending:
+            yield from _drain_one(pending, stats)
 
-    if not docs:
-        print("No ingestible files in rag/data. Add PDFs/MD/TXT first.")
+def _drain_one(pending, stats):
+    (path, source, file_hash, stale), fut = pending.popleft()
+    try:
+        chunks = fut.result()
+    except Exception as e:
+        stats.failed.append((source, f"{type(e).__name__}: {e}"))
         return
+    yield source, file_hash, stale, chunks
+
+
+class BatchWriter:
+    """Embeds and commits chunks in fixed-size batches.
+
+    Every committed batch is a checkpoint: chunk ids are deterministic, so a
+    re-run skips ids that are already present. A file's stale chunks are
+    only deleted after all of its new chunks have been committed.
+    """
+
+    def __init__(self, coll, stats, batch_size=EMBED_BATCH):
+        self.coll, self.stats, self.batch_size = coll, stats, batch_size
+        self.embedder = None
+        self.batch = []           # (id, doc, meta)
+        self.open_files = {}      # source -> [chunks not yet committed, stale ids]
+
+    def add_file(self, source, file_hash, stale, chunks):
+        if not chunks:
+            self._finish(source, stale)
+            return
+        self.open_files[source] = [len(chunks), stale]
+        for idx, chunk in enumerate(chunks):
+            meta = {"source": source, "chunk": idx, "file_hash": file_hash, "n_chunks": len(chunks)}
+            self.batch.append((chunk_id(source, file_hash, idx), chunk, meta))
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        done = set(self.coll.get(ids=[b[0] for b in batch], include=[])["ids"])
+        todo = [b for b in batch if b[0] not in done]
+        self.stats.resumed += len(batch) - len(todo)
+        if todo:
+            if self.embedder is None:
+                self.embedder = get_encoder(EMBED_TEXT_MODEL)
+            t0 = time.perf_counter()
+            embs = self.embedder.encode([b[1] for b in todo], batch_size=64, convert_to_numpy=True)
+            self.stats.embed_s += time.perf_counter() - t0
+            self.coll.upsert(ids=[b[0] for b in todo], documents=[b[1] for b in todo],
+                             metadatas=[b[2] for b in todo], embeddings=embs.tolist())
+            self.stats.embedded += len(todo)
+        for _, _, meta in batch:
+            entry = self.open_files[meta["source"]]
+            entry[0] -= 1
+            if entry[0] == 0:
+                self._finish(meta["source"], entry[1])
+
+    def _finish(self, source, stale):
+        self.open_files.pop(source, None)
+        if stale:
+            self.coll.delete(ids=stale)
+            self.stats.stale += len(stale)
+
+
+def main():
+    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
+    # PersistentClient in chromadb 0.5.x; persistence is automatic
+    client = chromadb.PersistentClient(path=VDB_DIR)
+    coll = client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+
+    paths = sorted(p for p in glob.glob(f"{DATA_DIR}/**/*", recursive=True)
+                   if not os.path.isdir(p) and Path(p).suffix.lower() in INGEST_EXTS)
+    if not paths:
+        # still fall through: chunks of files that were deleted must go
+        print(f"No ingestible files in {DATA_DIR}. Add PDFs/MD/TXT first.")
+
+    stats = IngestStats()
+    writer = BatchWriter(coll, stats)
+    t0 = time.perf_counter()
+    for source, file_hash, stale, chunks in iter_extracted(iter_changed(coll, paths, stats), stats):
+        writer.add_file(source, file_hash, stale, chunks)
+    writer.flush()
 
-    embs = embedder.encode(docs, convert_to_numpy=True, show_progress_bar=True)
-    coll.add(documents=docs, metadatas=metas, ids=ids, embeddings=embs)
-    client.persist()
-    print(f"Ingested {len(docs)} chunks into {VDB_DIR}")
+    seen = {os.path.relpath(p) for p in paths}
+    for source in ingested_sources(coll) - seen:
+        n = len(coll.get(where={"source": source}, include=[])["ids"])
+        coll.delete(where={"source": source})
+        stats.stale += n
+        stats.removed_files += 1
+    stats.wall_s = time.perf_counter() - t0
+    stats.report()
+    return stats
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
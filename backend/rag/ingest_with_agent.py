@@ -1,39 +1,152 @@
 import os
+import sys
 import csv
+import time
+import asyncio
+from pathlib import Path
 from dotenv import load_dotenv
 import chromadb
-from sentence_transformers import SentenceTransformer
-from moodboard_agent import MoodboardAgent
+
+try:
+    from backend.agents.moodboard_agent import MoodboardAgent, parse_metadata
+    from backend.rag.encoders import get_encoder
+except ImportError:  # run as a script from backend/rag
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "agents"))
+    from moodboard_agent import MoodboardAgent, parse_metadata
+    from encoders import get_encoder
 
 # Load .env and model
 load_dotenv()
 VDB_DIR = os.getenv("RAG_VDB_DIR", "rag/vectordb")
 EMBED_MODEL = os.getenv("EMBED_TEXT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 COLLECTION_NAME = "docs"
+CSV_PATH = os.getenv("RAG_CSV_PATH", "data/fashion_items.csv")
+CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "8"))    # LLM calls in flight
+UPSERT_BATCH = int(os.getenv("ENRICH_BATCH", "64"))        # items per encode + upsert
+
+
+def read_items(csv_path=CSV_PATH):
+    with open(csv_path, newline='', encoding="utf-8") as csvfile:
+        for row in csv.DictReader(csvfile):
+            # fashion_items.csv uses name/description; older exports used title/desc
+            title = row.get("title") or row.get("name") or ""
+            desc = row.get("desc") or row.get("description") or ""
+            yield row["id"], title, desc
+
+
+class EnrichStats:
+    def __init__(self):
+        self.items = 0
+        self.failed = []          # (item_id, error)
+        self.llm_s = 0.0          # summed over concurrent calls
+        self.encode_s = 0.0
+        self.upsert_s = 0.0
+        self.wall_s = 0.0
+
+    def report(self, agent):
+        rate = lambda n, s: f"{n / s:.1f}/s" if s else "-"
+        print(f"Enriched {self.items} items, {len(self.failed)} failed in {self.wall_s:.1f}s "
+              f"({rate(self.items, self.wall_s)} end-to-end, {agent.calls} LLM calls, "
+              f"{agent.retries} retries, mean LLM latency "
+              f"{(self.llm_s / max(1, agent.calls)):.2f}s, encode {rate(self.items, self.encode_s)}, "
+              f"upsert {rate(self.items, self.upsert_s)})")
+        if agent.cache is not None:
+            c = agent.cache.stats()
+            print(f"Enrichment cache: {c['hits']} hits, {c['misses']} misses, {c['entries']} entries")
+        for item_id, err in self.failed[:10]:
+            print(f"  ! {item_id}: {err}")
+
+
+async def _enrich_worker(agent, todo, done, stats):
+    while True:
+        item = await todo.get()
+        if item is None:
+            await done.put(None)
+            return
+        item_id, title, desc = item
+        t0 = time.perf_counter()
+        try:
+            metadata_text = await agent.arun(desc)
+        except Exception as e:
+            stats.failed.append((item_id, f"{type(e).__name__}: {e}"))
+            continue
+        finally:
+            stats.llm_s += time.perf_counter() - t0
+        await done.put((item_id, title, f"# {title}\n\n{metadata_text.strip()}"))
+
+
+async def enrich(items, agent, embedder, coll, concurrency=CONCURRENCY, batch_size=UPSERT_BATCH):
+    """Bounded-concurrency LLM enrichment feeding batched encode + upsert.
+
+    Encoding and Chroma writes run in a worker thread so the LLM calls keep
+    flowing while a batch is being committed.
+    """
+    stats = EnrichStats()
+    todo = asyncio.Queue(maxsize=2 * concurrency)
+    done = asyncio.Queue(maxsize=2 * batch_size)
+    workers = [asyncio.create_task(_enrich_worker(agent, todo, done, stats))
+               for _ in range(concurrency)]
+
+    async def feed():
+        for item in items:
+            await todo.put(item)
+        for _ in workers:
+            await todo.put(None)
+
+    def commit(batch):
+        ids, titles, docs = zip(*batch)
+        t0 = time.perf_counter()
+        embs = embedder.encode(list(docs), batch_size=batch_size, normalize_embeddings=True)
+        t1 = time.perf_counter()
+        coll.upsert(ids=list(ids), documents=list(docs), embeddings=embs.tolist(),
+                    # parsed fields make the agent's Category/Style Tags filterable
+                    metadatas=[{"title": t, **parse_metadata(d)} for t, d in zip(titles, docs)])
+        stats.encode_s += t1 - t0
+        stats.upsert_s += time.perf_counter() - t1
+        stats.items += len(batch)
+
+    t0 = time.perf_counter()
+    feeder = asyncio.create_task(feed())
+    batch, running = [], len(workers)
+    while running:
+        res = await done.get()
+        if res is None:
+            running -= 1
+            continue
+        batch.append(res)
+        if len(batch) >= batch_size:
+            await asyncio.to_thread(commit, batch)
+            batch = []
+    if batch:
+        await asyncio.to_thread(commit, batch)
+    await feeder
+    stats.wall_s = time.perf_counter() - t0
+    return stats
 
-embedder = SentenceTransformer(EMBED_MODEL)
-client = chromadb.PersistentClient(path=VDB_DIR)
-coll = client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
 
-agent = MoodboardAgent()
-csv_path = "data/fashion_items.csv"
+def refresh_filters():
+    """Rewrite the catalog search's filter postings so the new agent_category /
+    agent_style_tags are filterable; running servers pick them up on their own."""
+    try:
+        from backend.rag import rag_service
+    except ImportError:  # run as a script from backend/rag
+        print("Run from the repo root, or POST /admin/index/attributes, to refresh search filters.")
+        return
+    if rag_service.refresh_attributes() is None:
+        print("No catalog search index published yet; its first build reads the agent attributes.")
 
-with open(csv_path, newline='', encoding="utf-8") as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        item_id = row["id"]
-        title = row["title"]
-        desc = row["desc"]
 
-        print(f"[→] Enriching: {title}")
-        metadata_text = agent.run(desc)
-        document = f"# {title}\n\n{metadata_text.strip()}"
-        embedding = embedder.encode([document], normalize_embeddings=True).tolist()[0]
+def main():
+    embedder = get_encoder(EMBED_MODEL)
+    client = chromadb.PersistentClient(path=VDB_DIR)
+    coll = client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+    agent = MoodboardAgent()
 
-        coll.upsert(
-            documents=[document],
-            ids=[item_id],
-            metadatas=[{"title": title}]
-        )
+    stats = asyncio.run(enrich(read_items(), agent, embedder, coll))
+    stats.report(agent)
+    refresh_filters()
+    print("\n✅ CSV-based ingestion complete. All items indexed into ChromaDB.")
+    return stats
 
-print("\n✅ CSV-based ingestion complete. All items indexed into ChromaDB.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# backend/rag/meta_store.py
+"""Read-only columnar item metadata, memory-mapped from a single file.
+
+Layout (little-endian):
+
+    b"VMS1" | u32 header length | header JSON | pad to 8
+    offsets     int64[rows * ncols + 1]   cell i*ncols+j spans blob[off[k]:off[k+1]]
+    rows_by_id  int64[id_span]            FAISS id -> row, -1 for gaps (optional)
+    blob        UTF-8 cell values
+
+Opening a store maps the file and parses the header, nothing else; cells are
+decoded on access. Every worker process maps the same pages, so the catalog
+is held once in the page cache instead of once per worker as Python objects.
+Values are stored as text; any character (tabs, newlines) round-trips.
+"""
+from __future__ import annotations
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+
+try:
+    from backend.rag.index_files import atomic_write_bytes
+except ImportError:  # run as a script from backend/rag
+    from index_files import atomic_write_bytes
+
+MAGIC = b"VMS1"
+
+
+def _pad8(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+def write_store(path: str | Path, columns: Sequence[str], rows: Iterable,
+                ids: Sequence[int] | None = None):
+    """Atomically write `rows` (dicts or sequences ordered like `columns`).
+
+    Without `ids` the FAISS id of a row is its position; with `ids` the file
+    carries a dense id -> row table so lookups stay O(1) for sparse ids.
+    """
+    columns = list(columns)
+    chunks, offsets, pos = [], [0], 0
+    n = 0
+    for row in rows:
+        values = [row.get(c) for c in columns] if isinstance(row, dict) else row
+        for v in values:
+            b = ("" if v is None else str(v)).encode("utf-8")
+            chunks.append(b)
+            pos += len(b)
+            offsets.append(pos)
+        n += 1
+    offsets = np.asarray(offsets, dtype="<i8")
+
+    rows_by_id = None
+    if ids is not None:
+        ids = np.asarray(ids, dtype="int64")
+        if len(ids) != n:
+            raise ValueError(f"{len(ids)} ids for {n} rows")
+        rows_by_id = np.full(int(ids.max()) + 1 if n else 0, -1, dtype="<i8")
+        rows_by_id[ids] = np.arange(n)
+
+    header = {"columns": columns, "rows": n,
+              "id_span": None if rows_by_id is None else len(rows_by_id)}
+    hb = json.dumps(header).encode("utf-8")
+    lead = MAGIC + struct.pack("<I", len(hb)) + hb
+    parts = [lead, b"\0" * _pad8(len(lead)), offsets.tobytes()]
+    if rows_by_id is not None:
+        parts.append(rows_by_id.tobytes())
+    parts.extend(chunks)
+    atomic_write_bytes(path, b"".join(parts))
+
+
+class MetaStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:4] != MAGIC:
+            raise ValueError(f"{self.path} is not a metadata store")
+        (hlen,) = struct.unpack_from("<I", self._mm, 4)
+        header = json.loads(self._mm[8:8 + hlen])
+        self.columns: list = header["columns"]
+        self._col = {c: j for j, c in enumerate(self.columns)}
+        self._ncols = len(self.columns)
+        self._rows = header["rows"]
+
+        at = 8 + hlen + _pad8(8 + hlen)
+        n_off = self._rows * self._ncols + 1
+        self._offsets = np.frombuffer(self._mm, dtype="<i8", count=n_off, offset=at)
+        at += 8 * n_off
+        self._rows_by_id = None
+        if header["id_span"] is not None:
+            self._rows_by_id = np.frombuffer(self._mm, dtype="<i8", count=header["id_span"], offset=at)
+            at += 8 * header["id_span"]
+        self._blob_at = at
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _cell(self, row: int, j: int) -> str:
+        k = row * self._ncols + j
+        a, b = int(self._offsets[k]), int(self._offsets[k + 1])
+        return self._mm[self._blob_at + a:self._blob_at + b].decode("utf-8")
+
+    def value(self, row: int, column: str) -> str:
+        return self._cell(row, self._col[column])
+
+    def row(self, row: int) -> dict:
+        return {c: self._cell(row, j) for j, c in enumerate(self.columns)}
+
+    def row_of(self, faiss_id: int) -> int:
+        """Row holding `faiss_id`, or -1."""
+        faiss_id = int(faiss_id)
+        if self._rows_by_id is None:
+            return faiss_id if 0 <= faiss_id < self._rows else -1
+        if 0 <= faiss_id < len(self._rows_by_id):
+            return int(self._rows_by_id[faiss_id])
+        return -1
+
+    def rows_of(self, faiss_ids) -> np.ndarray:
+        """Vectorised `row_of` over an array of ids."""
+        ids = np.asarray(faiss_ids, dtype="int64")
+        if self._rows_by_id is None:
+            return np.where((ids >= 0) & (ids < self._rows), ids, -1)
+        out = np.full(ids.shape, -1, dtype="int64")
+        ok = (ids >= 0) & (ids < len(self._rows_by_id))
+        out[ok] = self._rows_by_id[ids[ok]]
+        return out
+
+    def get(self, faiss_id: int, column: str | None = None):
+        """Full record (or one column) for a FAISS id; None if it isn't stored."""
+        r = self.row_of(faiss_id)
+        if r < 0:
+            return None
+        return self.row(r) if column is None else self.value(r, column)
+
+    def close(self):
+        self._offsets = self._rows_by_id = None
+        self._mm.close()
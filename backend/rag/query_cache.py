@@ -0,0 +1,141 @@
+# backend/rag/query_cache.py
+"""In-process caches for hot queries.
+
+`LRUCache` is bounded by an approximate memory budget rather than an entry
+count, with an optional TTL. `VersionedCache` additionally drops everything
+when `version_fn()` changes, so retrieval results never outlive the index
+or collection they were computed from.
+"""
+from __future__ import annotations
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+EMB_CACHE_MB = float(os.getenv("QUERY_EMB_CACHE_MB", "32"))
+RESULT_CACHE_MB = float(os.getenv("QUERY_RESULT_CACHE_MB", "64"))
+RESULT_TTL_S = float(os.getenv("QUERY_RESULT_TTL_S", "300"))
+VERSION_CHECK_S = float(os.getenv("QUERY_CACHE_VERSION_CHECK_S", "1"))
+
+
+def normalize_query(q: str) -> str:
+    return " ".join((q or "").split()).casefold()
+
+
+def approx_nbytes(value) -> int:
+    """Rough retained size; good enough to keep a cache inside its budget."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_nbytes(k) + approx_nbytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int, ttl_s: float | None = None):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = ttl_s
+        self._data: OrderedDict = OrderedDict()   # key -> (value, nbytes, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[2] is not None and entry[2] < time.monotonic()):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def put(self, key, value, nbytes: int | None = None):
+        size = (nbytes if nbytes is not None else approx_nbytes(value)) + approx_nbytes(key)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl_s if self.ttl_s else None
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, size, expires)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": (self.hits / total) if total else None}
+
+
+class VersionedCache(LRUCache):
+    """LRU/TTL cache that empties itself whenever `version_fn()` changes.
+
+    The version is re-read at most every `check_interval_s`, so a cheap stat()
+    based token is enough.
+    """
+
+    def __init__(self, max_bytes: int, version_fn, ttl_s: float | None = None,
+                 check_interval_s: float = VERSION_CHECK_S):
+        super().__init__(max_bytes, ttl_s)
+        self.version_fn = version_fn
+        self.check_interval_s = check_interval_s
+        self._version = None
+        self._next_check = 0.0
+        self.invalidations = 0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval_s
+        version = self.version_fn()
+        if version != self._version:
+            if self._version is not None:
+                self.invalidations += 1
+            self._version = version
+            self.clear()
+
+    def get(self, key):
+        self._check_version()
+        return super().get(key)
+
+    def put(self, key, value, nbytes: int | None = None):
+        self._check_version()
+        super().put(key, value, nbytes)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "invalidations": self.invalidations}
+
+
+def mb(x: float) -> int:
+    return int(x * 1024 * 1024)
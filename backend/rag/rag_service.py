@@ -1,126 +1,609 @@
 # backend/rag/rag_service.py
 from __future__ import annotations
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 import csv
-import faiss
+import hashlib
+import json
+import os
+import threading
+import time
 import numpy as np
-from io import BytesIO
-from PIL import Image
-from sentence_transformers import SentenceTransformer
+
+# faiss (via ann_index) and torch/sentence-transformers are imported inside the
+# functions that need them: importing this module must not load either
+from backend.rag.attr_index import AttributeIndex, write_attr_index
+from backend.rag.embed_batcher import MicroBatcher
+from backend.rag.encoders import ENCODER_BACKEND, get_encoder
+from backend.rag.image_search import content_key, open_image
+from backend.rag.index_files import (atomic_write_bytes, atomic_write_json, file_signature,
+                                     generation_name, prune_generations)
+from backend.rag.meta_store import MetaStore, write_store
+from backend.rag.query_cache import (LRUCache, VersionedCache, normalize_query, mb,
+                                     EMB_CACHE_MB, RESULT_CACHE_MB, RESULT_TTL_S)
+from backend.agents.moodboard_agent import parse_metadata
 
 # ---- paths ----
 DATA_DIR = Path(__file__).resolve().parent / "data"
 CSV_PATH = DATA_DIR / "fashion_items.csv"
 INDEX_DIR = DATA_DIR / "rag_index"
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
-FAISS_FILE = INDEX_DIR / "clip_text.index"
-META_FILE = INDEX_DIR / "meta.tsv"
+# points at the live generation: clip_text-N.index, items-N.store (replaces the
+# old meta.tsv), vectors-N.npy (float32 re-scoring copy for quantized indexes)
+# and attrs-N.json/.npy (filter postings)
+MANIFEST_FILE = INDEX_DIR / "manifest.json"
+REBUILD_FILE = INDEX_DIR / "rebuild.json"   # exists while some worker rebuilds; holds its progress
+# enriched catalog docs (ingest_with_agent) supply agent_category / agent_style_tags
+VDB_DIR = Path(os.getenv("RAG_VDB_DIR", Path(__file__).resolve().parent / "vectordb"))
+AGENT_COLLECTION = os.getenv("RAG_COLLECTION", "docs")
+
+# ---- rebuilds ----
+# how often a worker looks for a new generation or a changed CSV
+RELOAD_CHECK_S = float(os.getenv("RAG_RELOAD_CHECK_S", "2"))
+# rebuild in the background when fashion_items.csv changes (else only via rebuild())
+AUTO_REBUILD = os.getenv("RAG_AUTO_REBUILD", "1") == "1"
+BUILD_BATCH = int(os.getenv("RAG_BUILD_BATCH", "256"))
+# a rebuild lock whose progress hasn't moved for this long belongs to a dead worker
+REBUILD_STALE_S = float(os.getenv("RAG_REBUILD_STALE_S", "900"))
 
 # ---- model: CLIP (text & image in same space) ----
-_model = None
-def model() -> SentenceTransformer:
-    global _model
-    if _model is None:
-        _model = SentenceTransformer("clip-ViT-B-32")
-    return _model
-
-_items: List[Tuple[str, str, str]] = []   # (id, title, desc)
-_index = None
-
-def _load_csv() -> List[Tuple[str, str, str]]:
-    items = []
+def model():
+    # the process-wide copy, shared with image_search; ENCODER_BACKEND: torch / int8 / onnx
+    return get_encoder("clip-ViT-B-32")
+
+def _encode(items) -> np.ndarray:
+    return model().encode(items, convert_to_numpy=True, normalize_embeddings=True)
+
+# concurrent text/image queries share one batched CLIP encode
+_batcher = None
+def batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(_encode, name="clip")
+    return _batcher
+
+def _results_version():
+    gen = _live
+    return None if gen is None else (gen.number, file_signature(gen.attrs_path.with_suffix(".json")))
+
+# hot queries skip the encoder (embedding LRU) and the index (result cache);
+# results are dropped whenever a new generation or new filter postings go live
+_emb_cache = LRUCache(mb(EMB_CACHE_MB))
+_results_cache = VersionedCache(mb(RESULT_CACHE_MB), _results_version, ttl_s=RESULT_TTL_S)
+
+_filter_counts = {"exact": 0, "ann": 0, "empty": 0}
+
+def cache_stats() -> dict:
+    return {"embeddings": _emb_cache.stats(), "results": _results_cache.stats(),
+            "filtered_searches": dict(_filter_counts)}
+
+class Generation:
+    """One published index with its metadata store (row i = FAISS id i),
+    re-scoring vectors and filter postings. Swapped in as a whole: a search
+    takes one Generation and never mixes ids of one with rows of another."""
+
+    def __init__(self, manifest: dict):
+        from backend.rag import ann_index
+        self.manifest = manifest
+        self.number: int = manifest["generation"]
+        self.index = ann_index.read_index(INDEX_DIR / manifest["index_file"])
+        self.store = MetaStore(INDEX_DIR / manifest["store_file"])
+        if len(self.store) != self.index.ntotal:
+            raise ValueError(f"generation {self.number}: {len(self.store)} rows for {self.index.ntotal} vectors")
+        self.vectors = None   # memory-mapped, only for quantized index kinds
+        if manifest.get("vectors_file"):
+            self.vectors = ann_index.load_vectors(INDEX_DIR / manifest["vectors_file"], rows=self.index.ntotal)
+        if self.vectors is None:
+            # exact filtered search reads vectors back from the index; set up
+            # here, before any thread searches it
+            ann_index.enable_reconstruct(self.index)
+        self.attrs_path = INDEX_DIR / generation_name("attrs", self.number, "")
+        self.attrs: AttributeIndex | None = None
+        self.attrs_sig = None   # signature of the attrs JSON that `attrs` was loaded from
+        self.attrs_lock = threading.RLock()
+
+_live: Generation | None = None
+_swap_lock = threading.Lock()
+_manifest_sig = None
+# marked once a rebuild for them has started (or nothing needed rebuilding):
+# a change whose rebuild was refused, because one was already running, is
+# looked at again on the next check
+_csv_seen = None   # CSV signature last compared with the live generation's
+_csv_hash = (None, None)   # (signature, sha256): a pending change is hashed once
+_encoder_checked = None   # generation number whose encoder was last compared
+_next_check = 0.0
+
+_rebuild_lock = threading.Lock()
+_rebuild = {"running": False, "phase": None, "done": 0, "total": 0, "started_at": None,
+            "finished_at": None, "build_s": None, "error": None}
+
+# {"category": ["blazer", "dress"], "style_tags": ["red"]}: see attr_index
+Filters = Optional[Dict[str, Sequence[str]]]
+
+def _title(rec: dict) -> str:
+    return rec.get("name") or rec.get("title") or ""
+
+def _load_csv() -> Tuple[List[str], List[dict]]:
+    """All CSV columns, for rows that have a name/title."""
     if not CSV_PATH.exists():
-        return items
+        return [], []
     with open(CSV_PATH, newline="", encoding="utf-8") as f:
         rdr = csv.DictReader(f)
-        for row in rdr:
-            iid = (row.get("id") or "").strip()
-            title = (row.get("title") or "").strip()
-            desc = (row.get("desc") or "").strip()
-            if title:
-                items.append((iid, title, desc))
-    return items
-
-def _save_meta(items: List[Tuple[str, str, str]]):
-    with open(META_FILE, "w", encoding="utf-8") as f:
-        f.write("id\ttitle\tdesc\n")
-        for iid, t, d in items:
-            f.write(f"{iid}\t{t}\t{d}\n")
-
-def _load_meta() -> List[Tuple[str, str, str]]:
-    if not META_FILE.exists():
-        return []
-    lines = META_FILE.read_text(encoding="utf-8").splitlines()[1:]
-    out = []
-    for line in lines:
-        parts = line.split("\t")
-        if len(parts) == 3:
-            out.append((parts[0], parts[1], parts[2]))
-    return out
+        rows = [{k: (v or "").strip() for k, v in row.items() if k} for row in rdr]
+        columns = [c for c in (rdr.fieldnames or []) if c]
+    return columns, [r for r in rows if _title(r)]
 
-def _build_index(items: List[Tuple[str, str, str]]):
-    texts = [f"{title}. {desc}".strip() for _, title, desc in items]
-    embs = model().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-    d = embs.shape[1]
-    index = faiss.IndexFlatIP(d)
-    index.add(embs.astype("float32"))
-    return index
-
-def _save_index(index):
-    out_path = FAISS_FILE
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, str(out_path))
-
-def _load_index():
-    if not FAISS_FILE.exists():
+def _read_json(path: Path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
         return None
-    return faiss.read_index(str(FAISS_FILE))
 
-def _ensure_ready():
-    global _items, _index
-    if _index is not None:
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _maybe_reload(force: bool = False, rebuild_stale: bool = True):
+    """Swap in a newer published generation; start a rebuild if the CSV changed.
+
+    Checked at most every RELOAD_CHECK_S; every worker process picks up the
+    generation whichever worker built it. `rebuild_stale=False` only swaps.
+    """
+    global _live, _manifest_sig, _next_check
+    now = time.monotonic()
+    if not force and now < _next_check:
         return
-    idx = _load_index()
-    meta = _load_meta()
-    if idx and meta:
-        _items, _index = meta, idx
+    _next_check = now + RELOAD_CHECK_S
+    sig = file_signature(MANIFEST_FILE)
+    if sig is not None and sig != _manifest_sig:
+        with _swap_lock:
+            if sig != _manifest_sig:
+                try:
+                    gen = Generation(_read_json(MANIFEST_FILE))
+                except Exception as e:   # half-deleted old generation, corrupt file: keep serving
+                    print(f"[rag_service] can't load {MANIFEST_FILE.name}: {type(e).__name__}: {e}")
+                else:
+                    _live = gen
+                _manifest_sig = sig
+    if AUTO_REBUILD and rebuild_stale:
+        _rebuild_if_stale()
+
+def _rebuild_if_stale():
+    global _csv_seen, _encoder_checked
+    csv_sig, enc_gen = _csv_changed(), _encoder_changed()
+    if (csv_sig is not None or enc_gen is not None) and rebuild():
+        if csv_sig is not None:
+            _csv_seen = csv_sig
+        if enc_gen is not None:
+            _encoder_checked = enc_gen
+
+def _csv_changed():
+    """The CSV's signature if its contents differ from the live generation's, else None."""
+    global _csv_seen, _csv_hash
+    gen = _live
+    sig = file_signature(CSV_PATH)
+    if gen is None or sig is None or sig == _csv_seen:
+        return None
+    if list(sig) != gen.manifest.get("csv_signature"):
+        # touched is not changed: compare contents before re-embedding everything
+        if _csv_hash[0] != sig:
+            _csv_hash = (sig, _file_sha256(CSV_PATH))
+        if _csv_hash[1] != gen.manifest.get("csv_sha256"):
+            return sig
+    _csv_seen = sig
+    return None
+
+def _encoder_changed():
+    """The live generation's number if it was embedded with another ENCODER_BACKEND, else None:
+    its vectors don't mix with this process's query vectors."""
+    global _encoder_checked
+    gen = _live
+    if gen is None or gen.number == _encoder_checked:
+        return None
+    if gen.manifest.get("encoder", "torch") != ENCODER_BACKEND:
+        return gen.number
+    _encoder_checked = gen.number
+    return None
+
+def _current(build: bool = True) -> Generation | None:
+    """The live generation. With none published yet, `build` starts one in the background."""
+    _maybe_reload()
+    gen = _live
+    if gen is None and build:
+        rebuild()
+    return gen
+
+def _progress(**kw):
+    _rebuild.update(kw)
+    # rewriting the file is also the heartbeat that keeps other workers off the lock
+    atomic_write_json(REBUILD_FILE, {"pid": os.getpid(),
+                                     **{k: _rebuild[k] for k in ("phase", "done", "total", "started_at")}})
+
+def _rebuild_alive() -> bool:
+    """A rebuild lock exists and its owner wrote progress within REBUILD_STALE_S."""
+    sig = file_signature(REBUILD_FILE)
+    return sig is not None and time.time() - sig[0] / 1e9 < REBUILD_STALE_S
+
+def _take_rebuild_lock() -> bool:
+    """Cross-worker: only the process that creates REBUILD_FILE rebuilds."""
+    for _ in range(2):
+        try:
+            os.close(os.open(REBUILD_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            if _rebuild_alive():
+                return False
+            REBUILD_FILE.unlink(missing_ok=True)   # its owner died mid-build
+    return False
+
+def rebuild() -> bool:
+    """Start a background rebuild from CSV_PATH; False if one is already running (in any worker).
+
+    The live generation keeps serving until the new one is published; then
+    every worker swaps to it.
+    """
+    with _rebuild_lock:
+        if _rebuild["running"] or not _take_rebuild_lock():
+            return False
+        _rebuild.update(running=True, error=None, finished_at=None, build_s=None)
+        _progress(phase="loading", done=0, total=0, started_at=time.time())
+    threading.Thread(target=_run_rebuild, name="rag-rebuild", daemon=True).start()
+    return True
+
+def _run_rebuild():
+    from backend.rag import ann_index
+    t0 = time.perf_counter()
+    try:
+        csv_sig = file_signature(CSV_PATH)
+        csv_sha = _file_sha256(CSV_PATH) if csv_sig else None
+        columns, rows = _load_csv()
+        if not rows:
+            raise ValueError(f"no catalog rows in {CSV_PATH}")
+        texts = [f"{_title(r)}. {r.get('description') or r.get('desc') or ''}".strip() for r in rows]
+        _progress(phase="encoding", total=len(texts))
+        parts = []
+        for s in range(0, len(texts), BUILD_BATCH):
+            # small chunks: live queries on the shared model get in between
+            parts.append(model().encode_bulk(texts[s:s + BUILD_BATCH],
+                                             normalize_embeddings=True).astype("float32"))
+            _progress(done=min(s + BUILD_BATCH, len(texts)))
+        embs = np.vstack(parts)
+        _progress(phase="indexing")
+        # RAG_INDEX_TYPE picks the index kind; positions stay the row ids
+        index = ann_index.build_index(embs)
+        _progress(phase="attributes")
+        attr_rows = [dict(r) for r in rows]
+        _agent_attributes(attr_rows)
+        _progress(phase="publishing")
+        _publish(index, embs, columns, rows, attr_rows, csv_sig, csv_sha, time.perf_counter() - t0)
+        _maybe_reload(force=True, rebuild_stale=False)
+        _rebuild.update(phase="done")
+    except Exception as e:
+        _rebuild.update(phase="failed", error=f"{type(e).__name__}: {e}")
+        print(f"[rag_service] rebuild failed: {_rebuild['error']}")
+    finally:
+        _rebuild.update(running=False, finished_at=time.time(), build_s=round(time.perf_counter() - t0, 3))
+        REBUILD_FILE.unlink(missing_ok=True)
+    if AUTO_REBUILD and _rebuild["phase"] == "done":
+        # the CSV may have been edited while this build embedded the previous version
+        _rebuild_if_stale()
+
+def _publish(index, embs, columns, rows, attr_rows, csv_sig, csv_sha, build_s):
+    """Write the generation's files under new names, then swap the manifest to point at them.
+
+    The filter postings are written with the rest, so no worker builds them
+    on a search.
+    """
+    import faiss
+    from backend.rag import ann_index
+    generation = ((_read_json(MANIFEST_FILE) or {}).get("generation") or 0) + 1
+    index_file = generation_name("clip_text", generation, ".index")
+    store_file = generation_name("items", generation, ".store")
+    atomic_write_bytes(INDEX_DIR / index_file, faiss.serialize_index(index).tobytes())
+    write_store(INDEX_DIR / store_file, columns, rows)
+    vectors_file = None
+    if ann_index.needs_vectors(ann_index.index_kind(index)):
+        vectors_file = generation_name("vectors", generation, ".npy")
+        ann_index.save_vectors(INDEX_DIR / vectors_file, embs)
+    write_attr_index(INDEX_DIR / generation_name("attrs", generation, ""), attr_rows, n_ids=index.ntotal)
+    atomic_write_json(MANIFEST_FILE, {
+        "generation": generation,
+        "index_file": index_file,
+        "store_file": store_file,
+        "vectors_file": vectors_file,
+        "index_type": ann_index.index_kind(index),   # as built: small catalogs fall back to flat
+        "encoder": ENCODER_BACKEND,
+        "items": len(rows),
+        "csv_signature": list(csv_sig) if csv_sig else None,
+        "csv_sha256": csv_sha,
+        "built_at": time.time(),
+        "build_s": round(build_s, 3),
+    })
+    # a worker that hasn't swapped yet may still read the previous generation
+    for prefix, suffix in (("clip_text", ".index"), ("items", ".store"), ("vectors", ".npy"),
+                           ("attrs", ".json"), ("attrs", ".npy")):
+        prune_generations(INDEX_DIR, prefix, suffix, keep=2)
+
+def index_status() -> dict:
+    """Live generation and rebuild progress, for the admin endpoint."""
+    gen = _current(build=False)
+    out = {"generation": None, "items": 0, "pid": os.getpid()}
+    if gen is not None:
+        m = gen.manifest
+        from backend.rag import ann_index
+        out.update(generation=gen.number, items=gen.index.ntotal, index_type=ann_index.index_kind(gen.index),
+                   encoder=m.get("encoder", "torch"), built_at=m.get("built_at"), build_s=m.get("build_s"))
+    other = _read_json(REBUILD_FILE) if _rebuild_alive() else None
+    if other:
+        out["rebuild"] = {"running": True, **other}
+    else:
+        out["rebuild"] = {k: _rebuild[k] for k in ("running", "phase", "done", "total", "started_at",
+                                                   "finished_at", "build_s", "error")}
+    return out
+
+def preload():
+    """Load the model and map the live generation without running either.
+
+    Called before workers fork: they inherit the weights and mappings, and
+    no torch/OpenMP thread pool is started in the parent. With nothing
+    published yet, or a CSV that changed while the server was down, the
+    first worker to warm up starts the build.
+    """
+    model()
+    _maybe_reload(force=True, rebuild_stale=False)
+
+def warmup():
+    """One query through the micro-batcher and the index (results not cached)."""
+    _maybe_reload(force=True)   # a preloaded worker inherited the parent's check time
+    gen = _current()
+    if gen is not None:
+        _search_scored(batcher().encode("warmup", kind="text"), 1, gen=gen)
+
+def _agent_attributes(rows: List[dict]):
+    """Add agent_category / agent_style_tags parsed from the enriched docs, when there are any."""
+    ids = [r["id"] for r in rows if r.get("id")]
+    if not ids or not (VDB_DIR / "chroma.sqlite3").exists():
         return
-    items = _load_csv()
-    if not items:
-        _items, _index = [], None
+    try:
+        import chromadb
+        coll = chromadb.PersistentClient(path=str(VDB_DIR)).get_collection(AGENT_COLLECTION)
+        res = coll.get(ids=ids, include=["documents"])
+    except Exception as e:
+        print(f"[rag_service] agent attributes unavailable: {type(e).__name__}: {e}")
         return
-    idx = _build_index(items)
-    _save_index(idx)
-    _save_meta(items)
-    _items, _index = items, idx
-
-def _search(vec: np.ndarray, k: int = 8) -> List[int]:
-    _ensure_ready()
-    if _index is None or not _items:
-        return []
-    if vec.ndim == 1:
-        vec = vec[None, :]
-    D, I = _index.search(vec.astype("float32"), k)
-    return [int(i) for i in I[0] if i != -1]
+    docs = dict(zip(res["ids"], res["documents"]))
+    for r in rows:
+        parsed = parse_metadata(docs.get(r.get("id"), ""))
+        r["agent_category"] = parsed.get("category", "")
+        r["agent_style_tags"] = parsed.get("style_tags", "")
+
+def refresh_attributes(gen: Generation | None = None):
+    """Rewrite the live generation's filter postings, e.g. after ingest_with_agent
+    enriched the catalog. Every worker picks them up on its next filtered search."""
+    if gen is None:
+        _maybe_reload(force=True, rebuild_stale=False)   # may run outside the server
+        gen = _live
+    if gen is None:
+        return None
+    with gen.attrs_lock:
+        rows = [gen.store.row(i) for i in range(len(gen.store))]
+        _agent_attributes(rows)
+        write_attr_index(gen.attrs_path, rows, n_ids=gen.index.ntotal)
+        gen.attrs_sig = file_signature(gen.attrs_path.with_suffix(".json"))
+        gen.attrs = AttributeIndex(gen.attrs_path)
+    return gen.attrs
+
+def attributes(gen: Generation | None = None) -> AttributeIndex | None:
+    """Filter postings for a generation (the live one by default).
+
+    Published with the generation; reloaded when their file changes, i.e.
+    after a `refresh_attributes` in any process.
+    """
+    gen = gen or _current()
+    if gen is None:
+        return None
+    sig = file_signature(gen.attrs_path.with_suffix(".json"))
+    if sig is not None and sig == gen.attrs_sig:
+        return gen.attrs
+    with gen.attrs_lock:
+        if sig is not None and sig != gen.attrs_sig:
+            try:
+                attrs = AttributeIndex(gen.attrs_path)
+            except (OSError, ValueError):   # being rewritten: keep the loaded ones
+                attrs = gen.attrs
+            else:
+                gen.attrs_sig = sig
+            gen.attrs = attrs
+        if gen.attrs is None or gen.attrs.n_ids != gen.index.ntotal:
+            # a generation published without postings (before they were built with it)
+            print(f"[rag_service] generation {gen.number} has no filter postings; building them")
+            refresh_attributes(gen)
+    return gen.attrs
+
+def filter_values(attr: str) -> Dict[str, int]:
+    """Known values of a filter attribute with their item counts."""
+    attrs = attributes()
+    return attrs.values(attr) if attrs else {}
+
+def _search_scored_batch(Q: np.ndarray, k: int = 8, include: Filters = None,
+                         exclude: Filters = None, gen: Generation | None = None) -> List[List[Tuple[int, float]]]:
+    """One matrix search for all rows of Q; (row id, score) hits per query.
+
+    Row ids belong to `gen` (the live generation by default): pass the same
+    one to `_records`.
+    """
+    from backend.rag import ann_index
+    gen = gen or _current()
+    if Q.ndim == 1:
+        Q = Q[None, :]
+    if gen is None:
+        return [[] for _ in range(len(Q))]
+    if include or exclude:
+        # filter inside the search instead of over-fetching and dropping rows
+        allowed = attributes(gen).mask(include, exclude)
+        D, I, strategy = ann_index.search_filtered(gen.index, Q, k, allowed, vectors=gen.vectors)
+        _filter_counts[strategy] += 1
+    else:
+        D, I = ann_index.search(gen.index, Q, k, vectors=gen.vectors)
+    return [[(int(i), float(d)) for d, i in zip(D[r], I[r]) if i != -1] for r in range(len(Q))]
+
+def _search_scored(vec: np.ndarray, k: int = 8, include: Filters = None,
+                   exclude: Filters = None, gen: Generation | None = None) -> List[Tuple[int, float]]:
+    return _search_scored_batch(vec, k, include, exclude, gen)[0]
+
+def _search(vec: np.ndarray, k: int = 8, include: Filters = None, exclude: Filters = None,
+            gen: Generation | None = None) -> List[int]:
+    return [i for i, _ in _search_scored(vec, k, include, exclude, gen)]
+
+def _filter_key(include: Filters, exclude: Filters):
+    freeze = lambda f: tuple(sorted((a, (v,) if isinstance(v, str) else tuple(sorted(v)))
+                                    for a, v in (f or {}).items()))
+    return freeze(include), freeze(exclude)
+
+def _records(hits: List[Tuple[int, float]], gen: Generation) -> List[dict]:
+    return [{**gen.store.row(i), "score": score} for i, score in hits]
+
+def _query_vec(query: str) -> np.ndarray:
+    key = normalize_query(query)
+    q = _emb_cache.get(key)
+    if q is None:
+        q = batcher().encode(query, kind="text")
+        _emb_cache.put(key, q)
+    return q
+
+def _query_vecs(queries: List[str]) -> np.ndarray:
+    """Embeddings for many queries: cache hits plus one encode call for the rest."""
+    keys = [normalize_query(q) for q in queries]
+    vecs = [_emb_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        for i, v in zip(missing, _encode([queries[i] for i in missing])):
+            vecs[i] = v
+            _emb_cache.put(keys[i], v)
+    return np.vstack(vecs).astype("float32")
 
 # -------- public api used by your routes --------
-def text_search(query: str, k: int = 8) -> List[str]:
-    _ensure_ready()
-    if not query.strip() or _index is None:
+def text_search(query: str, k: int = 8, include: Filters = None, exclude: Filters = None) -> List[str]:
+    gen = _current()
+    if not query.strip() or gen is None:
         return []
-    q = model().encode([query], convert_to_numpy=True, normalize_embeddings=True)
-    ids = _search(q[0], k=k)
-    return [_items[i][1] for i in ids]  # return titles for now
+    key = (normalize_query(query), k, *_filter_key(include, exclude))
+    hit = _results_cache.get(key)
+    if hit is not None:
+        return list(hit)
+    ids = _search(_query_vec(query), k, include, exclude, gen)
+    titles = [_title(gen.store.row(i)) for i in ids]
+    _results_cache.put(key, tuple(titles))
+    return titles
+
+def text_search_records(query: str, k: int = 8, include: Filters = None,
+                        exclude: Filters = None) -> List[dict]:
+    """Full catalog rows (every CSV column) plus "score", best first.
 
-def image_search(image_bytes: bytes, k: int = 8) -> List[str]:
-    _ensure_ready()
-    if _index is None:
+    `include` keeps items matching any listed value of every given attribute,
+    `exclude` drops items matching any listed value, e.g.
+    include={"category": ["blazer"]}, exclude={"style_tags": ["red"]}.
+    """
+    gen = _current()
+    if not query.strip() or gen is None:
         return []
-    try:
-        img = Image.open(BytesIO(image_bytes)).convert("RGB")
-    except Exception:
+    key = ("records", normalize_query(query), k, *_filter_key(include, exclude))
+    hit = _results_cache.get(key)
+    if hit is not None:
+        return [dict(r) for r in hit]
+    recs = _records(_search_scored(_query_vec(query), k, include, exclude, gen), gen)
+    _results_cache.put(key, tuple(recs))
+    return recs
+
+def text_search_batch(queries: List[str], k: int = 8, include: Filters = None,
+                      exclude: Filters = None) -> List[List[dict]]:
+    """`text_search_records` for many queries, in input order.
+
+    Cached queries are answered from the result cache; the rest share one
+    CLIP encode and one matrix index search.
+    """
+    gen = _current()
+    out: List[List[dict]] = [[] for _ in queries]
+    if gen is None:
+        return out
+    fkey = _filter_key(include, exclude)
+    todo = []
+    for i, q in enumerate(queries):
+        if not q.strip():
+            continue
+        hit = _results_cache.get(("records", normalize_query(q), k, *fkey))
+        if hit is not None:
+            out[i] = [dict(r) for r in hit]
+        else:
+            todo.append(i)
+    if todo:
+        Q = _query_vecs([queries[i] for i in todo])
+        for i, hits in zip(todo, _search_scored_batch(Q, k, include, exclude, gen)):
+            out[i] = _records(hits, gen)
+            _results_cache.put(("records", normalize_query(queries[i]), k, *fkey), tuple(out[i]))
+    return out
+
+def _image_vec(image_bytes: bytes):
+    # decoded from memory and downscaled; repeated uploads hit the cache by content hash
+    key = ("image", content_key(image_bytes))
+    q = _emb_cache.get(key)
+    if q is None:
+        try:
+            img = open_image(image_bytes)
+        except Exception:
+            return None
+        q = batcher().encode(img, kind="image")
+        _emb_cache.put(key, q)
+    return q
+
+def image_search(image_bytes: bytes, k: int = 8, include: Filters = None,
+                 exclude: Filters = None) -> List[str]:
+    gen = _current()
+    if gen is None:
+        return []
+    q = _image_vec(image_bytes)
+    if q is None:
+        return []
+    return [_title(gen.store.row(i)) for i in _search(q, k, include, exclude, gen)]  # titles
+
+def image_search_records(image_bytes: bytes, k: int = 8, include: Filters = None,
+                         exclude: Filters = None) -> List[dict]:
+    gen = _current()
+    if gen is None:
+        return []
+    q = _image_vec(image_bytes)
+    if q is None:
         return []
-    q = model().encode([img], convert_to_numpy=True, normalize_embeddings=True)
-    ids = _search(q[0], k=k)
-    return [_items[i][1] for i in ids]  # titles
+    return _records(_search_scored(q, k, include, exclude, gen), gen)
+
+def image_search_batch(images: List[bytes], k: int = 8, include: Filters = None,
+                       exclude: Filters = None) -> List[List[dict]]:
+    """`image_search_records` for many images; undecodable ones get []."""
+    gen = _current()
+    out: List[List[dict]] = [[] for _ in images]
+    if gen is None:
+        return out
+    keys = [("image", content_key(b)) for b in images]
+    vecs = [_emb_cache.get(key) for key in keys]
+    decoded = []
+    for i, b in enumerate(images):
+        if vecs[i] is not None:
+            continue
+        try:
+            decoded.append((i, open_image(b)))
+        except Exception:
+            continue
+    if decoded:
+        for (i, _), v in zip(decoded, _encode([img for _, img in decoded])):
+            vecs[i] = v
+            _emb_cache.put(keys[i], v)
+    ok = [i for i, v in enumerate(vecs) if v is not None]
+    if ok:
+        Q = np.vstack([vecs[i] for i in ok]).astype("float32")
+        for i, hits in zip(ok, _search_scored_batch(Q, k, include, exclude, gen)):
+            out[i] = _records(hits, gen)
+    return out
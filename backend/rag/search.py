@@ -1,9 +1,15 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-import chromadb
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+
+try:
+    from backend.rag.encoders import get_encoder
+    from backend.openai_config import openai_base_url
+except ImportError:  # run as a script: python rag/search.py
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from encoders import get_encoder
+    from openai_config import openai_base_url
 
 # load root .env
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
@@ -15,17 +21,34 @@ EMBED_TEXT_MODEL = os.getenv("EMBED_TEXT_MODEL", "sentence-transformers/all-Mini
 VDB_DIR = os.getenv("RAG_VDB_DIR", "rag/vectordb")
 COLLECTION_NAME = os.getenv("RAG_COLLECTION", "docs")
 
-client = OpenAI()
-embedder = SentenceTransformer(EMBED_TEXT_MODEL)
+# chromadb, sentence-transformers and openai are imported and constructed on
+# first use, so importing retrieve/build_payload costs nothing
+_client = None
+_coll = None
+
+def client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(base_url=openai_base_url())
+    return _client
+
+def embedder():
+    return get_encoder(EMBED_TEXT_MODEL)
 
-# Use PersistentClient in chromadb 0.5.x; persistence is automatic
-chroma = chromadb.PersistentClient(path=VDB_DIR)
-coll = chroma.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+def collection():
+    global _coll
+    if _coll is None:
+        import chromadb
+        # Use PersistentClient in chromadb 0.5.x; persistence is automatic
+        chroma = chromadb.PersistentClient(path=VDB_DIR)
+        _coll = chroma.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+    return _coll
 
 def retrieve(query, k=TOP_K):
     # Ensure we pass a plain Python list of floats to Chroma
-    q_emb = embedder.encode([query], normalize_embeddings=True).tolist()[0]
-    res = coll.query(
+    q_emb = embedder().encode([query], normalize_embeddings=True).tolist()[0]
+    res = collection().query(
         query_embeddings=[q_emb],
         n_results=k,
         include=["documents", "metadatas"]
@@ -65,7 +88,7 @@ def stream_answer(payload):
         {"role": "user", "content": f"Query: {payload['query']}\n\nContexts:\n{context_blob}"},
     ]
 
-    stream = client.chat.completions.create(
+    stream = client().chat.completions.create(
         model=OPENAI_MODEL,
         messages=messages,
         temperature=float(payload["params"].get("temperature", TEMPERATURE)),
@@ -1,11 +1,23 @@
 import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
 from sse_starlette.sse import EventSourceResponse
-import chromadb
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+
+from backend.rag.answer_cache import AnswerCache, answer_key
+from backend.rag.embed_batcher import MicroBatcher
+from backend.rag.encoders import get_encoder, registry_stats
+from backend.openai_config import openai_base_url
+from backend.rag.index_files import file_signature
+from backend.rag.singleflight import StreamFlights
+from backend.rag.query_cache import (LRUCache, VersionedCache, normalize_query, mb,
+                                     EMB_CACHE_MB, RESULT_CACHE_MB, RESULT_TTL_S)
 
 # Load .env
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[2] / ".env")
@@ -13,25 +25,167 @@ load_dotenv(dotenv_path=Path(__file__).resolve().parents[2] / ".env")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 EMBED_TEXT_MODEL = os.getenv("EMBED_TEXT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 VDB_DIR = os.getenv("RAG_VDB_DIR", "rag/vectordb")
+RETRIEVE_WORKERS = int(os.getenv("RAG_RETRIEVE_WORKERS", "16"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # each worker warms up before it accepts its first request
+    await asyncio.get_running_loop().run_in_executor(retrieve_pool, warmup)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+# torch/sentence-transformers, chromadb and openai are imported on first use:
+# importing this module (tests, --reload) stays fast, and lifespan warmup pays
+# for them before a worker takes traffic
+def embedder():
+    return get_encoder(EMBED_TEXT_MODEL)
+
+# the HTTP client holds a connection pool, which must not cross fork(): one per worker
+_client = None
+def openai_client():
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(base_url=openai_base_url())
+    return _client
+
+def preloaded_app():
+    """App factory for `main.py --prod`: load the embedder once in the gunicorn
+    master, so forked workers share the weights copy-on-write."""
+    embedder()
+    return app
 
-app = FastAPI()
-client = OpenAI()
-embedder = SentenceTransformer(EMBED_TEXT_MODEL)
-chroma = chromadb.PersistentClient(path=VDB_DIR)
-coll = chroma.get_or_create_collection("docs", metadata={"hnsw:space": "cosine"})
+# Chroma holds SQLite handles and threads, which must not cross fork(), so
+# the collection is opened lazily in each worker
+_coll = None
+_coll_lock = threading.Lock()
+def collection():
+    global _coll
+    if _coll is None:
+        with _coll_lock:
+            if _coll is None:
+                import chromadb
+                chroma = chromadb.PersistentClient(path=VDB_DIR)
+                _coll = chroma.get_or_create_collection("docs", metadata={"hnsw:space": "cosine"})
+    return _coll
+# retrieve() threads block on this; concurrent queries share one batched encode
+text_batcher = MicroBatcher(
+    lambda texts: embedder().encode(texts, convert_to_numpy=True, normalize_embeddings=True),
+    name="minilm",
+)
+
+# Chroma persists every write to chroma.sqlite3 (+ WAL), so its stat() is a
+# cheap collection version: cached results die as soon as anything is ingested
+_chroma_db = Path(VDB_DIR) / "chroma.sqlite3"
+def collection_version():
+    return (file_signature(_chroma_db), file_signature(f"{_chroma_db}-wal"))
+
+emb_cache = LRUCache(mb(EMB_CACHE_MB))
+results_cache = VersionedCache(mb(RESULT_CACHE_MB), collection_version, ttl_s=RESULT_TTL_S)
+answer_cache = AnswerCache(collection_version)
+flights = StreamFlights()
+
+# encode + Chroma query are CPU-bound; keep them off the event loop, in their
+# own pool so they can't starve the default executor used by FastAPI
+retrieve_pool = ThreadPoolExecutor(max_workers=RETRIEVE_WORKERS, thread_name_prefix="retrieve")
 
 @app.get("/")
 def root():
     return {"message": "Vintell RAG API is running. Visit /docs for Swagger UI."}
 
+def embed_query(query):
+    key = normalize_query(query)
+    q_emb = emb_cache.get(key)
+    if q_emb is None:
+        q_emb = text_batcher.encode(query).tolist()
+        emb_cache.put(key, q_emb)
+    return q_emb
+
 def retrieve(query, k):
-    q_emb = embedder.encode([query], normalize_embeddings=True).tolist()[0]
-    res = coll.query(query_embeddings=[q_emb], n_results=k, include=["documents","metadatas"])
-    return [{"text": d, "meta": m} for d, m in zip(res["documents"][0], res["metadatas"][0])]
+    key = normalize_query(query)
+    hit = results_cache.get((key, k))
+    if hit is not None:
+        return list(hit)
+    q_emb = embed_query(query)
+    res = collection().query(query_embeddings=[q_emb], n_results=k, include=["documents","metadatas"])
+    out = [{"id": i, "text": d, "meta": m}
+           for i, d, m in zip(res["ids"][0], res["documents"][0], res["metadatas"][0])]
+    results_cache.put((key, k), tuple(out))
+    return out
+
+async def aretrieve(query, k):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieve_pool, retrieve, query, k)
+
+_readiness = {"ready": False, "warmup_s": None, "error": None}
+
+def warmup():
+    """One encode + collection query, bypassing the caches, so lazy init isn't paid by a user."""
+    t0 = time.perf_counter()
+    try:
+        q_emb = text_batcher.encode("warmup").tolist()
+        if collection().count():
+            collection().query(query_embeddings=[q_emb], n_results=1, include=["documents"])
+        _readiness.update(ready=True, error=None)
+    except Exception as e:
+        _readiness.update(ready=False, error=f"{type(e).__name__}: {e}")
+    _readiness["warmup_s"] = round(time.perf_counter() - t0, 3)
+
+@app.get("/ready")
+def ready():
+    """200 once this worker has warmed up, 503 otherwise (for launchers and load balancers)."""
+    return JSONResponse({**_readiness, "pid": os.getpid()}, status_code=200 if _readiness["ready"] else 503)
+
+@app.get("/rag/stats")
+def rag_stats():
+    return {
+        "embed_batcher": text_batcher.stats(),
+        "embedding_cache": emb_cache.stats(),
+        "results_cache": results_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "single_flight": flights.stats(),
+        "encoders": registry_stats(),
+    }
+
+async def upstream_tokens(messages, temperature):
+    stream = await openai_client().chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = getattr(chunk.choices[0], "delta", None)
+            if delta and delta.content:
+                yield delta.content
+    finally:
+        # when the last listener disconnects the flight is cancelled; closing
+        # the response aborts the upstream completion instead of draining it
+        await stream.close()
+
+async def replay(tokens):
+    for t in tokens:
+        yield {"event": "token", "data": t}
+    yield {"event": "done", "data": "[DONE]"}
 
 @app.get("/rag/stream")
-async def rag_stream(q: str = Query(...), top_k: int = Query(4), temperature: float = Query(0.2)):
-    contexts = retrieve(q, top_k)
+async def rag_stream(q: str = Query(...), top_k: int = Query(4), temperature: float = Query(0.2),
+                     cache: bool = Query(True, description="false bypasses the answer cache and "
+                                                           "in-flight sharing: a fresh completion")):
+    contexts = await aretrieve(q, top_k)
+    chunk_ids = [c["id"] for c in contexts]
+    q_emb = None
+    if cache and answer_cache.near_dup:
+        q_emb = await asyncio.get_running_loop().run_in_executor(retrieve_pool, embed_query, q)
+    if cache:
+        tokens = answer_cache.get(q, chunk_ids, OPENAI_MODEL, temperature, q_emb)
+        if tokens is not None:
+            return EventSourceResponse(replay(tokens))
+
     context_blob = "\n\n".join([
         f"({c['meta'].get('source', 'source')}#{c['meta'].get('chunk', 0)})\n{c['text']}"
         for c in contexts
@@ -41,17 +195,24 @@ async def rag_stream(q: str = Query(...), top_k: int = Query(4), temperature: fl
         {"role": "user", "content": f"Query: {q}\n\nContexts:\n{context_blob}"}
     ]
 
+    async def generate():
+        tokens = []
+        async for t in upstream_tokens(messages, temperature):
+            tokens.append(t)
+            yield t
+        # only complete answers are cached; a cancelled stream never gets here
+        answer_cache.put(q, chunk_ids, OPENAI_MODEL, temperature, tokens, q_emb)
+
     async def event_generator():
-        stream = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            temperature=temperature,
-            stream=True,
-        )
-        for chunk in stream:
-            delta = getattr(chunk.choices[0], "delta", None)
-            if delta and delta.content:
-                yield {"event": "token", "data": delta.content}
+        if cache:
+            # identical in-flight questions share one upstream completion
+            key = answer_key(q, chunk_ids, OPENAI_MODEL, temperature)
+            tokens = flights.subscribe(key, generate)
+        else:
+            # a bypass neither joins another request's stream nor writes the cache
+            tokens = upstream_tokens(messages, temperature)
+        async for t in tokens:
+            yield {"event": "token", "data": t}
         yield {"event": "done", "data": "[DONE]"}
 
     return EventSourceResponse(event_generator())
@@ -0,0 +1,82 @@
+# backend/rag/singleflight.py
+"""Single-flight sharing of identical upstream token streams.
+
+The first subscriber for a key starts the producer; later subscribers for
+the same key attach to it, get every token emitted so far replayed, then
+follow the live tail. The producer is cancelled once nobody is listening.
+"""
+from __future__ import annotations
+import asyncio
+from typing import AsyncIterator, Callable, Hashable
+
+
+class _Flight:
+    def __init__(self):
+        self.tokens: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()   # replaced after every update
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class StreamFlights:
+    def __init__(self):
+        self._flights: dict = {}
+        self.started = 0
+        self.joined = 0
+
+    async def subscribe(self, key: Hashable,
+                        start: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, start))
+            self.started += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                if i < len(flight.tokens):
+                    i += 1
+                    yield flight.tokens[i - 1]
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # last listener left: abort upstream, and make sure a new
+                # request for this key starts fresh instead of joining a dying flight
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _produce(self, key, flight: _Flight, start):
+        try:
+            async for token in start():
+                flight.tokens.append(token)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("upstream stream cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.notify()
+
+    def stats(self) -> dict:
+        return {"active": len(self._flights), "started": self.started, "joined": self.joined}
@@ -0,0 +1,60 @@
+# backend/text_search_api.py
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from backend.rag import rag_service
+from backend.rag.attr_index import FIELDS as FILTER_FIELDS
+
+# queries per encode + index.search; each chunk is streamed as soon as it is done
+BATCH_CHUNK = int(os.getenv("SEARCH_BATCH_CHUNK", "256"))
+BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "10000"))
+
+router = APIRouter()
+
+
+class TextBatchRequest(BaseModel):
+    queries: List[str] = Field(..., description="search texts, answered in this order")
+    top_k: int = 8
+    include: Optional[Dict[str, List[str]]] = None
+    exclude: Optional[Dict[str, List[str]]] = None
+
+
+def ndjson(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@router.post("/text-search/batch")
+async def text_search_batch_endpoint(req: TextBatchRequest) -> StreamingResponse:
+    """
+    Runs many catalog text searches; streams one NDJSON line per query:
+    {"index": 0, "query": "red blazer", "results": [{"id": "1", "name": ..., "score": 0.31}, ...]}
+    """
+    if len(req.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per request.")
+    unknown = {*(req.include or {}), *(req.exclude or {})} - set(FILTER_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown filter attribute(s): {', '.join(sorted(unknown))}; "
+                                                    f"expected {', '.join(FILTER_FIELDS)}.")
+
+    async def lines():
+        for start in range(0, len(req.queries), BATCH_CHUNK):
+            chunk = req.queries[start:start + BATCH_CHUNK]
+            try:
+                results = await run_in_threadpool(rag_service.text_search_batch, chunk, req.top_k,
+                                                  req.include, req.exclude)
+            except Exception as e:
+                for i, q in enumerate(chunk, start):
+                    yield ndjson({"index": i, "query": q, "error": f"{type(e).__name__}: {e}"})
+                continue
+            for i, (q, recs) in enumerate(zip(chunk, results), start):
+                yield ndjson({"index": i, "query": q, "results": recs})
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,21 +1,44 @@
 # frontend/main.py
 from fastapi import FastAPI, Form, Request, UploadFile, File, Query
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 import os
+import time
 import httpx  # pip install httpx
 
+# one pooled client to the RAG backend per process (see rag_client below)
+_rag_client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _rag_client
+    # each worker warms up before it accepts its first request
+    await run_in_threadpool(warmup)
+    yield
+    if _rag_client is not None:
+        await _rag_client.aclose()
+        _rag_client = None
+
 # --- Create app FIRST ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # --- Mount static and include JSON image-search BEFORE defining other routes ---
 from backend.image_search_api import router as image_search_router
+from backend.text_search_api import router as text_search_router
+from backend.admin_api import router as admin_router
+from backend.rag import rag_service
+from backend.rag.image_search import engine as image_engine
 app.mount("/images", StaticFiles(directory="backend/rag/images"), name="images")
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 app.include_router(image_search_router)
+app.include_router(text_search_router)
+app.include_router(admin_router)
 
 # --- Resolve paths / templates ---
 HERE = Path(__file__).resolve()
@@ -32,8 +55,81 @@ from backend.agents.moodboard_agent import MoodboardAgent
 # If you STILL had a legacy HTML /image-search route here, REMOVE it
 # (Your new JSON /image-search is already included via router above.)
 
+# one agent per process so its enrichment cache and HTTP client are reused; created
+# on first use, so a preloading gunicorn master opens no sqlite connection to fork
+_moodboard_agent: Optional[MoodboardAgent] = None
+
+def moodboard_agent() -> MoodboardAgent:
+    global _moodboard_agent
+    if _moodboard_agent is None:
+        _moodboard_agent = MoodboardAgent()
+    return _moodboard_agent
+
 # --- RAG API Configuration ---
-RAG_API_URL = "http://127.0.0.1:8000"
+RAG_API_URL = os.getenv("RAG_API_URL", "http://127.0.0.1:8000")
+# connect fails fast; read is the longest silence allowed between streamed chunks
+RAG_PROXY_CONNECT_TIMEOUT_S = float(os.getenv("RAG_PROXY_CONNECT_TIMEOUT_S", "5"))
+RAG_PROXY_READ_TIMEOUT_S = float(os.getenv("RAG_PROXY_READ_TIMEOUT_S", "60"))
+RAG_PROXY_MAX_CONNECTIONS = int(os.getenv("RAG_PROXY_MAX_CONNECTIONS", "100"))
+RAG_PROXY_MAX_KEEPALIVE = int(os.getenv("RAG_PROXY_MAX_KEEPALIVE", "20"))
+
+def rag_client() -> httpx.AsyncClient:
+    """Keep-alive pooled client shared by all proxy requests; closed on shutdown."""
+    global _rag_client
+    if _rag_client is None:
+        _rag_client = httpx.AsyncClient(
+            base_url=RAG_API_URL,
+            timeout=httpx.Timeout(RAG_PROXY_READ_TIMEOUT_S, connect=RAG_PROXY_CONNECT_TIMEOUT_S,
+                                  pool=RAG_PROXY_CONNECT_TIMEOUT_S),
+            limits=httpx.Limits(max_connections=RAG_PROXY_MAX_CONNECTIONS,
+                                max_keepalive_connections=RAG_PROXY_MAX_KEEPALIVE),
+        )
+    return _rag_client
+
+def _sse_error(message: str) -> bytes:
+    return f"event: error\ndata: {message}\n\n".encode("utf-8")
+
+# --- Preload / warmup / readiness ---
+def preloaded_app():
+    """App factory for `main.py --prod`: load the CLIP models and map the indexes
+    once in the gunicorn master, so forked workers share them copy-on-write."""
+    rag_service.preload()
+    try:
+        image_engine()
+    except FileNotFoundError:
+        pass   # no image index yet; /image-search reports it
+    return app
+
+_readiness = {"ready": False, "warmup_s": None, "error": None, "image_index": None}
+
+def warmup():
+    """One text and one image search per worker, so lazy init isn't paid by a user."""
+    t0 = time.perf_counter()
+    try:
+        rag_service.warmup()
+        try:
+            image_engine().warmup()
+            _readiness["image_index"] = "ok"
+        except FileNotFoundError:
+            _readiness["image_index"] = "missing"
+        _readiness.update(ready=True, error=None)
+    except Exception as e:
+        _readiness.update(ready=False, error=f"{type(e).__name__}: {e}")
+    _readiness["warmup_s"] = round(time.perf_counter() - t0, 3)
+
+@app.get("/ready")
+async def ready():
+    """200 once this worker is warm, the catalog index is published and the RAG backend
+    reports ready; 503 otherwise (e.g. while the first index build runs in the background)."""
+    try:
+        backend_ready = (await rag_client().get("/ready", timeout=2)).status_code == 200
+    except httpx.HTTPError:
+        backend_ready = False
+    text_index = await run_in_threadpool(rag_service.index_status)
+    ok = _readiness["ready"] and backend_ready and text_index["generation"] is not None
+    return JSONResponse({**_readiness, "backend_ready": backend_ready,
+                         "text_index_generation": text_index["generation"], "pid": os.getpid()},
+                        status_code=200 if ok else 503)
 
 @app.get("/", response_class=HTMLResponse)
 async def landing(request: Request):
@@ -41,18 +137,35 @@ async def landing(request: Request):
 
 # --- RAG Streaming Proxy Endpoint ---
 @app.get("/rag-stream-proxy")
-async def rag_stream_proxy(q: str = Query(...)):
+async def rag_stream_proxy(q: str = Query(...), top_k: Optional[int] = Query(None),
+                           temperature: Optional[float] = Query(None), cache: Optional[bool] = Query(None)):
+    # unset options are left to the backend's defaults
+    params = {"q": q, "top_k": top_k, "temperature": temperature,
+              "cache": None if cache is None else str(cache).lower()}
+    params = {k: v for k, v in params.items() if v is not None}
+
     async def stream_generator():
+        # Chunks are pulled from upstream only as fast as the browser takes
+        # them, so at most one is buffered here. When the browser goes away
+        # Starlette cancels this generator; leaving the `async with` closes the
+        # upstream connection, which makes the backend abort its LLM call.
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("GET", f"{RAG_API_URL}/rag/stream", params={"q": q}) as response:
-                    async for chunk in response.aiter_bytes():
-                        yield chunk
+            async with rag_client().stream("GET", "/rag/stream", params=params) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield _sse_error(f"RAG service returned {response.status_code}: {response.text[:200]}")
+                    return
+                async for chunk in response.aiter_bytes():
+                    yield chunk
         except httpx.ConnectError as e:
-            error_message = f"event: error\ndata: Cannot connect to RAG service: {e}\n\n"
-            yield error_message.encode('utf-8')
+            yield _sse_error(f"Cannot connect to RAG service: {e}")
+        except httpx.TimeoutException:
+            yield _sse_error("RAG service timed out")
+        except httpx.HTTPError as e:
+            yield _sse_error(f"RAG stream failed: {e}")
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    return StreamingResponse(stream_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # --- Text→Fashion ---
 @app.post("/text-to-fashion", response_class=HTMLResponse)
@@ -68,8 +181,7 @@ async def text_to_fashion(description: str = Form(...)):
 @app.post("/moodboard-tags", response_class=HTMLResponse)
 async def moodboard_tags(style_description: str = Form(...)):
     try:
-        agent = MoodboardAgent()
-        tags = agent.run(style_description)
+        tags = await moodboard_agent().arun(style_description)
         body = f"<h2>Suggested Hashtags:</h2><pre>{tags}</pre>"
     except Exception as e:
         body = f"<h2>Oops</h2><pre>{e}</pre>"
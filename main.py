@@ -1,24 +1,116 @@
+"""Start the RAG backend and the web frontend.
+
+    python main.py          # development: one auto-reloading uvicorn worker per app
+    python main.py --prod   # gunicorn: N workers per app, models preloaded before fork
+
+The frontend is only started once the backend answers /ready, and the
+script returns control (prints the URL) once the frontend does too.
+--prod needs gunicorn, so Linux/macOS only.
+"""
+import argparse
+import os
+import signal
 import subprocess
+import sys
 import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8000"))
+FRONTEND_PORT = int(os.getenv("FRONTEND_PORT", "8001"))
+HOST = os.getenv("HOST", "127.0.0.1")
+CPUS = os.cpu_count() or 1
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", str(max(1, CPUS // 4))))
+FRONTEND_WORKERS = int(os.getenv("FRONTEND_WORKERS", str(max(1, CPUS // 4))))
+READY_TIMEOUT_S = float(os.getenv("READY_TIMEOUT_S", "600"))
+# gunicorn kills a worker that is silent this long (includes its warmup)
+WORKER_TIMEOUT_S = int(os.getenv("WORKER_TIMEOUT_S", "120"))
+
+
+def dev_cmd(app: str, port: int) -> list:
+    return ["uvicorn", app, "--reload", "--host", HOST, "--port", str(port)]
+
+
+def prod_cmd(app: str, port: int, workers: int) -> list:
+    # --preload imports the app (and loads its models) once in the master;
+    # forked workers share those pages and only run their own warmup
+    return ["gunicorn", app, "--preload", "--workers", str(workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"{HOST}:{port}", "--timeout", str(WORKER_TIMEOUT_S),
+            "--graceful-timeout", "30", "--keep-alive", "5"]
+
+
+def wait_ready(name: str, port: int, proc: subprocess.Popen) -> bool:
+    """Poll http://HOST:port/ready until it returns 200, the process exits or READY_TIMEOUT_S passes."""
+    url = f"http://{HOST}:{port}/ready"
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < READY_TIMEOUT_S:
+        if proc.poll() is not None:
+            print(f"{name} exited with code {proc.returncode}")
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=2) as r:
+                if r.status == 200:
+                    print(f"{name} ready after {time.monotonic() - t0:.1f}s")
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass   # not listening yet, or 503 while warming up
+        time.sleep(0.5)
+    print(f"{name} not ready after {READY_TIMEOUT_S:.0f}s")
+    return False
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--prod", action="store_true", help="multi-worker gunicorn with preload")
+    args = ap.parse_args(argv)
+    # `kill`/systemd stop the launcher with SIGTERM: unwind so the apps are stopped too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    env = dict(os.environ)
+    if args.prod:
+        # one torch/faiss thread pool per worker: split the cores instead of oversubscribing
+        env.setdefault("OMP_NUM_THREADS", str(max(1, CPUS // (BACKEND_WORKERS + FRONTEND_WORKERS))))
+        backend_cmd = prod_cmd("backend.rag.server:preloaded_app()", BACKEND_PORT, BACKEND_WORKERS)
+        frontend_cmd = prod_cmd("frontend.main:preloaded_app()", FRONTEND_PORT, FRONTEND_WORKERS)
+    else:
+        backend_cmd = dev_cmd("backend.rag.server:app", BACKEND_PORT)
+        frontend_cmd = dev_cmd("frontend.main:app", FRONTEND_PORT)
+    env.setdefault("RAG_API_URL", f"http://{HOST}:{BACKEND_PORT}")
+
+    mode = f"{BACKEND_WORKERS}+{FRONTEND_WORKERS} workers" if args.prod else "dev, --reload"
+    print(f"--- Starting RAG backend on port {BACKEND_PORT} ({mode}) ---")
+    procs = [subprocess.Popen(backend_cmd, env=env)]
+    try:
+        if not wait_ready("Backend", BACKEND_PORT, procs[0]):
+            return 1
+        print(f"\n--- Starting frontend on port {FRONTEND_PORT} ---")
+        procs.append(subprocess.Popen(frontend_cmd, env=env))
+        if not wait_ready("Frontend", FRONTEND_PORT, procs[1]):
+            return 1
+        print(f"\nOpen http://{HOST}:{FRONTEND_PORT}")
+        # run until either app stops (or Ctrl+C), then stop the other
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        print("\n--- Stopping servers ---")
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=35)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
 
-# Start backend on port 8000
-# The correct file is server.py, not rag_service.py
-print("--- Starting RAG Backend Server on port 8000 ---")
-backend = subprocess.Popen([
-    "uvicorn", "backend.rag.server:app", "--reload", "--port", "8000"
-])
-
-# Give backend a moment to spin up before starting frontend
-print("Waiting for backend to initialize...")
-time.sleep(5) # Giving it a few seconds to load models
-
-# Start frontend on port 8001 (blocks until stopped)
-print("\n--- Starting Frontend Server on port 8001 ---")
-# Use subprocess.run for the frontend so the script waits here
-frontend_process = subprocess.run([
-    "uvicorn", "frontend.main:app", "--reload", "--port", "8001"
-])
-
-# Clean up backend when frontend stops (when you press Ctrl+C)
-print("\n--- Frontend stopped, terminating backend. ---")
-backend.terminate()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
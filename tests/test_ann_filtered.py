@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+from backend.rag import ann_index
+
+N, D, K = 2000, 32, 10
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((N, D)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    q = x[:5] + 0.05 * rng.standard_normal((5, D)).astype("float32")
+    return x, q
+
+
+@pytest.fixture(scope="module")
+def pq_data():
+    # pq needs 2^8 * 39 training points
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal((10000, 16)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x, x[:5].copy(), ann_index.build_index(x, kind="pq")
+
+
+def brute(x, q, allowed, k=K):
+    scores = q @ x.T
+    scores[:, ~allowed] = -np.inf
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def mask_every(n, size=N):
+    allowed = np.zeros(size, dtype=bool)
+    allowed[::n] = True
+    return allowed
+
+
+def only_allowed(I, allowed):
+    hits = I[I != -1]
+    return len(hits) > 0 and allowed[hits].all()
+
+
+@pytest.fixture
+def exact_below(monkeypatch):
+    def set_limits(max_rows, fraction):
+        monkeypatch.setattr(ann_index, "FILTER_EXACT_MAX", max_rows)
+        monkeypatch.setattr(ann_index, "FILTER_EXACT_FRACTION", fraction)
+    return set_limits
+
+
+def test_empty_filter(data):
+    x, q = data
+    index = ann_index.build_index(x, kind="flat")
+    D, I, strategy = ann_index.search_filtered(index, q, K, np.zeros(N, dtype=bool))
+    assert strategy == "empty"
+    assert (I == -1).all()
+
+
+def test_small_filter_is_exact(data, exact_below):
+    x, q = data
+    exact_below(1000, 0.0)
+    index = ann_index.build_index(x, kind="hnsw")
+    ann_index.enable_reconstruct(index)
+    allowed = mask_every(7)
+    D, I, strategy = ann_index.search_filtered(index, q, K, allowed)
+    assert strategy == "exact"
+    np.testing.assert_array_equal(I, brute(x, q, allowed))
+    np.testing.assert_allclose(D[:, 0], (q * x[I[:, 0]]).sum(1), rtol=1e-5)
+
+
+def test_wide_filter_uses_selector(data, exact_below):
+    x, q = data
+    exact_below(0, 0.0)
+    index = ann_index.build_index(x, kind="flat")
+    allowed = mask_every(2)
+    D, I, strategy = ann_index.search_filtered(index, q, K, allowed)
+    assert strategy == "ann"
+    np.testing.assert_array_equal(I, brute(x, q, allowed))
+
+
+@pytest.mark.parametrize("kind", ["hnsw", "ivf", "sq8"])
+def test_selector_only_returns_allowed(data, exact_below, kind):
+    x, q = data
+    exact_below(0, 0.0)
+    index = ann_index.build_index(x, kind=kind)
+    vectors = x if ann_index.needs_vectors(kind) else None
+    allowed = mask_every(3)
+    D, I, strategy = ann_index.search_filtered(index, q, K, allowed, vectors=vectors)
+    assert strategy == "ann"
+    assert only_allowed(I, allowed)
+
+
+def test_exclude_semantics_through_mask(data, exact_below):
+    x, q = data
+    exact_below(0, 0.0)
+    index = ann_index.build_index(x, kind="flat")
+    # dropping each query's nearest neighbour must surface the next one
+    allowed = np.ones(N, dtype=bool)
+    nearest = brute(x, q, allowed)[:, 0]
+    allowed[nearest] = False
+    D, I, _ = ann_index.search_filtered(index, q, K, allowed)
+    assert not np.isin(I, nearest).any()
+    np.testing.assert_array_equal(I, brute(x, q, allowed))
+
+
+def test_pq_without_vectors_post_filters(pq_data, exact_below, monkeypatch):
+    x, q, index = pq_data
+    assert ann_index.index_kind(index) == "pq"
+    exact_below(0, 0.0)
+    calls = []
+    real = ann_index._post_filtered
+    monkeypatch.setattr(ann_index, "_post_filtered", lambda *a, **kw: calls.append(1) or real(*a, **kw))
+    allowed = mask_every(4, len(x))
+    D, I, strategy = ann_index.search_filtered(index, q, K, allowed)
+    assert strategy == "ann" and calls
+    assert only_allowed(I, allowed)
+    assert (I != -1).all()
+
+
+def test_pq_with_vectors_scores_exactly(pq_data, exact_below):
+    x, q, index = pq_data
+    exact_below(0, 0.0)
+    allowed = mask_every(4, len(x))
+    D, I, strategy = ann_index.search_filtered(index, q, K, allowed, vectors=x)
+    assert strategy == "exact"
+    np.testing.assert_array_equal(I, brute(x, q, allowed))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from backend.rag.attr_index import AttributeIndex, split_values, write_attr_index
+
+ROWS = [
+    {"category": "Dress", "style_tags": "#red #boho", "occasions": "party, wedding"},
+    {"category": "blazer", "style_tags": "#navy", "occasions": "work"},
+    {"category": "dress", "style_tags": "#Navy,#minimal", "occasions": "work, party"},
+    {"category": "skirt", "style_tags": "", "occasions": ""},
+]
+
+
+@pytest.fixture
+def attrs(tmp_path):
+    write_attr_index(tmp_path / "attrs-1", ROWS, n_ids=len(ROWS))
+    return AttributeIndex(tmp_path / "attrs-1")
+
+
+def ids(mask):
+    return np.flatnonzero(mask).tolist()
+
+
+def test_split_values_normalizes():
+    assert split_values("#Red  #boho", "tags") == {"red", "boho"}
+    assert split_values("party, Black Tie ", "list") == {"party", "black tie"}
+    assert split_values("Dress", "single") == {"dress"}
+    assert split_values("", "tags") == set()
+
+
+def test_no_filter_allows_everything(attrs):
+    assert ids(attrs.mask()) == [0, 1, 2, 3]
+
+
+def test_include_any_value_of_an_attribute(attrs):
+    assert ids(attrs.mask(include={"category": ["dress"]})) == [0, 2]
+    assert ids(attrs.mask(include={"category": ["dress", "skirt"]})) == [0, 2, 3]
+    # a bare string is one value, not its characters
+    assert ids(attrs.mask(include={"category": "DRESS"})) == [0, 2]
+
+
+def test_include_every_attribute(attrs):
+    assert ids(attrs.mask(include={"category": ["dress"], "occasions": ["work"]})) == [2]
+
+
+def test_exclude_any_value(attrs):
+    assert ids(attrs.mask(exclude={"style_tags": ["#navy"]})) == [0, 3]
+    assert ids(attrs.mask(exclude={"style_tags": ["navy", "red"]})) == [3]
+
+
+def test_include_and_exclude(attrs):
+    mask = attrs.mask(include={"occasions": ["party", "work"]}, exclude={"style_tags": ["minimal"]})
+    assert ids(mask) == [0, 1]
+
+
+def test_unknown_value_matches_nothing(attrs):
+    assert ids(attrs.mask(include={"category": ["coat"]})) == []
+    assert ids(attrs.mask(exclude={"category": ["coat"]})) == [0, 1, 2, 3]
+
+
+def test_unknown_attribute_raises(attrs):
+    with pytest.raises(KeyError):
+        attrs.mask(include={"colour": ["red"]})
+
+
+def test_explicit_ids(tmp_path):
+    write_attr_index(tmp_path / "a", ROWS[:2], n_ids=10, ids=[7, 3])
+    attrs = AttributeIndex(tmp_path / "a")
+    assert ids(attrs.mask(include={"category": ["blazer"]})) == [3]
+    assert len(attrs.mask()) == 10
+    assert attrs.values("category") == {"dress": 1, "blazer": 1}
+
+
+def test_postings_must_match_dictionary(tmp_path):
+    write_attr_index(tmp_path / "a", ROWS, n_ids=len(ROWS))
+    np.save(tmp_path / "a.npy", np.arange(3, dtype="int64"))
+    with pytest.raises(ValueError):
+        AttributeIndex(tmp_path / "a")
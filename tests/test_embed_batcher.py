@@ -0,0 +1,88 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from backend.rag.embed_batcher import MicroBatcher
+
+
+class Recorder:
+    def __init__(self, delay_s=0.0, fail_on=None):
+        self.calls = []
+        self.delay_s = delay_s
+        self.fail_on = fail_on
+
+    def __call__(self, items):
+        self.calls.append(list(items))
+        if self.fail_on is not None and self.fail_on in items:
+            raise ValueError(f"bad item {self.fail_on}")
+        time.sleep(self.delay_s)
+        return np.array([[float(len(str(i))), float(hash(i) % 97)] for i in items])
+
+
+def encode_concurrently(batcher, items, kinds=None):
+    out, errors = {}, {}
+    barrier = threading.Barrier(len(items))
+
+    def worker(i, item):
+        barrier.wait()
+        try:
+            out[i] = batcher.encode(item, kind=kinds[i] if kinds else "text")
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i, it)) for i, it in enumerate(items)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return out, errors
+
+
+def test_each_caller_gets_its_own_row():
+    enc = Recorder()
+    batcher = MicroBatcher(enc, max_batch=64, max_wait_ms=50)
+    items = [f"query {i}" for i in range(20)]
+    out, errors = encode_concurrently(batcher, items)
+    assert not errors
+    for i, item in enumerate(items):
+        np.testing.assert_array_equal(out[i], enc([item])[0])
+
+
+def test_concurrent_calls_are_coalesced():
+    enc = Recorder()
+    batcher = MicroBatcher(enc, max_batch=64, max_wait_ms=50)
+    encode_concurrently(batcher, [f"q{i}" for i in range(16)])
+    stats = batcher.stats()
+    assert stats["items"] == 16
+    assert stats["batches"] < 16
+    assert max(len(c) for c in enc.calls) > 1
+
+
+def test_max_batch_is_respected():
+    enc = Recorder(delay_s=0.01)
+    batcher = MicroBatcher(enc, max_batch=4, max_wait_ms=50)
+    out, _ = encode_concurrently(batcher, [f"q{i}" for i in range(12)])
+    assert len(out) == 12
+    assert max(len(c) for c in enc.calls) <= 4
+
+
+def test_kinds_are_never_mixed():
+    enc = Recorder()
+    batcher = MicroBatcher(enc, max_batch=64, max_wait_ms=50)
+    items = [f"t{i}" if i % 2 else f"img{i}" for i in range(10)]
+    kinds = ["text" if i % 2 else "image" for i in range(10)]
+    out, errors = encode_concurrently(batcher, items, kinds)
+    assert not errors and len(out) == 10
+    for call in enc.calls:
+        assert len({c.startswith("img") for c in call}) == 1
+
+
+def test_encode_error_goes_to_that_batch_only():
+    enc = Recorder(fail_on="bad")
+    batcher = MicroBatcher(enc, max_batch=64, max_wait_ms=0)
+    with pytest.raises(ValueError, match="bad item"):
+        batcher.encode("bad")
+    # the scheduler thread survives and keeps serving
+    np.testing.assert_array_equal(batcher.encode("good"), enc(["good"])[0])
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from backend.agents.enrichment_cache import EnrichmentCache, cache_key
+
+
+def test_roundtrip(tmp_path):
+    cache = EnrichmentCache(tmp_path / "c.sqlite3")
+    key = cache_key("  A Red   Dress ", "1", "m")
+    assert key == cache_key("a red dress", "1", "m")
+    assert cache.get(key) is None
+    cache.put(key, "Category: dress")
+    assert cache.get(key) == "Category: dress"
+    assert cache.stats()["entries"] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_opens_its_own_connection(tmp_path):
+    cache = EnrichmentCache(tmp_path / "c.sqlite3")
+    cache.put("k", "parent")
+    parent_db = cache._db
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:   # child: must not touch the inherited connection
+        ok = cache._db is not parent_db and cache.get("k") == "parent"
+        cache.put("k2", "child")
+        os.write(w, b"1" if ok else b"0")
+        os._exit(0)
+    os.close(w)
+    assert os.read(r, 1) == b"1"
+    os.waitpid(pid, 0)
+    assert cache._db is parent_db
+    assert cache.get("k2") == "child"
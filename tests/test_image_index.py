@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+pytest.importorskip("faiss")
+from PIL import Image
+
+from backend.bench.suite import generate_catalog, install_stub
+from backend.rag import image_index
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    install_stub()
+    monkeypatch.setattr(image_index, "INDEX_TYPE", "ivf")
+    paths = generate_catalog(tmp_path, 20, 0)
+    return paths["images"], tmp_path / "img_index"
+
+
+def meta(out):
+    return json.loads((out / "meta.json").read_text())
+
+
+def test_meta_json_has_no_item_lists(catalog):
+    img, out = catalog
+    image_index.main(img_dir=str(img), out_dir=str(out))
+    m = meta(out)
+    assert m["items"] == 20 and m["failed"] == 0
+    assert len(image_index.load_manifest(str(out))["items"]) == 20
+
+
+def test_flat_fallback_upgrades_once_trainable(catalog):
+    img, out = catalog
+    image_index.main(img_dir=str(img), out_dir=str(out))
+    assert meta(out)["index_type"] == "flat"   # 20 vectors can't train ivf
+    assert image_index.main(img_dir=str(img), out_dir=str(out))["indexed"] == 0
+
+    for i in range(40):
+        Image.new("RGB", (32, 32), (i * 5, 255 - i * 5, i)).save(img / f"extra_{i}.jpg")
+    image_index.main(img_dir=str(img), out_dir=str(out))
+    assert meta(out)["index_type"] == "ivf"
+    assert meta(out)["items"] == 60
+    assert image_index.main(img_dir=str(img), out_dir=str(out))["indexed"] == 0
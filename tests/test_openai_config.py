@@ -0,0 +1,13 @@
+from backend.openai_config import DEFAULT_BASE_URL, openai_base_url
+
+
+def test_unset_and_empty_mean_the_public_endpoint(monkeypatch):
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    assert openai_base_url() == DEFAULT_BASE_URL
+    monkeypatch.setenv("OPENAI_BASE_URL", "")
+    assert openai_base_url() == DEFAULT_BASE_URL
+
+
+def test_override(monkeypatch):
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9999/v1")
+    assert openai_base_url() == "http://127.0.0.1:9999/v1"
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+from backend.rag.query_cache import LRUCache, VersionedCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  Red   Blazer\n") == "red blazer"
+
+
+def test_lru_get_put():
+    c = LRUCache(1 << 20)
+    assert c.get("a") is None
+    c.put("a", 1)
+    assert c.get("a") == 1
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+
+def test_lru_evicts_least_recently_used_within_budget():
+    c = LRUCache(1000)
+    for k in "abc":
+        c.put(k, None, nbytes=250)
+    c.get("a")          # "b" is now the oldest
+    c.put("d", None, nbytes=250)
+    assert "b" not in c and "a" in c and "d" in c
+    assert c.stats()["bytes"] <= 1000
+    assert c.stats()["evictions"] == 1
+
+
+def test_lru_skips_values_larger_than_budget():
+    c = LRUCache(100)
+    c.put("big", np.zeros(1000, dtype="float32"))
+    assert "big" not in c and c.stats()["bytes"] == 0
+
+
+def test_lru_ttl():
+    c = LRUCache(1 << 20, ttl_s=0.05)
+    c.put("a", 1)
+    assert c.get("a") == 1
+    time.sleep(0.08)
+    assert c.get("a") is None
+    assert len(c) == 0
+
+
+def test_lru_replace_keeps_byte_count():
+    c = LRUCache(1000)
+    c.put("a", None, nbytes=300)
+    c.put("a", None, nbytes=100)
+    assert len(c) == 1
+    assert c.stats()["bytes"] < 300
+
+
+def test_versioned_cache_drops_everything_on_version_change():
+    version = [1]
+    c = VersionedCache(1 << 20, lambda: version[0], check_interval_s=0)
+    c.put("a", 1)
+    assert c.get("a") == 1
+    version[0] = 2
+    assert c.get("a") is None
+    assert c.stats()["invalidations"] == 1
+    c.put("a", 2)
+    assert c.get("a") == 2
+
+
+def test_versioned_cache_rechecks_at_most_every_interval():
+    version, reads = [1], []
+
+    def version_fn():
+        reads.append(1)
+        return version[0]
+
+    c = VersionedCache(1 << 20, version_fn, check_interval_s=60)
+    c.put("a", 1)
+    version[0] = 2
+    # within the interval the old entry is still served
+    assert c.get("a") == 1
+    assert len(reads) == 1
+
+
+def test_versioned_cache_first_version_is_not_an_invalidation():
+    c = VersionedCache(1 << 20, lambda: None, check_interval_s=0)
+    c.put("a", 1)
+    assert c.get("a") == 1
+    assert c.stats()["invalidations"] == 0
@@ -0,0 +1,52 @@
+import pytest
+from fastapi.testclient import TestClient
+from sse_starlette.sse import AppStatus
+
+from backend.rag import server
+from backend.rag.answer_cache import AnswerCache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    async def aretrieve(q, k):
+        return [{"id": "doc#0", "text": "linen is breathable", "meta": {"source": "doc", "chunk": 0}}]
+
+    async def upstream_tokens(messages, temperature):
+        calls.append(messages)
+        for t in ("Linen", " works"):
+            yield t
+
+    monkeypatch.setattr(server, "aretrieve", aretrieve)
+    monkeypatch.setattr(server, "upstream_tokens", upstream_tokens)
+    monkeypatch.setattr(server, "answer_cache", AnswerCache(lambda: 0, near_dup=0))
+    # no models or Chroma to warm up
+    monkeypatch.setattr(server, "warmup", lambda: None)
+    # sse-starlette keeps one exit event per process, bound to the loop that made it
+    monkeypatch.setattr(AppStatus, "should_exit_event", None)
+    with TestClient(server.app) as c:   # one event loop for all requests
+        yield c, calls
+
+
+def tokens(body: str):
+    return [line[len("data: "):] for line in body.splitlines() if line.startswith("data: ")]
+
+
+def test_answer_is_cached_and_replayed(client):
+    c, calls = client
+    first = c.get("/rag/stream", params={"q": "summer fabric"})
+    second = c.get("/rag/stream", params={"q": "Summer  fabric"})
+    assert tokens(first.text) == tokens(second.text) == ["Linen", " works", "[DONE]"]
+    assert len(calls) == 1
+
+
+def test_cache_false_bypasses_cache_and_flights(client):
+    c, calls = client
+    started = server.flights.stats()["started"]
+    for _ in range(2):
+        r = c.get("/rag/stream", params={"q": "summer fabric", "cache": "false"})
+        assert tokens(r.text) == ["Linen", " works", "[DONE]"]
+    assert len(calls) == 2
+    assert server.flights.stats()["started"] == started
+    assert server.answer_cache.stats()["entries"] == 0
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from backend.rag.singleflight import StreamFlights
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(agen):
+    return [t async for t in agen]
+
+
+def gated_producer(tokens, gate, calls):
+    """start() factory: yields `tokens`, pausing on `gate` before the last one."""
+    async def start():
+        calls.append(1)
+        for i, t in enumerate(tokens):
+            if i == len(tokens) - 1:
+                await gate.wait()
+            yield t
+    return start
+
+
+def test_identical_requests_share_one_upstream():
+    async def main():
+        flights, gate, calls = StreamFlights(), asyncio.Event(), []
+        start = gated_producer(["a", "b", "c"], gate, calls)
+        first = asyncio.create_task(collect(flights.subscribe("k", start)))
+        await asyncio.sleep(0.01)
+        # joins late: "a" and "b" are replayed, "c" follows live
+        second = asyncio.create_task(collect(flights.subscribe("k", start)))
+        await asyncio.sleep(0.01)
+        gate.set()
+        return await first, await second, calls, flights.stats()
+
+    a, b, calls, stats = run(main())
+    assert a == b == ["a", "b", "c"]
+    assert len(calls) == 1
+    assert stats == {"active": 0, "started": 1, "joined": 1}
+
+
+def test_different_keys_do_not_share():
+    async def main():
+        flights, calls = StreamFlights(), []
+        gate = asyncio.Event()
+        gate.set()
+        start = gated_producer(["x"], gate, calls)
+        return await asyncio.gather(collect(flights.subscribe(1, start)),
+                                    collect(flights.subscribe(2, start))), calls
+
+    results, calls = run(main())
+    assert results == [["x"], ["x"]]
+    assert len(calls) == 2
+
+
+def test_finished_flight_is_not_joined():
+    async def main():
+        flights, calls = StreamFlights(), []
+        gate = asyncio.Event()
+        gate.set()
+        start = gated_producer(["x"], gate, calls)
+        await collect(flights.subscribe("k", start))
+        await collect(flights.subscribe("k", start))
+        return calls, flights.stats()
+
+    calls, stats = run(main())
+    assert len(calls) == 2
+    assert stats["joined"] == 0
+
+
+def test_one_subscriber_leaving_keeps_the_flight():
+    async def main():
+        flights, gate, calls = StreamFlights(), asyncio.Event(), []
+        start = gated_producer(["a", "b"], gate, calls)
+        stays = asyncio.create_task(collect(flights.subscribe("k", start)))
+        leaves = flights.subscribe("k", start)
+        assert await leaves.__anext__() == "a"
+        await leaves.aclose()
+        gate.set()
+        return await stays
+
+    assert run(main()) == ["a", "b"]
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def main():
+        flights, gate, calls = StreamFlights(), asyncio.Event(), []
+        cancelled = asyncio.Event()
+
+        async def start():
+            calls.append(1)
+            try:
+                yield "a"
+                await gate.wait()
+                yield "b"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        sub = flights.subscribe("k", start)
+        assert await sub.__anext__() == "a"
+        await sub.aclose()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        # a new request starts fresh instead of joining the dying flight
+        gate.set()
+        again = await collect(flights.subscribe("k", start))
+        return again, calls, flights.stats()
+
+    again, calls, stats = run(main())
+    assert again == ["a", "b"]
+    assert len(calls) == 2
+    assert stats["joined"] == 0
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        flights, gate = StreamFlights(), asyncio.Event()
+
+        async def start():
+            yield "a"
+            await gate.wait()
+            raise ValueError("upstream 500")
+
+        async def expect_error():
+            got = []
+            with pytest.raises(ValueError, match="upstream 500"):
+                async for t in flights.subscribe("k", start):
+                    got.append(t)
+            return got
+
+        first = asyncio.create_task(expect_error())
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(expect_error())
+        await asyncio.sleep(0.01)
+        gate.set()
+        return await first, await second, flights.stats()
+
+    first, second, stats = run(main())
+    assert first == second == ["a"]
+    assert stats["active"] == 0